@@ -0,0 +1,168 @@
+"""
+answer_cache.py — cache of RAGFlow chat completions
+
+Teachers in the same cluster ask near-identical questions, and without a
+cache each one goes through RAGFlow's LLM. Completions are cached under
+(chat_id, dataset scope, normalised question) with TTL + LRU eviction.
+Callers answering inside a conversation pass session_id, which confines the
+entry to that session.
+
+Lookup is an exact match on the normalised question. If
+ANSWER_CACHE_SIMILARITY is set (0 < t <= 1) and there is no exact match, the
+cache falls back to near-duplicates: questions sharing a word with the
+query are candidates, and the best one is returned if the Jaccard
+similarity of their character trigrams is at least t. Everything runs
+in process.
+
+invalidate_dataset() drops every entry whose scope includes the dataset, plus
+unscoped entries (those answered from the chat assistant's own datasets).
+"""
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Iterable, Optional, Tuple
+
+ANSWER_CACHE_SIZE       = int(os.getenv("ANSWER_CACHE_SIZE", "2000"))
+ANSWER_CACHE_TTL        = int(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0"))   # 0 = exact match only
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+_SPACES   = re.compile(r"\s+")
+
+Scope = Tuple[str, ...]
+Key   = Tuple[str, Scope, str]
+
+_lock     = threading.Lock()
+# key -> (expires_at, response, trigrams)
+_entries: "OrderedDict[Key, Tuple[float, Dict[str, Any], FrozenSet[str]]]" = OrderedDict()
+# (chat_id, scope) -> word -> keys, for near-duplicate candidates
+_postings: Dict[Tuple[str, Scope], Dict[str, set]] = {}
+_stats = {"exact_hits": 0, "similar_hits": 0, "misses": 0, "stores": 0, "invalidations": 0}
+
+
+def normalize_question(question: str) -> str:
+    text = _NON_WORD.sub(" ", (question or "").lower())
+    return _SPACES.sub(" ", text).strip()
+
+
+def _trigrams(text: str) -> FrozenSet[str]:
+    padded = f"  {text} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def _scope(dataset_ids: Optional[Iterable[str]]) -> Scope:
+    return tuple(sorted({str(d) for d in (dataset_ids or []) if d}))
+
+
+def _remove(key: Key) -> None:
+    """Drop an entry and its postings (caller holds the lock)."""
+    _entries.pop(key, None)
+    bucket = _postings.get(key[:2])
+    if bucket is None:
+        return
+    for word in key[2].split(" "):
+        keys = bucket.get(word)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del bucket[word]
+    if not bucket:
+        del _postings[key[:2]]
+
+
+def _owner(chat_id: str, session_id: str) -> str:
+    return f"{chat_id or ''}#{session_id}" if session_id else (chat_id or "")
+
+
+def lookup(
+    question: str,
+    chat_id: str,
+    dataset_ids: Optional[Iterable[str]] = None,
+    session_id: str = "",
+) -> Optional[Dict[str, Any]]:
+    """Return a cached completion for this question, or None."""
+    normalized = normalize_question(question)
+    if not normalized:
+        return None
+    key: Key = (_owner(chat_id, session_id), _scope(dataset_ids), normalized)
+    now = time.monotonic()
+
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                _entries.move_to_end(key)
+                _stats["exact_hits"] += 1
+                return entry[1]
+            _remove(key)
+
+        if ANSWER_CACHE_SIMILARITY > 0:
+            bucket = _postings.get(key[:2], {})
+            candidates = set()
+            for word in normalized.split(" "):
+                candidates |= bucket.get(word, set())
+
+            grams = _trigrams(normalized)
+            best_key, best_score = None, ANSWER_CACHE_SIMILARITY
+            for cand in candidates:
+                expires_at, _, cand_grams = _entries[cand]
+                if expires_at <= now:
+                    continue
+                score = len(grams & cand_grams) / len(grams | cand_grams)
+                if score >= best_score:
+                    best_key, best_score = cand, score
+            if best_key is not None:
+                _entries.move_to_end(best_key)
+                _stats["similar_hits"] += 1
+                return _entries[best_key][1]
+
+        _stats["misses"] += 1
+    return None
+
+
+def store(
+    question: str,
+    chat_id: str,
+    dataset_ids: Optional[Iterable[str]],
+    response: Dict[str, Any],
+    session_id: str = "",
+) -> None:
+    """Cache a completion response (callers should only store successful answers)."""
+    normalized = normalize_question(question)
+    if not normalized:
+        return
+    key: Key = (_owner(chat_id, session_id), _scope(dataset_ids), normalized)
+
+    with _lock:
+        _remove(key)
+        _entries[key] = (time.monotonic() + ANSWER_CACHE_TTL, response, _trigrams(normalized))
+        bucket = _postings.setdefault(key[:2], {})
+        for word in normalized.split(" "):
+            bucket.setdefault(word, set()).add(key)
+        _stats["stores"] += 1
+        while len(_entries) > ANSWER_CACHE_SIZE:
+            _remove(next(iter(_entries)))
+
+
+def invalidate_dataset(dataset_id: str) -> int:
+    """Drop answers that may have drawn on `dataset_id`. Returns how many were removed."""
+    with _lock:
+        stale = [k for k in _entries if not k[1] or dataset_id in k[1]]
+        for key in stale:
+            _remove(key)
+        _stats["invalidations"] += len(stale)
+    return len(stale)
+
+
+def answer_cache_stats() -> Dict[str, Any]:
+    with _lock:
+        lookups = _stats["exact_hits"] + _stats["similar_hits"] + _stats["misses"]
+        hits = _stats["exact_hits"] + _stats["similar_hits"]
+        return {
+            **_stats,
+            "size":       len(_entries),
+            "similarity": ANSWER_CACHE_SIMILARITY,
+            "hit_rate":   round(hits / lookups, 4) if lookups else 0.0,
+        }
@@ -14,7 +14,17 @@ import os
 import traceback
 from dotenv import load_dotenv
 from routes.public_auth_routes import public_auth_bp
-from routes.public_chat_routes import public_chat_bp
+from routes.public_chat_routes import public_chat_bp, session_cache_stats
+from answer_cache import answer_cache_stats
+from retrieval_cache import retrieval_cache_stats
+from lesson_cache import lesson_cache_stats
+from lesson_plan_writer import writer_stats as lesson_writer_stats
+from dataset_routing import routing_stats
+from upload_stream import upload_stats
+from ingest_jobs import ingest_stats
+from parse_tracker import tracker_stats as parse_tracker_stats
+from content_index import content_index_stats
+from upload_transactions import transaction_stats as upload_transaction_stats
 from lesson_planner_routes import lesson_bp
 # Load environment variables from root
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '../../.env'))
@@ -24,6 +34,11 @@ from flask_cors import CORS
 
 # Import RAGFlow routes
 from ragflow_routes import ragflow_bp
+import ragflow_client as rf
+from auth.hash_pool import hash_pool_stats
+from auth.token_cache import token_cache_stats
+from middleware.rate_limiter import limiter_stats
+from middleware.audit_logger import audit_stats
 
 # Initialize database
 from supabase_client import db
@@ -57,6 +72,30 @@ def health_check():
             'error': str(e),
         }), 500
 
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """In-process performance counters for monitoring."""
+    return jsonify({
+        'service': 'ai-personalization',
+        'ragflow_pool': rf.pool_stats(),
+        'credential_verifier': hash_pool_stats(),
+        'jwt_cache': token_cache_stats(),
+        'rate_limiter': limiter_stats(),
+        'audit_log': audit_stats(),
+        'chat_sessions': session_cache_stats(),
+        'answer_cache': answer_cache_stats(),
+        'retrieval_cache': retrieval_cache_stats(),
+        'lesson_cache': lesson_cache_stats(),
+        'lesson_plan_writer': lesson_writer_stats(),
+        'dataset_routing': routing_stats(),
+        'uploads': upload_stats(),
+        'ingest': ingest_stats(),
+        'parse_tracker': parse_tracker_stats(),
+        'content_index': content_index_stats(),
+        'upload_transactions': upload_transaction_stats(),
+    })
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Error Handlers
 # ─────────────────────────────────────────────────────────────────────────────
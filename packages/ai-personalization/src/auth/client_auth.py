@@ -1,7 +1,14 @@
 import os
-import bcrypt
+import hmac
+import atexit
+import hashlib
+import secrets
+import threading
+import time
+from collections import OrderedDict
 from supabase import create_client
 from dotenv import load_dotenv, find_dotenv
+from auth.hash_pool import check_secret
 
 # Load environment variables
 load_dotenv(find_dotenv(), override=False)
@@ -11,12 +18,122 @@ SUPABASE_KEY = os.environ["SUPABASE_SERVICE_ROLE_KEY"]
 
 _sb = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+CREDENTIAL_CACHE_TTL  = int(os.getenv("CLIENT_CREDENTIAL_CACHE_TTL", "300"))     # seconds
+CREDENTIAL_CACHE_SIZE = int(os.getenv("CLIENT_CREDENTIAL_CACHE_SIZE", "1024"))
+LAST_USED_FLUSH_SECONDS = float(os.getenv("CLIENT_LAST_USED_FLUSH_SECONDS", "30"))
+
+# ── verified-credential cache ────────────────────────────────
+# Keyed on HMAC(client_id, secret) with a per-process random key, so neither
+# the secret nor an offline-crackable hash of it is ever held in memory.
+_cache_key   = secrets.token_bytes(32)
+_cache_lock  = threading.Lock()
+_cache: "OrderedDict[bytes, tuple[float, str, dict]]" = OrderedDict()
+
+
+def _credential_digest(client_id: str, client_secret: str) -> bytes:
+    return hmac.new(_cache_key, f"{client_id}\0{client_secret}".encode(), hashlib.sha256).digest()
+
+
+def get_cached_client(client_id: str, client_secret: str) -> dict | None:
+    """Return the client row if this exact id/secret pair was verified recently."""
+    key = _credential_digest(client_id, client_secret)
+    now = time.monotonic()
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is None:
+            return None
+        expires_at, _, client = entry
+        if expires_at <= now:
+            del _cache[key]
+            return None
+        _cache.move_to_end(key)
+    return dict(client)
+
+
+def cache_verified_client(client_id: str, client_secret: str, client: dict) -> None:
+    """Remember a successful verification (the stored hash is not kept)."""
+    row = {k: v for k, v in client.items() if k != "client_secret_hash"}
+    row["client_id"] = client_id
+    key = _credential_digest(client_id, client_secret)
+    with _cache_lock:
+        _cache[key] = (time.monotonic() + CREDENTIAL_CACHE_TTL, client_id, row)
+        _cache.move_to_end(key)
+        while len(_cache) > CREDENTIAL_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def invalidate_client(client_id: str) -> None:
+    """Drop every cached verification for a client (call when it is disabled or rotated)."""
+    with _cache_lock:
+        for key in [k for k, (_, cid, _) in _cache.items() if cid == client_id]:
+            del _cache[key]
+
+
+# ── debounced last_used_at writer ────────────────────────────
+# Token exchanges only mark the client here; a background thread writes one
+# batched update per interval and, in the same pass, evicts cache entries for
+# clients that have since been disabled.
+_pending_lock  = threading.Lock()
+_pending_used: set[str] = set()
+_writer_thread: threading.Thread | None = None
+
+
+def mark_client_used(client_id: str) -> None:
+    global _writer_thread
+    with _pending_lock:
+        _pending_used.add(client_id)
+        if _writer_thread is None:
+            _writer_thread = threading.Thread(target=_last_used_writer, name="last-used-writer", daemon=True)
+            _writer_thread.start()
+
+
+def _flush_last_used() -> None:
+    with _pending_lock:
+        if not _pending_used:
+            return
+        client_ids = list(_pending_used)
+        _pending_used.clear()
+
+    try:
+        _sb.table("api_clients").update(
+            {"last_used_at": "now()"}
+        ).in_("client_id", client_ids).execute()
+
+        result = (
+            _sb.table("api_clients")
+            .select("client_id, is_active")
+            .in_("client_id", client_ids)
+            .execute()
+        )
+        active = {row["client_id"] for row in (result.data or []) if row.get("is_active")}
+        for client_id in client_ids:
+            if client_id not in active:
+                invalidate_client(client_id)
+    except Exception as e:
+        print(f"[WARN] last_used_at flush failed: {e}")
+
+
+def _last_used_writer() -> None:
+    while True:
+        time.sleep(LAST_USED_FLUSH_SECONDS)
+        _flush_last_used()
+
+
+atexit.register(_flush_last_used)
+
 
 def authenticate_client(client_id: str, client_secret: str) -> dict | None:
     """
     Look up the client by client_id, verify secret hash.
     Returns the client row dict on success, None on failure.
+    Repeat exchanges within CLIENT_CREDENTIAL_CACHE_TTL skip Supabase and bcrypt.
+    Raises HashPoolSaturated when the bcrypt pool cannot take the check.
     """
+    cached = get_cached_client(client_id, client_secret)
+    if cached is not None:
+        mark_client_used(client_id)
+        return cached
+
     result = (
         _sb.table("api_clients")
         .select("*")
@@ -29,14 +146,9 @@ def authenticate_client(client_id: str, client_secret: str) -> dict | None:
         return None
 
     client = result.data
-    if not bcrypt.checkpw(client_secret.encode(), client["client_secret_hash"].encode()):
+    if not check_secret(client_secret, client["client_secret_hash"]):
         return None
 
-    try:
-        _sb.table("api_clients").update(
-            {"last_used_at": "now()"}
-        ).eq("client_id", client_id).execute()
-    except Exception:
-        pass
-
+    cache_verified_client(client_id, client_secret, client)
+    mark_client_used(client_id)
     return client
@@ -0,0 +1,98 @@
+"""
+Bounded worker pool for bcrypt secret verification.
+
+bcrypt.checkpw is deliberately slow (~100-300 ms of CPU). Running it on the
+request thread lets a burst of token exchanges occupy every Flask worker
+thread and stall chat traffic. Checks run on a small dedicated pool instead
+(bcrypt releases the GIL while hashing, so threads are enough). Once every
+worker is busy and HASH_POOL_MAX_QUEUE checks are waiting, new checks fail
+fast with HashPoolSaturated, which routes turn into a 503.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import bcrypt
+
+HASH_POOL_WORKERS     = int(os.getenv("HASH_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_POOL_MAX_QUEUE   = int(os.getenv("HASH_POOL_MAX_QUEUE", "16"))
+HASH_POOL_TIMEOUT_SEC = float(os.getenv("HASH_POOL_TIMEOUT_SEC", "5"))
+
+
+class HashPoolSaturated(Exception):
+    """All verification workers are busy and the wait queue is full."""
+
+
+_executor = ThreadPoolExecutor(max_workers=HASH_POOL_WORKERS, thread_name_prefix="bcrypt")
+_slots    = threading.BoundedSemaphore(HASH_POOL_WORKERS + HASH_POOL_MAX_QUEUE)
+
+_stats_lock = threading.Lock()
+_queued     = 0
+_running    = 0
+_completed  = 0
+_rejected   = 0
+_timed_out  = 0
+_wait_total = 0.0
+_verify_total = 0.0
+_verify_max   = 0.0
+
+
+def _verify(secret: bytes, hashed: bytes, submitted_at: float) -> bool:
+    global _queued, _running, _completed, _wait_total, _verify_total, _verify_max
+    started = time.perf_counter()
+    with _stats_lock:
+        _queued  -= 1
+        _running += 1
+        _wait_total += started - submitted_at
+    try:
+        return bcrypt.checkpw(secret, hashed)
+    finally:
+        elapsed = time.perf_counter() - started
+        with _stats_lock:
+            _running   -= 1
+            _completed += 1
+            _verify_total += elapsed
+            _verify_max = max(_verify_max, elapsed)
+        _slots.release()
+
+
+def check_secret(secret: str, hashed: str) -> bool:
+    """
+    Verify `secret` against a bcrypt hash on the worker pool.
+    Raises HashPoolSaturated when the pool is full or the check does not
+    finish within HASH_POOL_TIMEOUT_SEC.
+    """
+    global _queued, _rejected, _timed_out
+    if not _slots.acquire(blocking=False):
+        with _stats_lock:
+            _rejected += 1
+        raise HashPoolSaturated("credential verification pool is saturated")
+
+    with _stats_lock:
+        _queued += 1
+    future = _executor.submit(_verify, secret.encode(), hashed.encode(), time.perf_counter())
+    try:
+        return future.result(timeout=HASH_POOL_TIMEOUT_SEC)
+    except FutureTimeout:
+        with _stats_lock:
+            _timed_out += 1
+        raise HashPoolSaturated("credential verification timed out")
+
+
+def hash_pool_stats() -> dict:
+    """Queue depth, throughput and latency counters for monitoring."""
+    with _stats_lock:
+        done = _completed or 1
+        return {
+            "workers":        HASH_POOL_WORKERS,
+            "max_queue":      HASH_POOL_MAX_QUEUE,
+            "queue_depth":    _queued,
+            "running":        _running,
+            "completed":      _completed,
+            "rejected":       _rejected,
+            "timed_out":      _timed_out,
+            "avg_wait_ms":    round(_wait_total / done * 1000, 2),
+            "avg_verify_ms":  round(_verify_total / done * 1000, 2),
+            "max_verify_ms":  round(_verify_max * 1000, 2),
+        }
@@ -0,0 +1,68 @@
+"""
+LRU cache of verified bearer tokens → decoded claims.
+
+Clients reuse the same JWT for its whole lifetime (15 min by default), so the
+auth decorators (middleware.auth_middleware.require_token and the require_jwt
+decorators in ragflow_routes / lesson_planner_routes) verify each token once
+and serve repeat requests from here until the token's `exp`.
+
+Only successful verifications are cached. An expired entry is dropped and the
+token is decoded again, so the caller still gets ExpiredSignatureError.
+"""
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+JWT_CACHE_SIZE    = int(os.getenv("JWT_CACHE_SIZE", "4096"))
+JWT_CACHE_MAX_TTL = int(os.getenv("JWT_CACHE_MAX_TTL", "900"))   # for tokens without `exp`
+
+_lock    = threading.Lock()
+_entries: "OrderedDict[bytes, tuple[float, dict]]" = OrderedDict()
+_hits    = 0
+_misses  = 0
+
+
+def cached_decode(token: str, decode: Callable[[str], dict], namespace: str) -> dict:
+    """
+    Return the claims for `token`, calling `decode` only on a cache miss.
+    `namespace` separates decoders with different validation rules.
+    Whatever `decode` raises (jwt.PyJWTError etc.) propagates unchanged.
+    """
+    global _hits, _misses
+    key = hashlib.sha256(f"{namespace}\0{token}".encode()).digest()
+    now = time.time()
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                _entries.move_to_end(key)
+                _hits += 1
+                return dict(entry[1])
+            del _entries[key]
+        _misses += 1
+
+    claims = decode(token)
+
+    exp = claims.get("exp")
+    expires_at = float(exp) if isinstance(exp, (int, float)) else now + JWT_CACHE_MAX_TTL
+    with _lock:
+        _entries[key] = (expires_at, claims)
+        _entries.move_to_end(key)
+        while len(_entries) > JWT_CACHE_SIZE:
+            _entries.popitem(last=False)
+    return dict(claims)
+
+
+def token_cache_stats() -> dict:
+    with _lock:
+        total = _hits + _misses
+        return {
+            "size":     len(_entries),
+            "max_size": JWT_CACHE_SIZE,
+            "hits":     _hits,
+            "misses":   _misses,
+            "hit_rate": round(_hits / total, 4) if total else 0.0,
+        }
@@ -0,0 +1,163 @@
+"""
+competency_classifier.py — issue text → competency areas
+
+get_issue_competency_mappings() returns the whole issue_competency_mapping
+table. Scanning every keyword against every issue is O(issues × keywords),
+so this module compiles the rows into an Aho-Corasick automaton instead. One
+pass over an issue's text finds every keyword in it.
+
+Matches are case-insensitive and must sit on word boundaries ("focus"
+does not match "unfocused"). Each keyword counts once per issue. Keyword
+confidences for the same competency_area are combined as a noisy-OR,
+1 - Π(1 - c), so several weak signals add up but the score never goes
+past 1.
+
+get_classifier() returns a process-wide instance. The mapping table is
+re-read every COMPETENCY_MAP_REFRESH_SEC, and the automaton is only rebuilt
+when the rows actually changed. Call invalidate() after editing the table.
+"""
+import os
+import time
+import threading
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from supabase_client import db
+
+COMPETENCY_MAP_REFRESH_SEC = float(os.getenv("COMPETENCY_MAP_REFRESH_SEC", "300"))
+
+DEFAULT_TEXT_FIELDS = ("title", "description")
+
+
+class CompetencyClassifier:
+    """Aho-Corasick automaton over issue_keyword rows."""
+
+    def __init__(self, mappings: Iterable[Dict[str, Any]]):
+        # node 0 is the root; _goto[n] maps a character to the next node
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # keywords ending at each node (own + inherited via fail links): (length, keyword index)
+        self._out: List[List[tuple]] = [[]]
+        self.keywords: List[tuple] = []   # (keyword, competency_area, confidence)
+
+        for row in mappings:
+            keyword = " ".join(str(row.get("issue_keyword") or "").lower().split())
+            area = row.get("competency_area")
+            if not keyword or not area:
+                continue
+            self._add(keyword, len(self.keywords))
+            self.keywords.append((keyword, area, float(row.get("confidence_score") or 0.0)))
+        self._link()
+
+    def _add(self, keyword: str, index: int) -> None:
+        node = 0
+        for ch in keyword:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append((len(keyword), index))
+
+    def _link(self) -> None:
+        # breadth-first so every node's fail target is finished before it
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def matches(self, text: str) -> List[int]:
+        """Indexes into self.keywords found in `text` (each at most once)."""
+        text = " ".join((text or "").lower().split())
+        found, node = set(), 0
+        for pos, ch in enumerate(text):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for length, index in self._out[node]:
+                start, end = pos - length + 1, pos + 1
+                if (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum()):
+                    found.add(index)
+        return sorted(found)
+
+    def classify(self, text: str) -> Dict[str, Dict[str, Any]]:
+        """{competency_area: {"score": noisy-OR confidence, "keywords": [...]}} for one text."""
+        areas: Dict[str, Dict[str, Any]] = {}
+        for index in self.matches(text):
+            keyword, area, confidence = self.keywords[index]
+            entry = areas.setdefault(area, {"score": 0.0, "keywords": []})
+            entry["score"] = 1 - (1 - entry["score"]) * (1 - confidence)
+            entry["keywords"].append(keyword)
+        for entry in areas.values():
+            entry["score"] = round(entry["score"], 4)
+        return areas
+
+    def classify_issues(
+        self,
+        issues: Iterable[Dict[str, Any]],
+        text_fields: Sequence[str] = DEFAULT_TEXT_FIELDS,
+    ) -> List[Dict[str, Any]]:
+        """
+        Classify issue rows (as returned by get_cluster_issues) in one pass each.
+        Returns [{"issue_id", "competencies", "primary"}] in input order, where
+        primary is the highest-scoring area or None.
+        """
+        results = []
+        for issue in issues:
+            text = " \n ".join(str(issue.get(f) or "") for f in text_fields)
+            competencies = self.classify(text)
+            primary = max(competencies, key=lambda a: competencies[a]["score"]) if competencies else None
+            results.append({"issue_id": issue.get("id"), "competencies": competencies, "primary": primary})
+        return results
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Shared instance
+# ─────────────────────────────────────────────────────────────────────────────
+
+_lock        = threading.Lock()
+_classifier: Optional[CompetencyClassifier] = None
+_fingerprint = None
+_checked_at  = float("-inf")
+
+
+def get_classifier() -> CompetencyClassifier:
+    """Process-wide classifier, rebuilt only when the mapping rows change."""
+    global _classifier, _fingerprint, _checked_at
+    with _lock:
+        if _classifier is not None and time.monotonic() - _checked_at < COMPETENCY_MAP_REFRESH_SEC:
+            return _classifier
+        rows = db.get_issue_competency_mappings()
+        if not rows and _classifier is not None:
+            # the loader returns [] on errors; keep serving the last good table
+            _checked_at = time.monotonic()
+            return _classifier
+        fingerprint = frozenset(
+            (r.get("issue_keyword"), r.get("competency_area"), r.get("confidence_score")) for r in rows
+        )
+        if _classifier is None or fingerprint != _fingerprint:
+            _classifier, _fingerprint = CompetencyClassifier(rows), fingerprint
+        _checked_at = time.monotonic()
+        return _classifier
+
+
+def invalidate() -> None:
+    """Force the next get_classifier() to re-read issue_competency_mapping."""
+    global _checked_at
+    with _lock:
+        _checked_at = float("-inf")
+
+
+def classify_cluster_issues(cluster_id: str, text_fields: Sequence[str] = DEFAULT_TEXT_FIELDS) -> List[Dict[str, Any]]:
+    """Fetch a cluster's issues once and classify them all."""
+    return get_classifier().classify_issues(db.get_cluster_issues(cluster_id), text_fields)
@@ -0,0 +1,202 @@
+"""
+content_index.py — SHA-256 content index for RAGFlow documents
+
+Re-uploading a file that a dataset already holds used to create a second
+document, and parsing it re-ran the whole chunking and embedding pipeline.
+This module keeps sha256 → document_id per dataset: in memory, backed by the
+Supabase document_hashes table (dataset_id, sha256, document_id, name, size;
+unique on dataset_id + sha256). Each dataset is loaded once on first use,
+and a hash missing from that snapshot is looked up in the table, since
+another worker may have recorded it since. The table is the arbiter between
+processes: claim() inserts with ON CONFLICT DO NOTHING and reads back whichever
+document is stored. If the table cannot be read, the index still works for
+this process.
+
+upload() is what the routes and ingestion jobs call instead of
+rf.upload_document_stream:
+
+  * if the caller hashed the bytes itself (sha256_verified, e.g. a local file
+    in an ingestion job) and the dataset has them, nothing is uploaded; the
+    existing document id comes back with duplicate=True;
+  * a client-declared hash (sha256 / X-Content-SHA256) is not proof of
+    content, so it only skips the upload when the stored document also has
+    the same file name, and the response is marked declared_hash=True;
+  * otherwise the hash is computed while the bytes stream to RAGFlow. If
+    another upload claimed the same content first, the new document is
+    deleted again before anyone parses it, and the existing id is returned.
+
+Deleting documents or datasets through the routes calls forget_documents /
+forget_dataset. scripts/reconcile_content_hashes.py backfills hashes for
+documents uploaded before this index existed and drops entries for
+documents that are gone.
+"""
+import hashlib
+import threading
+from datetime import datetime, timezone
+from typing import Any, BinaryIO, Dict, Iterable, Optional
+
+import ragflow_client as rf
+import upload_stream
+from supabase_client import db
+
+_lock = threading.Lock()
+_index: Dict[str, Dict[str, Dict[str, Any]]] = {}   # dataset id -> sha256 -> row
+_stats = {"lookups": 0, "remote_hits": 0, "skipped_uploads": 0, "late_duplicates": 0, "recorded": 0}
+
+
+def file_sha256(f: BinaryIO, chunk_size: int = upload_stream.UPLOAD_CHUNK_BYTES) -> str:
+    """Hash an open binary file from its current position to the end."""
+    digest = hashlib.sha256()
+    for block in upload_stream.iter_file(f, chunk_size):
+        digest.update(block)
+    return digest.hexdigest()
+
+
+def _dataset(dataset_id: str) -> Dict[str, Dict[str, Any]]:
+    """The dataset's sha256 → row map, loaded from Supabase (outside _lock) on first use."""
+    with _lock:
+        entries = _index.get(dataset_id)
+    if entries is not None:
+        return entries
+    rows = db.get_document_hashes(dataset_id) or []
+    with _lock:
+        entries = _index.setdefault(dataset_id, {})
+        for r in rows:
+            if r.get("sha256") and r.get("document_id"):
+                entries.setdefault(r["sha256"], r)
+    return entries
+
+
+def _row(dataset_id: str, sha256: str) -> Optional[Dict[str, Any]]:
+    entries = _dataset(dataset_id)
+    with _lock:
+        _stats["lookups"] += 1
+        row = entries.get(sha256)
+    if row is not None:
+        return row
+    # not in this process's snapshot; another worker may have recorded it since
+    row = db.get_document_hash(dataset_id, sha256)
+    if not (row and row.get("document_id")):
+        return None
+    with _lock:
+        _stats["remote_hits"] += 1
+        return entries.setdefault(sha256, row)
+
+
+def lookup(dataset_id: str, sha256: str) -> Optional[str]:
+    """Document id already holding this content in the dataset, if any."""
+    row = _row(dataset_id, sha256.lower())
+    return row["document_id"] if row else None
+
+
+def claim(dataset_id: str, sha256: str, document_id: str, name: str = "", size: int = 0) -> str:
+    """
+    Record `document_id` as the holder of this content unless another
+    document already is; returns whichever id owns it.
+    """
+    sha256 = sha256.lower()
+    existing = _row(dataset_id, sha256)
+    if existing and existing["document_id"] != document_id:
+        return existing["document_id"]
+    row = {
+        "dataset_id": dataset_id,
+        "sha256": sha256,
+        "document_id": document_id,
+        "name": name,
+        "size": size,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+    # first insert wins across processes; never overwrite another worker's owner
+    result = db.bulk_upsert("document_hashes", [row], on_conflict="dataset_id,sha256", ignore_duplicates=True)
+    for failure in result["failed"]:
+        print(f"[WARN] document_hashes insert failed for {document_id}: {failure['error']}")
+    stored = None if result["failed"] else db.get_document_hash(dataset_id, sha256)
+
+    entries = _dataset(dataset_id)
+    with _lock:
+        if stored and stored.get("document_id"):
+            entries[sha256] = stored
+        else:
+            # Supabase unavailable: the first claim in this process wins
+            entries.setdefault(sha256, row)
+        owner = entries[sha256]["document_id"]
+        if owner == document_id:
+            _stats["recorded"] += 1
+    return owner
+
+
+def forget_documents(dataset_id: str, document_ids: Iterable[str]) -> None:
+    ids = {str(d) for d in document_ids}
+    with _lock:
+        entries = _index.get(dataset_id, {})
+        for sha in [sha for sha, row in entries.items() if row["document_id"] in ids]:
+            del entries[sha]
+    db.delete_document_hashes(dataset_id, ids)
+
+
+def forget_dataset(dataset_id: str) -> None:
+    with _lock:
+        _index.pop(dataset_id, None)
+    db.delete_document_hashes(dataset_id)
+
+
+def entries(dataset_id: str) -> Dict[str, Dict[str, Any]]:
+    """Copy of the dataset's sha256 → row map."""
+    entries = _dataset(dataset_id)   # takes _lock itself
+    with _lock:
+        return dict(entries)
+
+
+def upload(
+    dataset_id: str,
+    file_name: str,
+    chunks: Iterable[bytes],
+    sha256: str = "",
+    sha256_verified: bool = False,
+) -> Dict[str, Any]:
+    """
+    Upload a document unless the dataset already has its content. Returns
+    {"result", "document_ids", "upload_stats", "sha256", "duplicate",
+    "declared_hash"}; result and upload_stats are None when the upload was
+    skipped. Pass sha256_verified=True only for a hash computed here from the
+    actual bytes; a client's hash skips the upload only if the stored
+    document has the same name, and declared_hash marks that it was trusted.
+    """
+    sha256 = (sha256 or "").strip().lower()
+    if sha256:
+        row = _row(dataset_id, sha256)
+        if row and (sha256_verified or (row.get("name") or "") == file_name):
+            with _lock:
+                _stats["skipped_uploads"] += 1
+            return {
+                "result": None, "document_ids": [row["document_id"]], "upload_stats": None,
+                "sha256": sha256, "duplicate": True, "declared_hash": not sha256_verified,
+            }
+
+    digest = hashlib.sha256()
+    result, report = rf.upload_document_stream(dataset_id, file_name, upload_stream.hashing(chunks, digest))
+    sha256 = digest.hexdigest()
+    document_ids = rf.extract_document_ids(result)
+    outcome = {
+        "result": result, "document_ids": document_ids, "upload_stats": report,
+        "sha256": sha256, "duplicate": False, "declared_hash": False,
+    }
+    if len(document_ids) != 1:
+        return outcome
+
+    owner = claim(dataset_id, sha256, document_ids[0], file_name, report["bytes"])
+    if owner != document_ids[0]:
+        # same bytes were already in the dataset: drop the copy before it gets parsed
+        with _lock:
+            _stats["late_duplicates"] += 1
+        try:
+            rf.delete_documents(dataset_id, document_ids)
+        except Exception as e:
+            print(f"[WARN] could not delete duplicate document {document_ids[0]}: {e}")
+        outcome.update(document_ids=[owner], duplicate=True)
+    return outcome
+
+
+def content_index_stats() -> Dict[str, Any]:
+    with _lock:
+        return {**_stats, "datasets_loaded": len(_index), "hashes": sum(len(e) for e in _index.values())}
@@ -0,0 +1,165 @@
+"""
+dataset_routing.py — in-memory board→dataset and name→dataset tables
+
+Lesson generation used to query Supabase resource_source_routing on every
+request, and ragflow_routes called rf.get_or_create_dataset (a RAGFlow
+list_datasets, sometimes a create) for every retrieve/ask/upload. Both
+tables are small, so they are loaded once, refreshed by a daemon thread every
+DATASET_ROUTING_REFRESH_SEC, and served from memory.
+
+Admin routes call refresh() after routing or dataset changes. A name that
+is not in the table yet falls through to get_or_create_dataset once and is
+remembered.
+"""
+import os
+import time
+import threading
+from typing import Dict, Optional
+
+import ragflow_client as rf
+from supabase_client import db
+
+DATASET_ROUTING_REFRESH_SEC = float(os.getenv("DATASET_ROUTING_REFRESH_SEC", "300"))
+
+_lock         = threading.Lock()
+_by_board: Dict[str, str] = {}
+_by_name:  Dict[str, str] = {}
+_loaded_at    = 0.0
+_ready        = threading.Event()     # set once the first load has finished
+_refresher_pid = None
+_stats = {"board_hits": 0, "board_misses": 0, "name_hits": 0, "name_misses": 0, "refreshes": 0, "refresh_errors": 0}
+
+
+def _load_boards() -> Dict[str, str]:
+    rows = (
+        db.client.table("resource_source_routing")
+        .select("board, ragflow_dataset_id, priority")
+        .eq("is_active", True)
+        .order("priority", desc=True)
+        .execute()
+    ).data or []
+    boards: Dict[str, str] = {}
+    for row in rows:
+        # rows arrive highest priority first; keep the first per board
+        if row.get("board") and row.get("ragflow_dataset_id"):
+            boards.setdefault(row["board"], row["ragflow_dataset_id"])
+    return boards
+
+
+def _load_names(page_size: int = 100) -> Dict[str, str]:
+    names: Dict[str, str] = {}
+    page = 1
+    while True:
+        batch = rf.list_datasets(page=page, page_size=page_size)
+        for ds in batch:
+            if ds.get("name") and ds.get("id"):
+                names[ds["name"]] = ds["id"]
+        if len(batch) < page_size:
+            return names
+        page += 1
+
+
+def refresh() -> bool:
+    """Reload both tables. A table that fails to load keeps its previous contents."""
+    global _loaded_at
+    ok = True
+    try:
+        boards = _load_boards()
+        with _lock:
+            _by_board.clear()
+            _by_board.update(boards)
+    except Exception as e:
+        ok = False
+        print(f"[WARN] dataset routing: resource_source_routing load failed: {e}")
+    try:
+        names = _load_names()
+        with _lock:
+            _by_name.clear()
+            _by_name.update(names)
+    except Exception as e:
+        ok = False
+        print(f"[WARN] dataset routing: RAGFlow dataset list failed: {e}")
+
+    with _lock:
+        _loaded_at = time.time()
+        _stats["refreshes"] += 1
+        if not ok:
+            _stats["refresh_errors"] += 1
+    return ok
+
+
+def _refresher() -> None:
+    while True:
+        time.sleep(DATASET_ROUTING_REFRESH_SEC)
+        refresh()
+
+
+def _ensure_loaded() -> None:
+    # the first lookup in each process loads synchronously and starts the timer;
+    # concurrent first lookups wait for that load instead of seeing empty tables
+    global _refresher_pid
+    if _refresher_pid != os.getpid():
+        with _lock:
+            leader = _refresher_pid != os.getpid()
+            if leader:
+                _refresher_pid = os.getpid()
+        if leader:
+            try:
+                refresh()
+            finally:
+                _ready.set()
+                threading.Thread(target=_refresher, name="dataset-routing-refresh", daemon=True).start()
+    _ready.wait(30)
+
+
+def loaded() -> bool:
+    """True once this process has its tables, i.e. lookups no longer block on a load."""
+    return _refresher_pid == os.getpid() and _ready.is_set()
+
+
+def board_dataset_id(board: str) -> Optional[str]:
+    """Highest-priority active dataset for `board`, or None if the board is not routed."""
+    _ensure_loaded()
+    with _lock:
+        dataset_id = _by_board.get(board)
+        _stats["board_hits" if dataset_id else "board_misses"] += 1
+    return dataset_id
+
+
+def dataset_id_for_name(name: str, description: str = "", chunk_method: str = "naive") -> str:
+    """Dataset id for `name`, creating the dataset in RAGFlow if it does not exist."""
+    _ensure_loaded()
+    with _lock:
+        dataset_id = _by_name.get(name)
+        _stats["name_hits" if dataset_id else "name_misses"] += 1
+    if dataset_id:
+        return dataset_id
+
+    dataset = rf.get_or_create_dataset(name=name, description=description, chunk_method=chunk_method)
+    dataset_id = dataset.get("id", "") or dataset.get("dataset_id", "") or ""
+    if dataset_id:
+        remember_dataset(name, dataset_id)
+    return dataset_id
+
+
+def remember_dataset(name: str, dataset_id: str) -> None:
+    with _lock:
+        _by_name[name] = dataset_id
+
+
+def forget_dataset(dataset_id: str) -> None:
+    """Drop a deleted dataset from both tables (the next refresh re-reads routing)."""
+    with _lock:
+        for table in (_by_name, _by_board):
+            for key in [k for k, v in table.items() if v == dataset_id]:
+                del table[key]
+
+
+def routing_stats() -> Dict[str, object]:
+    with _lock:
+        return {
+            **_stats,
+            "boards":   len(_by_board),
+            "datasets": len(_by_name),
+            "age_sec":  round(time.time() - _loaded_at, 1) if _loaded_at else None,
+        }
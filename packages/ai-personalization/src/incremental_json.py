@@ -0,0 +1,92 @@
+"""
+incremental_json.py — pull completed values out of a JSON document as it streams
+
+Gemini streams a lesson plan as a series of text fragments. The scanner is fed
+those fragments and returns every watched value as soon as its closing brace,
+bracket or quote arrives, long before the whole document can be parsed.
+
+Watched paths are tuples of object keys and array positions; "*" matches any
+key or index:
+
+    scanner = IncrementalJSONScanner([("lesson", "sections", "*")])
+    for fragment in stream:
+        for path, value in scanner.feed(fragment):
+            ...   # path == ("lesson", "sections", 0), value == {...}
+
+Only objects, arrays and strings are reported; numbers and literals at a
+watched path are skipped. Text outside the top-level value (e.g. a ```json
+fence) is ignored.
+"""
+import json
+from typing import Any, Iterable, List, Sequence, Tuple
+
+Path = Tuple[Any, ...]
+
+
+class IncrementalJSONScanner:
+
+    def __init__(self, watch: Iterable[Sequence[Any]]):
+        self._watch = [tuple(p) for p in watch]
+        self._buf = ""
+        self._pos = 0
+        # open containers: [kind, current key / index, start offset, expecting a key]
+        self._frames: List[list] = []
+        self._in_string = False
+        self._escaped = False
+        self._string_start = 0
+
+    def _watched(self, path: Path) -> bool:
+        for pattern in self._watch:
+            if len(pattern) == len(path) and all(p == "*" or p == k for p, k in zip(pattern, path)):
+                return True
+        return False
+
+    def feed(self, text: str) -> List[Tuple[Path, Any]]:
+        """Consume the next fragment; return (path, value) for each watched value it completed."""
+        self._buf += text
+        buf, frames, found = self._buf, self._frames, []
+
+        for i in range(self._pos, len(buf)):
+            ch = buf[i]
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+                    top = frames[-1] if frames else None
+                    if top is not None and top[0] == "{" and top[3]:
+                        top[1], top[3] = json.loads(buf[self._string_start:i + 1]), False
+                    else:
+                        path = tuple(f[1] for f in frames)
+                        if self._watched(path):
+                            found.append((path, json.loads(buf[self._string_start:i + 1])))
+                continue
+
+            if not frames and ch not in "{[":
+                continue
+            if ch == '"':
+                self._in_string, self._string_start = True, i
+            elif ch in "{[":
+                frames.append([ch, 0 if ch == "[" else None, i, ch == "{"])
+            elif ch in "}]":
+                frame = frames.pop()
+                path = tuple(f[1] for f in frames)
+                if self._watched(path):
+                    found.append((path, json.loads(buf[frame[2]:i + 1])))
+            elif ch == ",":
+                top = frames[-1]
+                if top[0] == "[":
+                    top[1] += 1
+                else:
+                    top[3] = True
+
+        self._pos = len(buf)
+        return found
+
+    @property
+    def text(self) -> str:
+        """Everything fed so far."""
+        return self._buf
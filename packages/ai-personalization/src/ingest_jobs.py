@@ -0,0 +1,366 @@
+"""
+ingest_jobs.py — bulk document ingestion into a RAGFlow dataset
+
+/api/ragflow/documents/upload-and-parse handles one file per request and
+waits for upload → parse_documents each time, so importing a textbook corpus
+takes hours. An ingestion job takes a list of sources (files, directories,
+zip archives):
+
+  * skips files whose SHA-256 the dataset already has (content_index) and
+    uploads the rest on a shared pool of INGEST_UPLOAD_WORKERS threads, so the
+    whole process never has more than that many uploads to RAGFlow in flight
+    however many jobs are running;
+  * gathers the returned document ids and sends them to parse_documents in
+    batches of INGEST_PARSE_BATCH_SIZE. Parsing of the first batch starts
+    while the rest are still uploading;
+  * runs in the background. start_job() returns the job at once, and
+    get_job() / list_jobs() report progress. Each parse batch is handed to
+    parse_tracker, whose completion callback fills in parsed / parse_failed.
+
+Job state lives in memory; the last INGEST_JOB_HISTORY finished jobs are
+kept for status queries.
+"""
+import os
+import time
+import uuid
+import shutil
+import zipfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import Any, BinaryIO, Callable, ContextManager, Dict, Iterable, Iterator, List, Optional
+
+import content_index
+import parse_tracker
+import ragflow_client as rf
+import upload_stream
+
+INGEST_UPLOAD_WORKERS  = int(os.getenv("INGEST_UPLOAD_WORKERS", "4"))
+INGEST_PARSE_BATCH_SIZE = int(os.getenv("INGEST_PARSE_BATCH_SIZE", "64"))
+INGEST_JOB_HISTORY     = int(os.getenv("INGEST_JOB_HISTORY", "200"))
+INGEST_ROOT            = os.path.abspath(os.getenv("UPLOAD_DIR", "uploads"))
+
+INGEST_EXTENSIONS = frozenset({
+    ".pdf", ".doc", ".docx", ".ppt", ".pptx", ".xls", ".xlsx", ".csv",
+    ".txt", ".md", ".html", ".htm", ".json", ".rtf", ".epub",
+    ".png", ".jpg", ".jpeg", ".tif", ".tiff",
+})
+
+_uploads = ThreadPoolExecutor(max_workers=INGEST_UPLOAD_WORKERS, thread_name_prefix="ingest-upload")
+
+
+def set_upload_workers(workers: int) -> None:
+    """Resize the shared upload pool (CLI use, before any job starts)."""
+    global _uploads, INGEST_UPLOAD_WORKERS
+    if workers == INGEST_UPLOAD_WORKERS:
+        return
+    old, INGEST_UPLOAD_WORKERS = _uploads, max(1, workers)
+    _uploads = ThreadPoolExecutor(max_workers=INGEST_UPLOAD_WORKERS, thread_name_prefix="ingest-upload")
+    old.shutdown(wait=False)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Sources
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+class Source:
+    """One document to ingest: a display name and a way to open it for reading."""
+
+    __slots__ = ("name", "open")
+
+    def __init__(self, name: str, open: Callable[[], ContextManager[BinaryIO]]):
+        self.name = name
+        self.open = open
+
+
+def _wanted(name: str, extensions: Iterable[str]) -> bool:
+    base = os.path.basename(name)
+    if not base or base.startswith(".") or "__MACOSX" in name:
+        return False
+    return os.path.splitext(base)[1].lower() in extensions
+
+
+def _zip_member(path: str, member: str) -> Callable[[], ContextManager[BinaryIO]]:
+    @contextmanager
+    def open_member() -> Iterator[BinaryIO]:
+        # one ZipFile per reader so parallel uploads do not share a file position
+        with zipfile.ZipFile(path) as archive, archive.open(member) as stream:
+            yield stream
+    return open_member
+
+
+def sources_from_path(path: str, extensions: Iterable[str] = INGEST_EXTENSIONS) -> List[Source]:
+    """
+    Expand a file, directory (recursively, sorted) or .zip archive into
+    sources, keeping only files with an ingestable extension. Zip members are
+    read straight from the archive without extracting it.
+    """
+    extensions = {e.lower() for e in extensions}
+    if os.path.isdir(path):
+        found = []
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            for name in sorted(files):
+                found.extend(sources_from_path(os.path.join(root, name), extensions))
+        return found
+    if not os.path.isfile(path):
+        raise ValueError(f"not found: {path}")
+    if zipfile.is_zipfile(path) and path.lower().endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            return [
+                Source(os.path.basename(info.filename), _zip_member(path, info.filename))
+                for info in archive.infolist()
+                if not info.is_dir() and _wanted(info.filename, extensions)
+            ]
+    if not _wanted(path, extensions):
+        return []
+    return [Source(os.path.basename(path), lambda: open(path, "rb"))]
+
+
+def resolve_ingest_path(path: str) -> str:
+    """Absolute path for a server-side ingest request, which must stay inside INGEST_ROOT."""
+    full = os.path.realpath(os.path.join(INGEST_ROOT, path))
+    if os.path.commonpath([full, os.path.realpath(INGEST_ROOT)]) != os.path.realpath(INGEST_ROOT):
+        raise ValueError("path must be inside the upload directory")
+    return full
+
+
+def staging_dir(name: str) -> str:
+    """Scratch directory for files posted to a job (add it to job.cleanup)."""
+    path = os.path.join(INGEST_ROOT, "ingest", name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Jobs
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+class IngestJob:
+    """Progress of one ingestion job; read it through snapshot()."""
+
+    def __init__(self, dataset_id: str, sources: List[Source], parse: bool, parse_batch_size: int, webhook: str = ""):
+        self.id = uuid.uuid4().hex
+        self.dataset_id = dataset_id
+        self.sources = sources
+        self.parse = parse
+        self.webhook = webhook
+        self.parse_batch_size = max(1, parse_batch_size)
+        self.cleanup: List[str] = []
+        self._lock = threading.Lock()
+        self._state: Dict[str, Any] = {
+            "job_id": self.id,
+            "dataset_id": dataset_id,
+            "status": "queued",
+            "total": len(sources),
+            "uploaded": 0,
+            "duplicates": 0,
+            "failed": 0,
+            "bytes": 0,
+            "parse_requested": 0,
+            "parse_calls": 0,
+            "parsed": 0,
+            "parse_failed": 0,
+            "document_ids": [],
+            "errors": [],
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "finished_at": None,
+        }
+        self._started = time.perf_counter()
+        self._elapsed: Optional[float] = None
+        self._pending_parse: List[str] = []
+
+    @property
+    def finished(self) -> bool:
+        with self._lock:
+            return self._state["finished_at"] is not None
+
+    def update(self, **changes: Any) -> None:
+        with self._lock:
+            self._state.update(changes)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            state = {**self._state, "document_ids": list(self._state["document_ids"]), "errors": list(self._state["errors"])}
+            elapsed = self._elapsed if self._elapsed is not None else time.perf_counter() - self._started
+        done = state["uploaded"] + state["duplicates"] + state["failed"]
+        state["progress"] = round(done / state["total"], 3) if state["total"] else 1.0
+        state["elapsed_s"] = round(elapsed, 2)
+        state["files_per_s"] = round(state["uploaded"] / elapsed, 2) if elapsed > 0 else None
+        state["mb_per_s"] = round(state["bytes"] / elapsed / 1e6, 2) if elapsed > 0 else None
+        return state
+
+    # called from upload workers
+    def _uploaded(self, name: str, document_ids: List[str], nbytes: int) -> Optional[List[str]]:
+        """Record an upload; returns a batch of ids to parse once one is full."""
+        with self._lock:
+            self._state["uploaded"] += 1
+            self._state["bytes"] += nbytes
+            self._state["document_ids"].extend(document_ids)
+            if not document_ids:
+                self._state["errors"].append({"file": name, "error": "no document id returned"})
+            self._pending_parse.extend(document_ids)
+            if self.parse and len(self._pending_parse) >= self.parse_batch_size:
+                batch = self._pending_parse[:self.parse_batch_size]
+                del self._pending_parse[:self.parse_batch_size]
+                return batch
+        return None
+
+    def _duplicate(self, document_ids: List[str]) -> None:
+        """Content already in the dataset: report its document, nothing to parse."""
+        with self._lock:
+            self._state["duplicates"] += 1
+            self._state["document_ids"].extend(document_ids)
+
+    def _failed(self, name: str, error: str) -> None:
+        with self._lock:
+            self._state["failed"] += 1
+            self._state["errors"].append({"file": name, "error": error})
+
+    def _parse_requested(self, document_ids: List[str]) -> None:
+        with self._lock:
+            self._state["parse_requested"] += len(document_ids)
+            self._state["parse_calls"] += 1
+
+    def _parse_failed(self, document_ids: List[str], error: str) -> None:
+        with self._lock:
+            self._state["errors"].append({"document_ids": document_ids, "error": f"parse_documents: {error}"})
+
+    def _parse_finished(self, summary: Dict[str, Any]) -> None:
+        # parse_tracker callback, once per parse batch
+        with self._lock:
+            self._state["parsed"] += summary["done"]
+            self._state["parse_failed"] += summary["failed"]
+
+    def _take_remaining(self) -> List[str]:
+        with self._lock:
+            batch, self._pending_parse = self._pending_parse, []
+            return batch
+
+    def _finish(self, status: str) -> None:
+        with self._lock:
+            self._elapsed = time.perf_counter() - self._started
+            self._state["status"] = status
+            self._state["finished_at"] = datetime.now(timezone.utc).isoformat()
+
+
+_jobs_lock = threading.Lock()
+_jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+
+
+def _remember(job: IngestJob) -> None:
+    with _jobs_lock:
+        _jobs[job.id] = job
+        finished = [jid for jid, j in _jobs.items() if j.finished]
+        for jid in finished[:max(0, len(finished) - INGEST_JOB_HISTORY)]:
+            del _jobs[jid]
+
+
+def _upload_one(job: IngestJob, source: Source) -> Optional[List[str]]:
+    # hash locally first so content the dataset already holds is never sent
+    with source.open() as f:
+        sha256 = content_index.file_sha256(f)
+    with source.open() as f:
+        outcome = content_index.upload(
+            job.dataset_id, source.name, upload_stream.iter_file(f), sha256=sha256, sha256_verified=True
+        )
+    if outcome["duplicate"]:
+        return job._duplicate(outcome["document_ids"])
+    return job._uploaded(source.name, outcome["document_ids"], outcome["upload_stats"]["bytes"])
+
+
+def _parse_batch(job: IngestJob, document_ids: List[str]) -> None:
+    try:
+        rf.parse_documents(job.dataset_id, document_ids)
+    except Exception as e:
+        job._parse_failed(document_ids, str(e))
+    else:
+        job._parse_requested(document_ids)
+        parse_tracker.track(job.dataset_id, document_ids, callback=job._parse_finished, webhook=job.webhook)
+
+
+def _run(job: IngestJob) -> None:
+    job.update(status="running")
+    try:
+        futures = {_uploads.submit(_upload_one, job, source): source for source in job.sources}
+        for future in as_completed(futures):
+            try:
+                batch = future.result()
+            except Exception as e:
+                job._failed(futures[future].name, str(e))
+                continue
+            if batch:
+                _parse_batch(job, batch)
+        remaining = job._take_remaining()
+        if remaining:
+            _parse_batch(job, remaining)
+        snap = job.snapshot()
+        ok = snap["uploaded"] + snap["duplicates"]
+        job._finish("completed" if not snap["errors"] else ("failed" if not ok else "completed_with_errors"))
+    except Exception as e:
+        job._failed("*", str(e))
+        job._finish("failed")
+    finally:
+        for path in job.cleanup:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def create_job(
+    dataset_id: str,
+    sources: List[Source],
+    parse: bool = True,
+    parse_batch_size: int = INGEST_PARSE_BATCH_SIZE,
+    webhook: str = "",
+) -> IngestJob:
+    """Register a job without starting it (so callers can attach cleanup paths)."""
+    job = IngestJob(dataset_id, sources, parse, parse_batch_size, webhook)
+    _remember(job)
+    return job
+
+
+def start_job(job: IngestJob) -> IngestJob:
+    """Run a job on a background thread and return it immediately."""
+    threading.Thread(target=_run, args=(job,), name=f"ingest-{job.id[:8]}", daemon=True).start()
+    return job
+
+
+def run_job(job: IngestJob) -> Dict[str, Any]:
+    """Run a job on the calling thread (CLI) and return its final snapshot."""
+    _run(job)
+    return job.snapshot()
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    return job.snapshot() if job else None
+
+
+def list_jobs() -> List[Dict[str, Any]]:
+    """Summaries of known jobs, newest first (without per-document lists)."""
+    with _jobs_lock:
+        jobs = list(_jobs.values())
+    summaries = []
+    for job in reversed(jobs):
+        snap = job.snapshot()
+        snap.pop("document_ids")
+        snap["errors"] = len(snap["errors"])
+        summaries.append(snap)
+    return summaries
+
+
+def ingest_stats() -> Dict[str, Any]:
+    with _jobs_lock:
+        jobs = list(_jobs.values())
+    snaps = [j.snapshot() for j in jobs]
+    return {
+        "jobs": len(snaps),
+        "running": sum(1 for s in snaps if not s["finished_at"]),
+        "documents_uploaded": sum(s["uploaded"] for s in snaps),
+        "upload_workers": INGEST_UPLOAD_WORKERS,
+        "parse_batch_size": INGEST_PARSE_BATCH_SIZE,
+    }
@@ -0,0 +1,174 @@
+"""
+lesson_cache.py — generated lesson plans, cached and coalesced
+
+Each /api/lesson/generate call is a paid, multi-second Gemini request. Many
+admins generate the same class/subject/topic/board/language/duration
+combination, so generated plans are kept in an in-process LRU + TTL store.
+Keys are built from the normalised prompt inputs and the dataset's version
+(retrieval_cache.dataset_version), so uploading or re-parsing documents
+produces fresh plans.
+
+Both the store and that version are local to the worker process: an upload
+handled by another worker does not bump this worker's version. Plans are
+therefore only trusted for LESSON_CACHE_TTL, kept short so a plan never
+outlives a dataset change for long; pass regenerate=true to skip the cache.
+
+get_or_generate() is also single-flight: concurrent callers with the same key
+wait on the one in-flight generation and share its result or its exception.
+Streaming generation uses the same flight through begin(): the leader streams
+from Gemini and hands the plan to finish() (or its error to fail()), while
+followers wait and replay the finished plan.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+import retrieval_cache
+
+LESSON_CACHE_SIZE     = int(os.getenv("LESSON_CACHE_SIZE", "500"))
+LESSON_CACHE_TTL      = int(os.getenv("LESSON_CACHE_TTL", "900"))      # per-worker; bounds staleness after uploads elsewhere
+LESSON_CACHE_WAIT_SEC = float(os.getenv("LESSON_CACHE_WAIT_SEC", "180"))   # max wait on another request's generation
+
+Key = Tuple[Any, ...]
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done   = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+        self.error:  Optional[BaseException] = None
+
+
+_lock     = threading.Lock()
+_entries: "OrderedDict[Key, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_inflight: Dict[Key, _Flight] = {}
+_stats    = {"hits": 0, "misses": 0, "coalesced": 0, "errors": 0}
+
+
+def _norm(value: Any) -> str:
+    return " ".join(str(value or "").lower().split())
+
+
+def make_key(
+    class_name: str,
+    subject: str,
+    topic: str,
+    board: str,
+    language: str,
+    duration_minutes: int,
+    learning_objectives: Optional[Iterable[str]],
+    dataset_id: Optional[str],
+) -> Key:
+    return (
+        _norm(class_name), _norm(subject), _norm(topic), _norm(board), _norm(language),
+        int(duration_minutes),
+        tuple(_norm(o) for o in (learning_objectives or []) if _norm(o)),
+        dataset_id or "",
+        retrieval_cache.dataset_version(dataset_id or ""),
+    )
+
+
+def get(key: Key) -> Optional[Dict[str, Any]]:
+    """Cached plan for `key`, or None."""
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            _entries.move_to_end(key)
+            _stats["hits"] += 1
+            return entry[1]
+        _stats["misses"] += 1
+    return None
+
+
+def put(key: Key, result: Dict[str, Any]) -> None:
+    with _lock:
+        _entries[key] = (time.monotonic() + LESSON_CACHE_TTL, result)
+        _entries.move_to_end(key)
+        while len(_entries) > LESSON_CACHE_SIZE:
+            _entries.popitem(last=False)
+
+
+def begin(key: Key, refresh: bool = False) -> Tuple[Optional[Dict[str, Any]], str]:
+    """
+    Look `key` up, joining an identical in-flight generation if there is one.
+    Returns (plan, "hit"), (plan, "coalesced"), or (None, "miss"): the caller
+    now leads the flight and must end it with finish() or fail().
+    With refresh=True the cached plan is ignored (but still coalesced and replaced).
+    """
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and not refresh:
+            if entry[0] > time.monotonic():
+                _entries.move_to_end(key)
+                _stats["hits"] += 1
+                return entry[1], "hit"
+            del _entries[key]
+
+        flight = _inflight.get(key)
+        if flight is None:
+            _inflight[key] = _Flight()
+            _stats["misses"] += 1
+            return None, "miss"
+        _stats["coalesced"] += 1
+
+    if not flight.done.wait(LESSON_CACHE_WAIT_SEC):
+        raise TimeoutError("Timed out waiting for an identical lesson generation")
+    if flight.error is not None:
+        raise flight.error
+    return flight.result, "coalesced"
+
+
+def _land(key: Key, result: Optional[Dict[str, Any]] = None, error: Optional[BaseException] = None) -> None:
+    with _lock:
+        flight = _inflight.pop(key, None)
+    if flight is not None:
+        flight.result, flight.error = result, error
+        flight.done.set()
+
+
+def finish(key: Key, result: Dict[str, Any]) -> None:
+    """Cache the leader's plan and release everyone waiting on it."""
+    put(key, result)
+    _land(key, result=result)
+
+
+def fail(key: Key, error: BaseException) -> None:
+    """End the leader's flight with `error`, which every waiter re-raises."""
+    if not isinstance(error, Exception):
+        # GeneratorExit / KeyboardInterrupt belong to the leader, not to its followers
+        error = RuntimeError("An identical lesson generation was abandoned")
+    with _lock:
+        _stats["errors"] += 1
+    _land(key, error=error)
+
+
+def get_or_generate(key: Key, generate: Callable[[], Dict[str, Any]], refresh: bool = False) -> Tuple[Dict[str, Any], str]:
+    """
+    Return (result, status); status is "hit", "coalesced" or "miss".
+    With refresh=True the cached plan is ignored (but still coalesced and replaced).
+    """
+    result, status = begin(key, refresh)
+    if status != "miss":
+        return result, status
+    try:
+        result = generate()
+    except BaseException as e:
+        fail(key, e)
+        raise
+    finish(key, result)
+    return result, "miss"
+
+
+def lesson_cache_stats() -> Dict[str, Any]:
+    with _lock:
+        lookups = _stats["hits"] + _stats["misses"] + _stats["coalesced"]
+        return {
+            **_stats,
+            "size":      len(_entries),
+            "in_flight": len(_inflight),
+            "hit_rate":  round((_stats["hits"] + _stats["coalesced"]) / lookups, 4) if lookups else 0.0,
+        }
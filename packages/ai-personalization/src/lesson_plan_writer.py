@@ -0,0 +1,201 @@
+"""
+lesson_plan_writer.py — background writer for lesson_plans
+
+/api/lesson/generate used to insert the generated plan before responding.
+Rows are now given their id up front and put on a bounded queue, and the
+route answers with save: {"id", "status": "queued"}. A writer thread
+bulk-inserts them once LESSON_SAVE_BATCH_SIZE are waiting, or every
+LESSON_SAVE_FLUSH_SECONDS through SupabaseDB.bulk_insert, which retries a
+rejected batch row by row so a single bad row does not lose the rest.
+
+When a batch lands nothing at all, Supabase is taken to be unreachable: the
+rows are kept, no attempt is counted, and flushing pauses with exponential
+backoff (LESSON_SAVE_FLUSH_SECONDS doubling up to LESSON_SAVE_BACKOFF_MAX_SEC).
+Only a row refused while other rows in its batch were written counts as an
+attempt. After LESSON_SAVE_MAX_ATTEMPTS it goes to a bounded dead-letter list
+that writer_stats() reports and dead_letters() returns in full. When the
+queue is full the row is inserted inline instead of blocking the request on
+the queue (or kept for retry during a backoff). flush() runs at exit.
+"""
+import os
+import time
+import uuid
+import queue
+import atexit
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+from supabase_client import db
+
+LESSON_SAVE_QUEUE_SIZE    = int(os.getenv("LESSON_SAVE_QUEUE_SIZE", "1000"))
+LESSON_SAVE_BATCH_SIZE    = int(os.getenv("LESSON_SAVE_BATCH_SIZE", "50"))
+LESSON_SAVE_FLUSH_SECONDS = float(os.getenv("LESSON_SAVE_FLUSH_SECONDS", "1"))
+LESSON_SAVE_MAX_ATTEMPTS  = int(os.getenv("LESSON_SAVE_MAX_ATTEMPTS", "3"))
+LESSON_SAVE_DEAD_LETTERS  = int(os.getenv("LESSON_SAVE_DEAD_LETTERS", "100"))
+LESSON_SAVE_BACKOFF_MAX_SEC = float(os.getenv("LESSON_SAVE_BACKOFF_MAX_SEC", "300"))
+
+_queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=LESSON_SAVE_QUEUE_SIZE)
+_flush_lock  = threading.Lock()
+_wake        = threading.Event()
+_start_lock  = threading.Lock()
+_writer_pid  = None
+
+_stats_lock = threading.Lock()
+_stats = {"enqueued": 0, "inserted": 0, "inline": 0, "retried": 0, "failed": 0, "batches": 0, "unreachable": 0}
+_retry: List[Dict[str, Any]] = []                  # rejected rows waiting for the next flush
+_dead: "deque[Dict[str, Any]]" = deque(maxlen=LESSON_SAVE_DEAD_LETTERS)
+_backoff  = 0.0      # current pause after a batch that landed nothing
+_retry_at = 0.0      # monotonic time before which flush() does not write
+
+
+def _bump(name: str, n: int = 1) -> None:
+    with _stats_lock:
+        _stats[name] += n
+
+
+def _ensure_writer() -> None:
+    global _writer_pid
+    if _writer_pid == os.getpid():
+        return
+    with _start_lock:
+        if _writer_pid != os.getpid():
+            threading.Thread(target=_writer, name="lesson-plan-writer", daemon=True).start()
+            _writer_pid = os.getpid()
+
+
+def _backing_off() -> bool:
+    with _stats_lock:
+        return time.monotonic() < _retry_at
+
+
+def enqueue(row: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Queue a lesson_plans row; returns {"id", "status"}. Status is "queued",
+    or "saved" when the queue was full and the row was inserted inline (an
+    inline insert that does not land is left to the writer's retries: "queued").
+    """
+    row = {**row, "id": row.get("id") or str(uuid.uuid4())}
+    _ensure_writer()
+    try:
+        _queue.put_nowait(row)
+    except queue.Full:
+        _bump("inline")
+        if _backing_off():
+            # Supabase is down: hold it for the writer rather than fail the request
+            with _stats_lock:
+                _retry.append(row)
+            return {"id": row["id"], "status": "queued"}
+        # write it ourselves rather than hold the request or lose the plan
+        written = _insert([row])
+        return {"id": row["id"], "status": "saved" if written else "queued"}
+    _bump("enqueued")
+    if _queue.qsize() >= LESSON_SAVE_BATCH_SIZE:
+        _wake.set()
+    return {"id": row["id"], "status": "queued"}
+
+
+def _drain(limit: int) -> List[Dict[str, Any]]:
+    rows = []
+    while len(rows) < limit:
+        try:
+            rows.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    return rows
+
+
+def _insert(rows: List[Dict[str, Any]]) -> int:
+    """
+    Insert a batch and return how many rows were written. Rows that did not
+    land are kept for retry; only rows refused while Supabase was reachable
+    count as attempts (and are dead-lettered after the last one).
+    """
+    global _backoff, _retry_at
+    result = db.bulk_insert("lesson_plans", [{k: v for k, v in r.items() if k != "_attempts"} for r in rows])
+    if result["failed"] and not result["written"]:
+        # nothing landed: treat Supabase as unreachable and back off without charging the rows
+        with _stats_lock:
+            _retry.extend(rows)
+            _backoff = min(max(_backoff * 2, LESSON_SAVE_FLUSH_SECONDS), LESSON_SAVE_BACKOFF_MAX_SEC)
+            _retry_at = time.monotonic() + _backoff
+            _stats["unreachable"] += 1
+            delay = _backoff
+        print(f"[WARN] lesson_plans insert of {len(rows)} rows failed, retrying in {delay:.1f}s: {result['failed'][0]['error']}")
+        return 0
+
+    with _stats_lock:
+        _backoff = 0.0
+        _stats["inserted"] += result["written"]
+    for failure in result["failed"]:
+        row = rows[failure["index"]]
+        row["_attempts"] = row.get("_attempts", 0) + 1
+        print(f"[WARN] lesson_plans insert rejected {row['id']} (attempt {row['_attempts']}): {failure['error']}")
+        with _stats_lock:
+            if row["_attempts"] < LESSON_SAVE_MAX_ATTEMPTS:
+                _retry.append(row)
+                _stats["retried"] += 1
+                continue
+            if len(_dead) == _dead.maxlen:
+                print(f"[WARN] lesson_plans dead-letter list full, discarding {_dead[0]['id']}")
+            _dead.append({**row, "error": failure["error"], "failed_at": datetime.now(timezone.utc).isoformat()})
+            _stats["failed"] += 1
+    return result["written"]
+
+
+def flush(ignore_backoff: bool = False) -> None:
+    """Write everything currently queued, plus rows held back for retry."""
+    with _flush_lock:
+        if _backing_off() and not ignore_backoff:
+            return
+        with _stats_lock:
+            pending = _retry[:]
+            _retry.clear()
+        while True:
+            # retried rows share batches with fresh ones, so a bad row cannot pass for an outage
+            rows = pending[:LESSON_SAVE_BATCH_SIZE]
+            del pending[:LESSON_SAVE_BATCH_SIZE]
+            rows += _drain(LESSON_SAVE_BATCH_SIZE - len(rows))
+            if not rows:
+                return
+            _bump("batches")
+            _insert(rows)
+            if _backing_off():
+                with _stats_lock:
+                    _retry.extend(pending)
+                return
+
+
+def _writer() -> None:
+    while True:
+        _wake.wait(LESSON_SAVE_FLUSH_SECONDS)
+        _wake.clear()
+        try:
+            flush()
+        except Exception as e:
+            print(f"[WARN] lesson plan flush failed: {e}")
+
+
+def dead_letters() -> List[Dict[str, Any]]:
+    """Rows that exhausted LESSON_SAVE_MAX_ATTEMPTS, with the last error (oldest first)."""
+    with _stats_lock:
+        return list(_dead)
+
+
+def writer_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        return {
+            **_stats,
+            "queue_depth": _queue.qsize(),
+            "queue_capacity": LESSON_SAVE_QUEUE_SIZE,
+            "retry_pending": len(_retry),
+            "backoff_s": round(max(0.0, _retry_at - time.monotonic()), 1),
+            "dead_letters": [
+                {"id": r["id"], "teacher_id": r.get("teacher_id"), "error": r["error"], "failed_at": r["failed_at"]}
+                for r in _dead
+            ],
+        }
+
+
+atexit.register(flush, ignore_backoff=True)
@@ -15,8 +15,10 @@ Saved-plan reads are scoped to the requesting teacher.
 """
 # TODO : Still working on all of these , a base defination has been set and WILL need updates.
 import json
+import threading
 import traceback
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, List, Optional
 
 import google.generativeai as genai
@@ -25,6 +27,12 @@ import jwt as pyjwt
 import os
 
 import ragflow_client as rf
+import ragflow_async_client as arf
+import dataset_routing
+import lesson_cache
+import lesson_plan_writer
+from incremental_json import IncrementalJSONScanner
+from auth.token_cache import cached_decode
 from supabase_client import db
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -37,6 +45,14 @@ JWT_SECRET = os.getenv("JWT_SECRET", "your-super-secret-key")
 DEFAULT_DATASET_NAME = os.getenv("RAGFLOW_DEFAULT_DATASET", "gurusikshan-ncert")
 DEFAULT_CHAT_ID = os.getenv("RAGFLOW_CHAT_ID", "")
 
+LESSON_PIPELINE_WORKERS = int(os.getenv("LESSON_PIPELINE_WORKERS", "8"))
+
+# runs speculative retrievals while the routing tables are still loading
+_pipeline = ThreadPoolExecutor(max_workers=LESSON_PIPELINE_WORKERS, thread_name_prefix="lesson-pipeline")
+# last dataset each board routed to; the speculative retrieval targets it
+_routed_lock = threading.Lock()
+_routed_by_board: Dict[str, str] = {}
+
 if os.getenv("GEMINI_API_KEY"):
     genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
@@ -47,6 +63,13 @@ if os.getenv("GEMINI_API_KEY"):
 from functools import wraps
 
 
+def _decode_dashboard_token(token: str) -> Dict[str, Any]:
+    return pyjwt.decode(
+        token, JWT_SECRET, algorithms=["HS256"],
+        options={"verify_aud": False}
+    )
+
+
 def require_jwt(auth_required: bool = True):
     def decorator(f):
         @wraps(f)
@@ -60,10 +83,7 @@ def require_jwt(auth_required: bool = True):
 
             token = auth_header.split(" ")[1]
             try:
-                payload = pyjwt.decode(
-                    token, JWT_SECRET, algorithms=["HS256"],
-                    options={"verify_aud": False}
-                )
+                payload = cached_decode(token, _decode_dashboard_token, "dashboard")
                 g.user = payload
             except pyjwt.ExpiredSignatureError:
                 if auth_required:
@@ -111,27 +131,15 @@ def _clean_gemini_json(text: str) -> Dict[str, Any]:
 def _resolve_dataset_id(board: str = "CBSE", explicit_dataset_id: str = "") -> str:
     """
     Dynamically maps the requested school board to a live RAGFlow dataset UUID
-    using the resource_source_routing database table.
+    using the resource_source_routing table, cached by dataset_routing.
     """
     if explicit_dataset_id:
         return explicit_dataset_id
 
-    try:
-        result = (
-            db.client.table("resource_source_routing")
-            .select("ragflow_dataset_id")
-            .eq("board", board)
-            .eq("is_active", True)
-            .order("priority", desc=True) 
-            .execute()
-        )
-        
-        if result.data and len(result.data) > 0:
-            resolved_id = result.data[0].get("ragflow_dataset_id")
-            if resolved_id:
-                return resolved_id
-    except Exception as err:
-        print(f"[WARN] Database lookup on resource_source_routing failed: {err}")
+    # served from the in-memory routing table (see dataset_routing)
+    resolved_id = dataset_routing.board_dataset_id(board)
+    if resolved_id:
+        return resolved_id
 
     fallback_id = os.getenv("RAGFLOW_DEFAULT_DATASET_ID")
     if not fallback_id:
@@ -225,6 +233,173 @@ Return ONLY valid JSON (no markdown fences) with this exact structure:
 # Routes
 # ─────────────────────────────────────────────────────────────────────────────
 
+# ── Generation helpers (shared by /generate and /generate/stream) ──────────
+
+# Values in the Gemini JSON that /generate/stream emits as soon as they close
+_STREAM_EVENTS = {
+    ("lesson", "learning_objectives"):  "learning_objectives",
+    ("lesson", "sections", "*"):        "section",
+    ("assignment", "questions", "*"):   "question",
+}
+
+
+def _lesson_request(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Normalise a generate request body; raises ValueError if required fields are missing."""
+    req = {
+        "class_name":       (data.get("class_name") or "").strip(),
+        "subject":          (data.get("subject")    or "").strip(),
+        "topic":            (data.get("topic")      or "").strip(),
+        "teacher_id":       data.get("teacher_id", "") or "",
+        "dataset_name":     (data.get("dataset_name") or DEFAULT_DATASET_NAME).strip(),
+        "dataset_id_param": (data.get("dataset_id")   or "").strip(),
+        "duration_minutes": int(data.get("duration_minutes", 45)),
+        "language":         (data.get("language", "English") or "English").strip(),
+        "board":            (data.get("board",    "CBSE")    or "CBSE").strip(),
+        "learning_objectives": data.get("learning_objectives") or [],
+        "auto_save":        bool(data.get("save", False)),
+        "regenerate":       bool(data.get("regenerate", False)),
+    }
+    if not all([req["class_name"], req["subject"], req["topic"]]):
+        raise ValueError("class_name, subject, and topic are required")
+    return req
+
+
+def _retrieve_lesson_chunks(req: Dict[str, Any], dataset_id: str) -> List[Dict[str, Any]]:
+    # Execute the raw vector lookup against the determined dataset UUID
+    return rf.retrieve_chunks(
+        question=f"{req['class_name']} {req['subject']} {req['topic']}",
+        dataset_ids=[dataset_id],
+        top_k=5,
+        similarity_threshold=0.2,
+    )
+
+
+def _ms(since: float) -> int:
+    return int((time.perf_counter() - since) * 1000)
+
+
+def _lesson_rag_context(req: Dict[str, Any], timings: Optional[Dict[str, Any]] = None):
+    """
+    Resolve the dataset and pull chunks; returns (dataset_id or None, chunks).
+
+    Routing is normally an in-memory lookup (dataset_routing), so retrieval
+    simply follows it. Only while this process is still loading the routing
+    tables does retrieval start speculatively against the board's last routed
+    dataset (or RAGFLOW_DEFAULT_DATASET_ID). That result is used only if
+    routing agrees; otherwise retrieval is repeated against the routed dataset.
+    A losing speculative retrieval cannot be stopped once it has started, so it
+    runs to completion and is discarded.
+    """
+    timings = {} if timings is None else timings
+    start = time.perf_counter()
+    explicit = req["dataset_id_param"]
+    speculative, guess = None, ""
+    if not explicit and not dataset_routing.loaded():
+        with _routed_lock:
+            guess = _routed_by_board.get(req["board"]) or os.getenv("RAGFLOW_DEFAULT_DATASET_ID", "")
+        if guess:
+            speculative = _pipeline.submit(_retrieve_lesson_chunks, req, guess)
+    try:
+        dataset_id = _resolve_dataset_id(board=req["board"], explicit_dataset_id=explicit)
+        timings["routing_ms"] = _ms(start)
+        if not explicit:
+            with _routed_lock:
+                _routed_by_board[req["board"]] = dataset_id
+
+        timings["speculative_hit"] = speculative is not None and dataset_id == guess
+        if timings["speculative_hit"]:
+            chunks = speculative.result()
+        else:
+            if speculative is not None:
+                speculative.cancel()    # only helps if it has not started yet
+            chunks = _retrieve_lesson_chunks(req, dataset_id)
+        timings["context_ms"] = _ms(start)
+        return dataset_id, chunks
+    except Exception as rag_err:
+        print(f"[WARN] RAG context fetch failed: {rag_err}")
+        timings["context_ms"] = _ms(start)
+        return None, []
+
+
+def _lesson_prompt(req: Dict[str, Any], chunks: List[Dict[str, Any]]) -> str:
+    chunk_context = ""
+    if chunks:
+        chunk_context = "\n\nReference material from NCERT/dataset:\n" + "\n---\n".join(
+            c.get("content", "") for c in chunks[:4] if c.get("content")
+        )
+    return _build_lesson_prompt(
+        class_name=req["class_name"],
+        subject=req["subject"],
+        topic=req["topic"],
+        duration_minutes=req["duration_minutes"],
+        chunk_context=chunk_context,
+        language=req["language"],
+        board=req["board"],
+        learning_objectives=req["learning_objectives"],
+    )
+
+
+def _lesson_model():
+    return genai.GenerativeModel(
+        "gemini-2.5-flash",
+        generation_config={
+            "temperature": 0.7,
+            "response_mime_type": "application/json",
+        },
+    )
+
+
+def _lesson_cache_key(req: Dict[str, Any], dataset_id: Optional[str]):
+    return lesson_cache.make_key(
+        req["class_name"], req["subject"], req["topic"], req["board"], req["language"],
+        req["duration_minutes"], req["learning_objectives"], dataset_id,
+    )
+
+
+def _save_lesson_plan(req: Dict[str, Any], lesson, assignment, dataset_id, rag_chunks_used: int) -> Optional[Dict[str, Any]]:
+    """Queue a lesson_plans row when save was requested; returns {"id", "status"} or None."""
+    if not (req["auto_save"] and req["teacher_id"] and lesson):
+        return None
+    try:
+        return lesson_plan_writer.enqueue({
+            "teacher_id":    req["teacher_id"],
+            "class_name":    req["class_name"],
+            "subject":       req["subject"],
+            "topic":         req["topic"],
+            "board":         req["board"],
+            "language":      req["language"],
+            "duration_minutes": req["duration_minutes"],
+            "lesson_json":   json.dumps(lesson),
+            "assignment_json": json.dumps(assignment) if assignment else None,
+            "dataset_id":    dataset_id or None,
+            "rag_chunks_used": rag_chunks_used,
+            "status":        "generated",
+        })
+    except Exception as save_err:
+        print(f"[WARN] Auto-save to lesson_plans failed: {save_err}")
+    return None
+
+
+def _saved_id(save: Optional[Dict[str, Any]]) -> Optional[str]:
+    """The lesson_plans id once the row is known to exist (a queued row may still fail)."""
+    return save["id"] if save and save["status"] == "saved" else None
+
+
+def _stream_event(path, value) -> Dict[str, Any]:
+    """SSE payload for a value completed by the incremental scanner."""
+    kind = next(
+        name for pattern, name in _STREAM_EVENTS.items()
+        if len(pattern) == len(path) and all(p in ("*", k) for p, k in zip(pattern, path))
+    )
+    if kind == "learning_objectives":
+        return {"type": kind, "learning_objectives": value}
+    return {"type": kind, "index": path[-1], kind: value}
+
+
+def _sse(payload: Any) -> str:
+    return f"data: {json.dumps(payload)}\n\n"
+
+
 # ── 1. Generate a lesson plan (Gemini + RAGFlow context) ─────────────────────
 # WORKS
 @lesson_bp.route("/generate", methods=["POST"])
@@ -246,113 +421,54 @@ def generate_lesson():
       board            str  optional  default "CBSE"
       learning_objectives list[str] optional
       save             bool optional  default False — auto-save to Supabase
+                                         (written in the background: saved_id stays
+                                         null until the row is written, and save is
+                                         {"id", "status": "queued" | "saved"})
+      regenerate       bool optional  default False — bypass the generated-plan cache
+
+    The response includes per-stage `timings` (routing_ms, context_ms,
+    speculative_hit, generation_ms, total_ms).
     """
     try:
-        data = request.json or {}
-        class_name = (data.get("class_name") or "").strip()
-        subject    = (data.get("subject")    or "").strip()
-        topic      = (data.get("topic")      or "").strip()
-
-        if not all([class_name, subject, topic]):
-            return jsonify(error="class_name, subject, and topic are required"), 400
-
-        teacher_id       = data.get("teacher_id", "") or ""
-        dataset_name     = (data.get("dataset_name") or DEFAULT_DATASET_NAME).strip()
-        dataset_id_param = (data.get("dataset_id")   or "").strip()
-        duration_minutes = int(data.get("duration_minutes", 45))
-        language         = (data.get("language", "English") or "English").strip()
-        board            = (data.get("board",    "CBSE")    or "CBSE").strip()
-        learning_objectives: List[str] = data.get("learning_objectives") or []
-        auto_save        = bool(data.get("save", False))
-
-        # Pull RAG context
-        dataset_id = ""
-        chunks: List[Dict[str, Any]] = []
+        started = time.perf_counter()
+        timings: Dict[str, Any] = {}
         try:
-            dataset_id = _resolve_dataset_id(
-                board=board,
-                explicit_dataset_id=dataset_id_param
-            )
-            
-            # Execute the raw vector lookup against the determined dataset UUID
-            chunks = rf.retrieve_chunks(
-                question=f"{class_name} {subject} {topic}",
-                dataset_ids=[dataset_id],
-                top_k=5,
-                similarity_threshold=0.2,
-            )
-        except Exception as rag_err:
-            print(f"[WARN] RAG context fetch failed: {rag_err}")
-            dataset_id = None
-            chunks = []
-
-        chunk_context = ""
-        if chunks:
-            chunk_context = "\n\nReference material from NCERT/dataset:\n" + "\n---\n".join(
-                c.get("content", "") for c in chunks[:4] if c.get("content")
-            )
+            req = _lesson_request(request.json or {})
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
 
-        # Build prompt & call Gemini
-        prompt = _build_lesson_prompt(
-            class_name=class_name,
-            subject=subject,
-            topic=topic,
-            duration_minutes=duration_minutes,
-            chunk_context=chunk_context,
-            language=language,
-            board=board,
-            learning_objectives=learning_objectives,
-        )
+        # Pull RAG context (see _lesson_rag_context for when retrieval is speculative)
+        dataset_id, chunks = _lesson_rag_context(req, timings)
 
-        model = genai.GenerativeModel(
-            "gemini-2.5-flash",
-            generation_config={
-                "temperature": 0.7,
-                "response_mime_type": "application/json",
-            },
+        def _generate() -> Dict[str, Any]:
+            response = _lesson_model().generate_content(_lesson_prompt(req, chunks))
+            return _clean_gemini_json(response.text)
+
+        # identical requests share one cached / in-flight generation
+        stage = time.perf_counter()
+        result, cache_status = lesson_cache.get_or_generate(
+            _lesson_cache_key(req, dataset_id), _generate, refresh=req["regenerate"]
         )
-        response = model.generate_content(prompt)
-        result   = _clean_gemini_json(response.text)
+        timings["generation_ms"] = _ms(stage)
 
         lesson     = result.get("lesson")
         assignment = result.get("assignment")
 
-        # Optionally save to Supabase , normally dont ig 
-        saved_id = None
-        if auto_save and teacher_id and lesson:
-            try:
-                insert_result = (
-                    db.client.table("lesson_plans")
-                    .insert({
-                        "teacher_id":    teacher_id,
-                        "class_name":    class_name,
-                        "subject":       subject,
-                        "topic":         topic,
-                        "board":         board,
-                        "language":      language,
-                        "duration_minutes": duration_minutes,
-                        "lesson_json":   json.dumps(lesson),
-                        "assignment_json": json.dumps(assignment) if assignment else None,
-                        "dataset_id":    dataset_id or None,
-                        "rag_chunks_used": len(chunks),
-                        "status":        "generated",
-                    })
-                    .execute()
-                )
-                saved = insert_result.data
-                if saved:
-                    saved_id = (saved[0] if isinstance(saved, list) else saved).get("id")
-            except Exception as save_err:
-                print(f"[WARN] Auto-save to lesson_plans failed: {save_err}")
+        # Optionally save to Supabase , handed to the background writer
+        save = _save_lesson_plan(req, lesson, assignment, dataset_id, len(chunks))
+        timings["total_ms"] = _ms(started)
 
         return jsonify(
             success=True,
             lesson=lesson,
             assignment=assignment,
             dataset_id=dataset_id or None,
-            dataset_name=dataset_name,
+            dataset_name=req["dataset_name"],
             rag_chunks_used=len(chunks),
-            saved_id=saved_id,
+            saved_id=_saved_id(save),
+            save=save,
+            cache=cache_status,
+            timings=timings,
         )
 
     except json.JSONDecodeError as e:
@@ -363,6 +479,96 @@ def generate_lesson():
         return jsonify(error=str(e)), 500
 
 
+# ── 1b. Generate a lesson plan as Server-Sent Events ─────────────────────────
+@lesson_bp.route("/generate/stream", methods=["POST"])
+@require_jwt(auth_required=True)
+@require_admin_or_higher()
+def generate_lesson_stream():
+    """
+    Same body as /generate, streamed as SSE while Gemini writes the plan.
+
+    Events (each `data: {...}`):
+      {"type": "context", "dataset_id", "rag_chunks_used"}
+      {"type": "learning_objectives", "learning_objectives": [...]}
+      {"type": "section",  "index": n, "section":  {...}}   one per lesson section
+      {"type": "question", "index": n, "question": {...}}   one per assignment question
+      {"type": "done", "lesson", "assignment", "saved_id", "save", "cache", "timings"}
+    then `data: [DONE]`. Failures are sent as {"type": "error", "error": "..."}.
+    A cached plan, or one an identical request is generating right now, is
+    replayed through the same events.
+    """
+    try:
+        req = _lesson_request(request.json or {})
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    def event_stream():
+        try:
+            started = time.perf_counter()
+            timings: Dict[str, Any] = {}
+            dataset_id, chunks = _lesson_rag_context(req, timings)
+            yield _sse({"type": "context", "dataset_id": dataset_id, "rag_chunks_used": len(chunks)})
+
+            cache_key = _lesson_cache_key(req, dataset_id)
+            stage = time.perf_counter()
+            # waits here if an identical plan is already being generated
+            result, cache_status = lesson_cache.begin(cache_key, refresh=req["regenerate"])
+
+            if cache_status == "miss":
+                try:
+                    scanner = IncrementalJSONScanner(_STREAM_EVENTS)
+                    stream = _lesson_model().generate_content(_lesson_prompt(req, chunks), stream=True)
+                    for part in stream:
+                        for path, value in scanner.feed(part.text or ""):
+                            timings.setdefault("first_event_ms", _ms(started))
+                            yield _sse(_stream_event(path, value))
+                    result = _clean_gemini_json(scanner.text)
+                except BaseException as e:
+                    lesson_cache.fail(cache_key, e)
+                    raise
+                lesson_cache.finish(cache_key, result)
+            else:
+                # replay the cached (or just generated) plan through the same events
+                scanner = IncrementalJSONScanner(_STREAM_EVENTS)
+                for path, value in scanner.feed(json.dumps(result)):
+                    yield _sse(_stream_event(path, value))
+
+            timings["generation_ms"] = _ms(stage)
+
+            lesson     = result.get("lesson")
+            assignment = result.get("assignment")
+            save       = _save_lesson_plan(req, lesson, assignment, dataset_id, len(chunks))
+            timings["total_ms"] = _ms(started)
+            yield _sse({
+                "type": "done",
+                "lesson": lesson,
+                "assignment": assignment,
+                "dataset_id": dataset_id or None,
+                "dataset_name": req["dataset_name"],
+                "saved_id": _saved_id(save),
+                "save": save,
+                "cache": cache_status,
+                "timings": timings,
+            })
+        except json.JSONDecodeError as e:
+            traceback.print_exc()
+            yield _sse({"type": "error", "error": f"Gemini JSON parse error: {e}"})
+        except Exception as e:
+            traceback.print_exc()
+            yield _sse({"type": "error", "error": str(e)})
+        yield "data: [DONE]\n\n"
+
+    return Response(
+        stream_with_context(event_stream()),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "Connection": "keep-alive",
+        },
+    )
+
+
 # ── Topic retrieval (RAG-only, no LLM) ───────────────────────────────────
 # Not tested haha
 @lesson_bp.route("/context", methods=["POST"])
@@ -374,8 +580,9 @@ def get_topic_context():
 
     Request body:
       question     str  required
-      dataset_name str  optional
+      board        str  optional  default "CBSE" — used to route to a dataset
       dataset_id   str  optional
+      dataset_ids  list[str] optional — queried concurrently and merged
       top_k        int  optional  default 6
       similarity_threshold float optional default 0.2
     """
@@ -385,23 +592,34 @@ def get_topic_context():
         if not question:
             return jsonify(error="question required"), 400
 
-        dataset_id = _resolve_dataset_id(
-            dataset_id=(data.get("dataset_id") or "").strip(),
-            dataset_name=(data.get("dataset_name") or DEFAULT_DATASET_NAME).strip(),
-        )
+        dataset_ids = [str(d) for d in (data.get("dataset_ids") or []) if d]
+        if not dataset_ids:
+            dataset_ids = [_resolve_dataset_id(
+                board=(data.get("board") or "CBSE").strip(),
+                explicit_dataset_id=(data.get("dataset_id") or "").strip(),
+            )]
         top_k                = int(data.get("top_k", 6))
         similarity_threshold = float(data.get("similarity_threshold", 0.2))
 
-        chunks = rf.retrieve_chunks(
-            question=question,
-            dataset_ids=[dataset_id],
-            top_k=top_k,
-            similarity_threshold=similarity_threshold,
-        )
+        if len(dataset_ids) > 1:
+            chunks = arf.run(arf.retrieve_chunks_multi(
+                question=question,
+                dataset_ids=dataset_ids,
+                top_k=top_k,
+                similarity_threshold=similarity_threshold,
+            ))
+        else:
+            chunks = rf.retrieve_chunks(
+                question=question,
+                dataset_ids=dataset_ids,
+                top_k=top_k,
+                similarity_threshold=similarity_threshold,
+            )
 
         return jsonify(
             success=True,
-            dataset_id=dataset_id,
+            dataset_id=dataset_ids[0],
+            dataset_ids=dataset_ids,
             chunks=chunks,
             count=len(chunks),
         )
@@ -1,10 +1,31 @@
+"""
+Background audit log pipeline for api_request_logs.
+
+log_request() only builds the row and puts it on a bounded in-memory queue;
+a flusher thread bulk-inserts rows once AUDIT_BATCH_SIZE are waiting or every
+AUDIT_FLUSH_SECONDS. If Supabase rejects a batch it is appended to a JSONL
+spill file and replayed after the next successful flush, by one worker at a
+time under an flock. The replay inserts row by row where needed, so a single
+bad row is dropped instead of holding the rest of the spill back. When the queue is full new rows are dropped and
+counted rather than blocking the request.
+"""
 import os
+import json
 import time
 import uuid
+import queue
+import fcntl
+import atexit
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timezone
 from flask import request, g
 from supabase import create_client
 from dotenv import load_dotenv, find_dotenv
 
+from supabase_client import db
+
 # Load environment variables
 load_dotenv(find_dotenv(), override=False)
 
@@ -12,11 +33,49 @@ SUPABASE_URL = os.environ["SUPABASE_URL"]
 SUPABASE_KEY = os.environ["SUPABASE_SERVICE_ROLE_KEY"]
 _sb = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+AUDIT_QUEUE_SIZE    = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_BATCH_SIZE    = int(os.getenv("AUDIT_BATCH_SIZE", "200"))
+AUDIT_FLUSH_SECONDS = float(os.getenv("AUDIT_FLUSH_SECONDS", "2"))
+AUDIT_SPILL_PATH    = os.getenv("AUDIT_SPILL_PATH") or os.path.join(
+    tempfile.gettempdir(), "guru-sikshan-audit-spill.jsonl"
+)
+
+# a spilled row whose whole batch is rejected this many replays in a row is dropped
+_MAX_REPLAYS = 5
+
+_queue: "queue.Queue[dict]" = queue.Queue(maxsize=AUDIT_QUEUE_SIZE)
+_flush_lock   = threading.Lock()      # one flush (thread or atexit) at a time
+_wake         = threading.Event()     # set when a full batch is waiting
+_start_lock   = threading.Lock()
+_flusher_pid  = None
+
+_stats_lock = threading.Lock()
+_stats = {
+    "enqueued": 0, "inserted": 0, "dropped": 0, "spilled": 0, "replayed": 0,
+    "rejected": 0, "failed_flushes": 0, "flusher_errors": 0,
+}
+
+
+def _bump(name: str, n: int = 1) -> None:
+    with _stats_lock:
+        _stats[name] += n
+
+
+def _ensure_flusher() -> None:
+    # started lazily (and again after a fork) so every worker owns a live thread
+    global _flusher_pid
+    if _flusher_pid == os.getpid():
+        return
+    with _start_lock:
+        if _flusher_pid != os.getpid():
+            threading.Thread(target=_flusher, name="audit-flusher", daemon=True).start()
+            _flusher_pid = os.getpid()
+
 
 def log_request(endpoint: str, status_code: int, start_time: float, error: str = None):
-    """Fire-and-forget audit log. Never raises."""
+    """Fire-and-forget audit log. Never raises, never blocks."""
     try:
-        _sb.table("api_request_logs").insert({
+        row = {
             "client_id":    getattr(g, "client_id", None),
             "endpoint":     endpoint,
             "status_code":  status_code,
@@ -24,6 +83,160 @@ def log_request(endpoint: str, status_code: int, start_time: float, error: str =
             "ip_address":   request.remote_addr,
             "request_id":   str(uuid.uuid4()),
             "error_message": error,
-        }).execute()
+            "created_at":   datetime.now(timezone.utc).isoformat(),
+        }
+        _ensure_flusher()
+        _queue.put_nowait(row)
+        _bump("enqueued")
+        if _queue.qsize() >= AUDIT_BATCH_SIZE:
+            _wake.set()
+    except queue.Full:
+        _bump("dropped")
     except Exception:
         pass
+
+
+def _drain(limit: int) -> list[dict]:
+    rows = []
+    while len(rows) < limit:
+        try:
+            rows.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    return rows
+
+
+def _insert(rows: list[dict]) -> bool:
+    try:
+        _sb.table("api_request_logs").insert(rows).execute()
+        return True
+    except Exception as e:
+        print(f"[WARN] audit log insert of {len(rows)} rows failed: {e}")
+        return False
+
+
+def _spill(rows: list[dict]) -> None:
+    try:
+        with open(AUDIT_SPILL_PATH, "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+        _bump("spilled", len(rows))
+    except OSError as e:
+        print(f"[WARN] audit spill to {AUDIT_SPILL_PATH} failed, dropping {len(rows)} rows: {e}")
+        _bump("dropped", len(rows))
+
+
+def _read_spill(path: str) -> list[dict]:
+    rows = []
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError as e:
+                # a torn write (crash mid-line) must not cost the rest of the file
+                print(f"[WARN] skipping bad audit spill line {n}: {e}")
+                _bump("dropped")
+    return rows
+
+
+def _replay_spill() -> None:
+    """
+    Re-insert spilled rows once Supabase is reachable again. Every worker
+    shares the spill file, so one replay runs at a time under an flock on
+    AUDIT_SPILL_PATH + ".lock"; a worker that finds it held skips this round.
+    """
+    try:
+        lock = open(AUDIT_SPILL_PATH + ".lock", "a")
+    except OSError as e:
+        print(f"[WARN] audit spill replay failed: {e}")
+        return
+    try:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        _replay_locked()
+    finally:
+        lock.close()   # releases the flock
+
+
+def _replay_locked() -> None:
+    # caller holds the spill flock
+    replaying = AUDIT_SPILL_PATH + ".replay"
+    try:
+        if os.path.exists(replaying):
+            # only a replay that died leaves this behind (its flock went with it): fold it back
+            with open(replaying, "rb") as src, open(AUDIT_SPILL_PATH, "ab") as dst:
+                shutil.copyfileobj(src, dst)
+            os.unlink(replaying)
+        if not os.path.exists(AUDIT_SPILL_PATH):
+            return
+        os.replace(AUDIT_SPILL_PATH, replaying)
+        rows = _read_spill(replaying)
+    except OSError as e:
+        print(f"[WARN] audit spill replay failed: {e}")
+        return
+
+    for i in range(0, len(rows), AUDIT_BATCH_SIZE):
+        batch = rows[i:i + AUDIT_BATCH_SIZE]
+        result = db.bulk_insert(
+            "api_request_logs", [{k: v for k, v in r.items() if k != "_replays"} for r in batch]
+        )
+        if result["written"]:
+            # Supabase is up, so rows it refused one by one are bad data
+            _bump("replayed", result["written"])
+            _bump("rejected", len(result["failed"]))
+            continue
+        # nothing landed: still down (or an all-bad batch); keep the rest for next time
+        retry = []
+        for row in batch:
+            row["_replays"] = row.get("_replays", 0) + 1
+            if row["_replays"] < _MAX_REPLAYS:
+                retry.append(row)
+        _bump("rejected", len(batch) - len(retry))
+        remainder = retry + rows[i + AUDIT_BATCH_SIZE:]
+        if remainder:
+            _spill(remainder)
+        break
+    try:
+        os.unlink(replaying)
+    except OSError as e:
+        print(f"[WARN] could not remove {replaying}: {e}")
+
+
+def flush() -> None:
+    """Write everything currently queued."""
+    with _flush_lock:
+        while True:
+            rows = _drain(AUDIT_BATCH_SIZE)
+            if not rows:
+                return
+            if _insert(rows):
+                _bump("inserted", len(rows))
+                _replay_spill()
+            else:
+                _bump("failed_flushes")
+                _spill(rows)
+                return
+
+
+def _flusher() -> None:
+    while True:
+        _wake.wait(AUDIT_FLUSH_SECONDS)
+        _wake.clear()
+        try:
+            flush()
+        except Exception as e:
+            # the thread must outlive any one bad flush, or logging stops for good
+            print(f"[WARN] audit flush failed: {e}")
+            _bump("flusher_errors")
+
+
+def audit_stats() -> dict:
+    with _stats_lock:
+        return {**_stats, "queue_depth": _queue.qsize(), "queue_capacity": AUDIT_QUEUE_SIZE}
+
+
+atexit.register(flush)
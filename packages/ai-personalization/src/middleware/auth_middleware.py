@@ -2,6 +2,7 @@ import functools
 import jwt as pyjwt
 from flask import request, jsonify, g
 from auth.token_utils import verify_token
+from auth.token_cache import cached_decode
 
 
 def require_token(*required_scopes: str):
@@ -21,7 +22,7 @@ def require_token(*required_scopes: str):
 
             token = auth_header.removeprefix("Bearer ").strip()
             try:
-                payload = verify_token(token)
+                payload = cached_decode(token, verify_token, "public")
             except pyjwt.ExpiredSignatureError:
                 return jsonify({"error": "token_expired", "message": "Token has expired"}), 401
             except pyjwt.PyJWTError as e:
@@ -0,0 +1,354 @@
+"""
+Storage backends for middleware.rate_limiter.
+
+Every backend implements one atomic operation, check(key, max_calls,
+window_seconds) -> bool. It decides whether the call is allowed and records
+it in the same step. Pick one with RATE_LIMIT_BACKEND:
+
+  memory  per-process token buckets (default; single worker / dev)
+  shm     mmap'd counter table shared by every worker on one host
+  redis   any Redis-protocol server, shared across hosts
+
+The shm and redis backends use a sliding-window counter: the current and
+previous fixed windows are blended by how far we are into the current one.
+This is O(1) and needs only integer counters.
+"""
+import os
+import mmap
+import time
+import fcntl
+import socket
+import struct
+import hashlib
+import tempfile
+import threading
+from urllib.parse import urlparse
+
+
+class RateLimitBackend:
+    name = "base"
+
+    def check(self, key: str, max_calls: int, window_seconds: int) -> bool:
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+
+def _sliding_estimate(prev: int, curr: int, window_seconds: int, now: float) -> float:
+    elapsed = (now % window_seconds) / window_seconds
+    return prev * (1.0 - elapsed) + curr
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# memory — per-process token buckets
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+class _Stripe:
+    __slots__ = ("lock", "buckets", "next_sweep")
+
+    def __init__(self, sweep_interval: float):
+        self.lock = threading.Lock()
+        # key -> [tokens, last_refill, capacity, refill_per_sec]
+        self.buckets: dict[str, list[float]] = {}
+        self.next_sweep = time.monotonic() + sweep_interval
+
+
+class MemoryBackend(RateLimitBackend):
+    """
+    A bucket holds up to `max_calls` tokens and refills at
+    max_calls / window_seconds per second. Buckets are spread over lock
+    stripes, and a stripe's full (idle) buckets are swept out periodically.
+    """
+    name = "memory"
+
+    def __init__(self, stripes: int = 64, sweep_interval: float = 60.0):
+        self.sweep_interval = sweep_interval
+        self._stripes = [_Stripe(sweep_interval) for _ in range(stripes)]
+
+    def _sweep(self, stripe: _Stripe, now: float) -> None:
+        """Drop buckets that would have refilled completely (caller holds the lock)."""
+        idle = [
+            key for key, (tokens, last, capacity, rate) in stripe.buckets.items()
+            if tokens + (now - last) * rate >= capacity
+        ]
+        for key in idle:
+            del stripe.buckets[key]
+        stripe.next_sweep = now + self.sweep_interval
+
+    def check(self, key: str, max_calls: int, window_seconds: int) -> bool:
+        now = time.monotonic()
+        stripe = self._stripes[hash(key) % len(self._stripes)]
+        with stripe.lock:
+            if now >= stripe.next_sweep:
+                self._sweep(stripe, now)
+
+            bucket = stripe.buckets.get(key)
+            if bucket is None:
+                stripe.buckets[key] = [max_calls - 1.0, now, float(max_calls), max_calls / window_seconds]
+                return True
+
+            tokens, last, capacity, rate = bucket
+            tokens = min(capacity, tokens + (now - last) * rate)
+            bucket[1] = now
+            if tokens < 1.0:
+                bucket[0] = tokens
+                return False
+            bucket[0] = tokens - 1.0
+        return True
+
+    def stats(self) -> dict:
+        tracked = 0
+        for stripe in self._stripes:
+            with stripe.lock:
+                tracked += len(stripe.buckets)
+        return {"backend": self.name, "stripes": len(self._stripes), "tracked_keys": tracked}
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# shm — mmap'd counter table shared by processes on one host
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+class SharedMemoryBackend(RateLimitBackend):
+    """
+    Fixed-size open-addressing table in a memory-mapped file. A slot is
+    (key_hash u64, window_index i64, current u32, previous u32, window_seconds u32).
+
+    Slots are grouped into stripes. A stripe is guarded by an fcntl byte-range
+    lock, which serialises the processes, and a threading.Lock, which
+    serialises threads inside one process, since POSIX record locks are
+    per-process. A slot whose windows have lapsed can be reclaimed by another
+    key. If every probed slot is live the call is allowed (fail open).
+    """
+    name = "shm"
+    SLOT = struct.Struct("<QqIII")
+    PROBES = 8
+
+    def __init__(self, path: str, slots: int = 65536, stripes: int = 256):
+        self.path = path
+        self.stripes = stripes
+        # a multiple of `stripes`, so probing never leaves the home stripe
+        self.slots = max(stripes, slots - slots % stripes)
+        self._size = self.slots * self.SLOT.size
+        self._local = [threading.Lock() for _ in range(stripes)]
+        self._pid = None
+        self._fd = None
+        self._map = None
+        self._open_lock = threading.Lock()
+        self._full = 0
+
+    def _mapping(self) -> mmap.mmap:
+        # (Re)open lazily after fork so each worker gets its own fd/mapping
+        if self._pid != os.getpid():
+            with self._open_lock:
+                if self._pid != os.getpid():
+                    fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+                    fcntl.lockf(fd, fcntl.LOCK_EX)
+                    try:
+                        if os.fstat(fd).st_size < self._size:
+                            os.ftruncate(fd, self._size)
+                    finally:
+                        fcntl.lockf(fd, fcntl.LOCK_UN)
+                    self._map = mmap.mmap(fd, self._size)
+                    self._fd = fd
+                    self._pid = os.getpid()
+        return self._map
+
+    def check(self, key: str, max_calls: int, window_seconds: int) -> bool:
+        table = self._mapping()
+        key_hash = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") or 1
+        home = key_hash % self.slots
+        stripe = home % self.stripes
+
+        now = time.time()
+        window_index = int(now // window_seconds)
+
+        with self._local[stripe]:
+            # one advisory byte per stripe acts as the cross-process lock
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, stripe)
+            try:
+                slot = self._find_slot(table, key_hash, home, now)
+                if slot is None:
+                    self._full += 1
+                    return True
+
+                offset = slot * self.SLOT.size
+                stored_hash, stored_window, curr, prev, _ = self.SLOT.unpack_from(table, offset)
+                if stored_hash != key_hash or stored_window < window_index - 1:
+                    curr, prev = 0, 0
+                elif stored_window == window_index - 1:
+                    curr, prev = 0, curr
+
+                if _sliding_estimate(prev, curr, window_seconds, now) + 1 > max_calls:
+                    self.SLOT.pack_into(table, offset, key_hash, window_index, curr, prev, window_seconds)
+                    return False
+                self.SLOT.pack_into(table, offset, key_hash, window_index, curr + 1, prev, window_seconds)
+                return True
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, stripe)
+
+    def _find_slot(self, table, key_hash: int, home: int, now: float):
+        """Probe within the home stripe for the key's slot or a reclaimable one."""
+        reclaim = None
+        for i in range(self.PROBES):
+            # step by `stripes` so every probe stays under the same stripe lock
+            slot = (home + i * self.stripes) % self.slots
+            stored_hash, stored_window, _, _, stored_len = self.SLOT.unpack_from(table, slot * self.SLOT.size)
+            if stored_hash == key_hash:
+                return slot
+            # lapsed = neither its current nor previous window is still live
+            if reclaim is None and (stored_hash == 0 or stored_window < now // stored_len - 1):
+                reclaim = slot
+        return reclaim
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "path": self.path,
+            "slots": self.slots,
+            "table_full_fail_open": self._full,
+        }
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# redis — any server speaking RESP (Redis, Valkey, KeyDB, local stand-ins)
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+class RedisError(Exception):
+    pass
+
+
+class _RespConnection:
+    """Minimal RESP2 client: pipelined commands over one socket."""
+
+    def __init__(self, host: str, port: int, timeout: float, password: str = "", db: int = 0):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.reader = self.sock.makefile("rb")
+        if password:
+            self.pipeline([("AUTH", password)])
+        if db:
+            self.pipeline([("SELECT", str(db))])
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(out)
+
+    def _read(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("connection closed by server")
+        prefix, rest = line[:1], line[1:-2]
+        if prefix == b"+":
+            return rest.decode()
+        if prefix == b"-":
+            raise RedisError(rest.decode())
+        if prefix == b":":
+            return int(rest)
+        if prefix == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if prefix == b"*":
+            count = int(rest)
+            return None if count < 0 else [self._read() for _ in range(count)]
+        raise RedisError(f"unexpected reply: {line!r}")
+
+    def pipeline(self, commands) -> list:
+        self.sock.sendall(b"".join(self._encode(c) for c in commands))
+        return [self._read() for _ in commands]
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RedisBackend(RateLimitBackend):
+    """
+    One pipelined round trip per check: INCR the current window's counter
+    (atomic on the server), refresh its EXPIRE, GET the previous window.
+    The increment happens before the decision, so rejected calls count too
+    and a client hammering past its limit stays limited. If the server is
+    unreachable, checks fail open.
+    """
+    name = "redis"
+
+    def __init__(self, url: str, timeout: float = 0.5, prefix: str = "rl:"):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password or ""
+        self.db = int((parsed.path or "/0").lstrip("/") or 0)
+        self.timeout = timeout
+        self.prefix = prefix
+        self._local = threading.local()
+        self._errors = 0
+
+    def _conn(self) -> _RespConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = _RespConnection(self.host, self.port, self.timeout, self.password, self.db)
+            self._local.conn = conn
+        return conn
+
+    def check(self, key: str, max_calls: int, window_seconds: int) -> bool:
+        now = time.time()
+        window_index = int(now // window_seconds)
+        curr_key = f"{self.prefix}{key}:{window_index}"
+        prev_key = f"{self.prefix}{key}:{window_index - 1}"
+        try:
+            curr, _, prev = self._conn().pipeline([
+                ("INCR", curr_key),
+                ("EXPIRE", curr_key, str(window_seconds * 2)),
+                ("GET", prev_key),
+            ])
+        except (OSError, RedisError, ValueError) as e:
+            self._errors += 1
+            conn = getattr(self._local, "conn", None)
+            if conn is not None:
+                conn.close()
+            self._local.conn = None
+            print(f"[WARN] redis rate limit check failed, allowing request: {e}")
+            return True
+
+        return _sliding_estimate(int(prev or 0), int(curr), window_seconds, now) <= max_calls
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "server": f"{self.host}:{self.port}", "errors": self._errors}
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Selection
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+def _default_shm_path() -> str:
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "guru-sikshan-ratelimit")
+
+
+def create_backend(name: str) -> RateLimitBackend:
+    name = (name or "memory").strip().lower()
+    if name == "memory":
+        return MemoryBackend()
+    if name == "shm":
+        return SharedMemoryBackend(
+            path=os.getenv("RATE_LIMIT_SHM_PATH") or _default_shm_path(),
+            slots=int(os.getenv("RATE_LIMIT_SHM_SLOTS", "65536")),
+        )
+    if name == "redis":
+        return RedisBackend(
+            url=os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0"),
+            timeout=float(os.getenv("RATE_LIMIT_REDIS_TIMEOUT_SEC", "0.5")),
+        )
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND '{name}' (expected memory, shm or redis)")
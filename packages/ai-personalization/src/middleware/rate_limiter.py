@@ -1,14 +1,17 @@
 """
-Simple in-memory sliding-window rate limiter per client_id.
-Good enough for v1. Replace with Redis for multi-process or multi-instance deploys.
+Rate limiter per client_id with a pluggable storage backend.
+
+RATE_LIMIT_BACKEND selects where counters live (see rate_limit_backends):
+  memory (default) — per-process token buckets; each worker counts separately
+  shm              — mmap'd table shared by all workers on one host
+  redis            — Redis-protocol server shared across hosts
+Limits per bucket are still defined in LIMITS below.
 """
-import time
-import threading
+import os
 import functools
 from flask import request, jsonify, g
 
-_lock   = threading.Lock()
-_windows: dict[str, list[float]] = {}
+from middleware.rate_limit_backends import create_backend
 
 # Per-client limits
 LIMITS = {
@@ -17,18 +20,17 @@ LIMITS = {
     "message": (60, 60),   # 60 messages per 60 s
 }
 
+_backend = create_backend(os.getenv("RATE_LIMIT_BACKEND", "memory"))
+
 
 def _check(key: str, max_calls: int, window_seconds: int) -> bool:
-    now = time.monotonic()
-    cutoff = now - window_seconds
-    with _lock:
-        timestamps = _windows.get(key, [])
-        timestamps = [t for t in timestamps if t > cutoff]
-        if len(timestamps) >= max_calls:
-            return False
-        timestamps.append(now)
-        _windows[key] = timestamps
-    return True
+    """Atomically decide and record one call for `key`."""
+    return _backend.check(key, max_calls, window_seconds)
+
+
+def limiter_stats() -> dict:
+    """Backend name and occupancy, for monitoring."""
+    return _backend.stats()
 
 
 def rate_limit(bucket: str):
@@ -0,0 +1,329 @@
+"""
+parse_tracker.py — background tracking of RAGFlow document parsing
+
+parse_documents only *starts* chunking. Nothing used to follow it, so admins
+refreshed /datasets/<id>/documents by hand, and each refresh was a full
+list_documents call. track() registers the documents passed to
+parse_documents. One poller thread then follows them all:
+
+  * one paged list_documents sweep per dataset per poll, shared by every
+    pending document in that dataset; the sweep stops as soon as all of them
+    have been seen, and newest-first ordering keeps that to a page or two;
+  * adaptive backoff per dataset: the interval starts at PARSE_POLL_MIN_SEC,
+    grows ×PARSE_POLL_BACKOFF while nothing changes, caps at
+    PARSE_POLL_MAX_SEC and drops back to the minimum when progress moves;
+  * state kept in memory, so status() answers without calling RAGFlow.
+
+When every document of a track() call has finished (done / failed /
+cancelled / missing / timeout), its callback runs and its webhook (or
+PARSE_WEBHOOK_URL) receives the summary as a JSON POST. Datasets whose
+documents finished get rf._dataset_changed(), so the retrieval and answer
+caches pick up the new chunks.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import requests
+
+import ragflow_client as rf
+
+PARSE_POLL_MIN_SEC      = float(os.getenv("PARSE_POLL_MIN_SEC", "2"))
+PARSE_POLL_MAX_SEC      = float(os.getenv("PARSE_POLL_MAX_SEC", "60"))
+PARSE_POLL_BACKOFF      = float(os.getenv("PARSE_POLL_BACKOFF", "1.5"))
+PARSE_POLL_PAGE_SIZE    = int(os.getenv("PARSE_POLL_PAGE_SIZE", "100"))
+PARSE_TRACK_TIMEOUT_SEC = float(os.getenv("PARSE_TRACK_TIMEOUT_SEC", str(6 * 3600)))
+PARSE_TRACK_HISTORY     = int(os.getenv("PARSE_TRACK_HISTORY", "5000"))
+PARSE_WEBHOOK_URL       = os.getenv("PARSE_WEBHOOK_URL", "").strip()
+
+# polls in which a pending document was absent from a complete listing before it is given up
+_MISSING_LIMIT = 3
+
+# RAGFlow reports `run` as a name or as the TaskStatus number
+_RUN_STATUS = {
+    "UNSTART": "pending", "0": "pending",
+    "RUNNING": "running", "1": "running",
+    "CANCEL": "cancelled", "2": "cancelled",
+    "DONE": "done", "3": "done",
+    "FAIL": "failed", "4": "failed",
+}
+TERMINAL = frozenset({"done", "failed", "cancelled", "missing", "timeout"})
+
+_lock = threading.Lock()
+_wake = threading.Event()
+_start_lock = threading.Lock()
+_poller_pid = None
+
+_docs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()   # document id -> state
+_datasets: Dict[str, Dict[str, Any]] = {}                    # dataset id -> {"pending", "interval", "next_poll"}
+_watches: List["_Watch"] = []
+
+_notify = ThreadPoolExecutor(max_workers=2, thread_name_prefix="parse-notify")
+_stats = {"tracked": 0, "completed": 0, "failed": 0, "polls": 0, "list_calls": 0,
+          "callbacks": 0, "webhooks_sent": 0, "webhooks_failed": 0}
+
+
+class _Watch:
+    """One track() call: fires its callback/webhook once all its documents finish."""
+
+    __slots__ = ("dataset_id", "document_ids", "callback", "webhook")
+
+    def __init__(self, dataset_id: str, document_ids: List[str], callback, webhook: str):
+        self.dataset_id = dataset_id
+        self.document_ids = document_ids
+        self.callback = callback
+        self.webhook = webhook
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _ensure_poller() -> None:
+    global _poller_pid
+    if _poller_pid == os.getpid():
+        return
+    with _start_lock:
+        if _poller_pid != os.getpid():
+            threading.Thread(target=_poller, name="parse-tracker", daemon=True).start()
+            _poller_pid = os.getpid()
+
+
+def track(
+    dataset_id: str,
+    document_ids: Iterable[str],
+    callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+    webhook: str = "",
+) -> None:
+    """
+    Follow parsing of `document_ids` (call right after parse_documents).
+    `callback(summary)` runs on a notifier thread once they have all finished;
+    `webhook` (default PARSE_WEBHOOK_URL) gets the same summary as JSON.
+    """
+    ids = [str(d) for d in dict.fromkeys(document_ids) if d]
+    if not ids:
+        return
+    started = time.monotonic()
+    with _lock:
+        for doc_id in ids:
+            _docs.pop(doc_id, None)
+            _docs[doc_id] = {
+                "document_id": doc_id,
+                "dataset_id": dataset_id,
+                "status": "pending",
+                "progress": 0.0,
+                "chunk_count": 0,
+                "message": "",
+                "name": None,
+                "tracked_at": _now(),
+                "finished_at": None,
+                "_started": started,
+                "_missing": 0,
+            }
+        first_poll = started + PARSE_POLL_MIN_SEC
+        ds = _datasets.setdefault(dataset_id, {"pending": set(), "interval": PARSE_POLL_MIN_SEC, "next_poll": first_poll})
+        ds["pending"].update(ids)
+        ds["interval"] = PARSE_POLL_MIN_SEC
+        ds["next_poll"] = min(ds["next_poll"], first_poll)
+        _watches.append(_Watch(dataset_id, ids, callback, webhook or PARSE_WEBHOOK_URL))
+        _stats["tracked"] += len(ids)
+        _trim()
+    _ensure_poller()
+    _wake.set()
+
+
+def _public(state: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in state.items() if not k.startswith("_")}
+
+
+def status(document_ids: Optional[Iterable[str]] = None, dataset_id: str = "") -> List[Dict[str, Any]]:
+    """
+    Tracked state for the given documents (untracked ids are reported as
+    such), or for every tracked document of `dataset_id`. Never calls RAGFlow.
+    """
+    with _lock:
+        if document_ids is not None:
+            return [
+                _public(_docs[d]) if d in _docs else {"document_id": d, "status": "untracked"}
+                for d in document_ids
+            ]
+        return [_public(s) for s in _docs.values() if not dataset_id or s["dataset_id"] == dataset_id]
+
+
+def summary(dataset_id: str = "") -> Dict[str, int]:
+    """Document counts per status."""
+    counts: Dict[str, int] = {}
+    with _lock:
+        for state in _docs.values():
+            if not dataset_id or state["dataset_id"] == dataset_id:
+                counts[state["status"]] = counts.get(state["status"], 0) + 1
+    return counts
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Polling
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+def _trim() -> None:
+    # caller holds _lock; forget the oldest finished documents past the history limit
+    excess = len(_docs) - PARSE_TRACK_HISTORY
+    if excess <= 0:
+        return
+    for doc_id in [d for d, s in _docs.items() if s["status"] in TERMINAL][:excess]:
+        del _docs[doc_id]
+
+
+def _fetch(dataset_id: str, wanted: set) -> tuple:
+    """Page through the dataset until every wanted id is seen; returns (docs by id, complete listing?)."""
+    found: Dict[str, Dict[str, Any]] = {}
+    page = 1
+    while True:
+        docs = rf.list_documents(dataset_id, page=page, page_size=PARSE_POLL_PAGE_SIZE)
+        with _lock:
+            _stats["list_calls"] += 1
+        for doc in docs:
+            doc_id = str(doc.get("id") or "")
+            if doc_id in wanted:
+                found[doc_id] = doc
+        if len(found) == len(wanted):
+            return found, False
+        if len(docs) < PARSE_POLL_PAGE_SIZE:
+            return found, True
+        page += 1
+
+
+def _apply(dataset_id: str, found: Dict[str, Dict[str, Any]], complete: bool) -> tuple:
+    """Fold one listing into the state; returns (anything changed?, any document done?)."""
+    changed = finished_ok = False
+    now = time.monotonic()
+    with _lock:
+        ds = _datasets.get(dataset_id)
+        if ds is None:
+            return False, False
+        for doc_id in list(ds["pending"]):
+            state = _docs.get(doc_id)
+            if state is None:
+                ds["pending"].discard(doc_id)
+                continue
+            doc = found.get(doc_id)
+            if doc is None:
+                state["_missing"] += 1 if complete else 0
+                new_status = "missing" if state["_missing"] >= _MISSING_LIMIT else state["status"]
+            else:
+                state["_missing"] = 0
+                new_status = _RUN_STATUS.get(str(doc.get("run", "")).upper(), state["status"])
+                progress = float(doc.get("progress") or 0.0)
+                if progress != state["progress"] or doc.get("chunk_count") != state["chunk_count"]:
+                    changed = True
+                state["progress"] = progress
+                state["chunk_count"] = doc.get("chunk_count") or 0
+                state["message"] = (doc.get("progress_msg") or "")[-500:]
+                state["name"] = doc.get("name") or state["name"]
+            if new_status not in TERMINAL and now - state["_started"] > PARSE_TRACK_TIMEOUT_SEC:
+                new_status = "timeout"
+            if new_status != state["status"]:
+                changed = True
+                state["status"] = new_status
+            if new_status in TERMINAL:
+                state["finished_at"] = _now()
+                ds["pending"].discard(doc_id)
+                if new_status == "done":
+                    finished_ok = True
+                    _stats["completed"] += 1
+                else:
+                    _stats["failed"] += 1
+    return changed, finished_ok
+
+
+def _poll(dataset_id: str) -> None:
+    with _lock:
+        wanted = set(_datasets[dataset_id]["pending"])
+    try:
+        found, complete = _fetch(dataset_id, wanted)
+        changed, finished_ok = _apply(dataset_id, found, complete)
+    except Exception as e:
+        print(f"[WARN] parse status poll failed for dataset {dataset_id}: {e}")
+        changed = finished_ok = False
+    if finished_ok:
+        rf._dataset_changed(dataset_id)
+
+    with _lock:
+        _stats["polls"] += 1
+        ds = _datasets[dataset_id]
+        if not ds["pending"]:
+            del _datasets[dataset_id]
+            return
+        ds["interval"] = PARSE_POLL_MIN_SEC if changed else min(ds["interval"] * PARSE_POLL_BACKOFF, PARSE_POLL_MAX_SEC)
+        ds["next_poll"] = time.monotonic() + ds["interval"]
+
+
+def _fire_watches() -> None:
+    with _lock:
+        ready, pending = [], []
+        for watch in _watches:
+            states = [_docs.get(d) for d in watch.document_ids]
+            (ready if all(s is None or s["status"] in TERMINAL for s in states) else pending).append(watch)
+        _watches[:] = pending
+        payloads = []
+        for watch in ready:
+            docs = [_public(_docs[d]) if d in _docs else {"document_id": d, "status": "untracked"} for d in watch.document_ids]
+            payloads.append((watch, {
+                "event": "parse.finished",
+                "dataset_id": watch.dataset_id,
+                "document_ids": watch.document_ids,
+                "done": sum(1 for d in docs if d["status"] == "done"),
+                "failed": sum(1 for d in docs if d["status"] != "done"),
+                "documents": docs,
+            }))
+    for watch, payload in payloads:
+        _notify.submit(_deliver, watch, payload)
+
+
+def _deliver(watch: _Watch, payload: Dict[str, Any]) -> None:
+    if watch.callback is not None:
+        try:
+            watch.callback(payload)
+            with _lock:
+                _stats["callbacks"] += 1
+        except Exception as e:
+            print(f"[WARN] parse callback failed for dataset {watch.dataset_id}: {e}")
+    if watch.webhook:
+        try:
+            requests.post(watch.webhook, json=payload, timeout=10).raise_for_status()
+            with _lock:
+                _stats["webhooks_sent"] += 1
+        except Exception as e:
+            print(f"[WARN] parse webhook {watch.webhook} failed: {e}")
+            with _lock:
+                _stats["webhooks_failed"] += 1
+
+
+def _poller() -> None:
+    while True:
+        now = time.monotonic()
+        with _lock:
+            due = [ds_id for ds_id, ds in _datasets.items() if ds["next_poll"] <= now]
+            upcoming = min((ds["next_poll"] for ds in _datasets.values()), default=None)
+        for dataset_id in due:
+            _poll(dataset_id)
+        if due:
+            _fire_watches()
+            continue
+        _wake.wait(None if upcoming is None else max(0.05, upcoming - now))
+        _wake.clear()
+
+
+def tracker_stats() -> Dict[str, Any]:
+    with _lock:
+        return {
+            **_stats,
+            "pending": sum(len(ds["pending"]) for ds in _datasets.values()),
+            "datasets_polling": len(_datasets),
+            "documents_known": len(_docs),
+            "next_interval_s": {ds_id: round(ds["interval"], 2) for ds_id, ds in _datasets.items()},
+        }
@@ -0,0 +1,439 @@
+"""
+ragflow_async_client.py — asyncio counterpart of ragflow_client
+
+Same RAGFlow /api/v1/* surface as ragflow_client.py, built on
+httpx.AsyncClient so a single worker can keep hundreds of RAGFlow calls in
+flight without a thread each. Configuration (base URL, API key, default chat)
+is shared with the sync client.
+
+Flask handlers are synchronous, so `run()` executes a coroutine on a shared
+background event loop and blocks for its result:
+
+    chunks = arf.run(arf.retrieve_chunks_multi(question, dataset_ids))
+"""
+import asyncio
+import json
+import os
+import threading
+import uuid
+import weakref
+from pathlib import Path
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+import httpx
+
+import ragflow_client as rf
+import retrieval_cache
+import upload_stream
+
+RAGFLOW_ASYNC_MAX_CONNECTIONS = int(os.getenv("RAGFLOW_ASYNC_MAX_CONNECTIONS", "200"))
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Client & Event Loop Management
+# ─────────────────────────────────────────────────────────────────────────────
+
+# httpx.AsyncClient is bound to the loop it was first used on, keep one per loop
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the pooled AsyncClient for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=RAGFLOW_ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=rf.RAGFLOW_POOL_MAXSIZE,
+            ),
+            timeout=rf.RAGFLOW_TIMEOUT_SEC,
+        )
+        _clients[loop] = client
+    return client
+
+
+async def aclose() -> None:
+    """Close the AsyncClient bound to the running loop."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    """Lazily start the shared event loop thread used by run()."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="ragflow-async", daemon=True).start()
+            _loop = loop
+    return _loop
+
+
+def run(coro, timeout: Optional[float] = None):
+    """Run a coroutine from synchronous code (e.g. a Flask route) and return its result."""
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop()).result(timeout)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Helper Functions
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+async def _get(path: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Execute GET request to RAGFlow API."""
+    resp = await get_client().get(
+        rf._url(path),
+        headers=rf._auth_headers(json_content=True),
+        params=params,
+    )
+    resp.raise_for_status()
+    return resp.json()
+
+
+async def _post(
+    path: str,
+    json: Optional[Dict[str, Any]] = None,
+    files: Optional[Dict[str, Any]] = None,
+    timeout: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Execute POST request to RAGFlow API."""
+    resp = await get_client().post(
+        rf._url(path),
+        headers=rf._auth_headers(json_content=(json is not None and files is None)),
+        json=json,
+        files=files,
+        timeout=timeout or rf.RAGFLOW_TIMEOUT_SEC,
+    )
+    resp.raise_for_status()
+    return resp.json()
+
+
+async def _delete(path: str, json: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Execute DELETE request to RAGFlow API (httpx.delete() takes no body)."""
+    resp = await get_client().request(
+        "DELETE",
+        rf._url(path),
+        headers=rf._auth_headers(json_content=True),
+        json=json,
+    )
+    resp.raise_for_status()
+    return resp.json()
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Dataset Operations
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+async def list_datasets(name: str = "", page: int = 1, page_size: int = 30) -> List[Dict[str, Any]]:
+    """List all datasets, optionally filtered by name."""
+    params: Dict[str, Any] = {"page": page, "page_size": page_size}
+    if name:
+        params["name"] = name
+
+    data = (await _get("/api/v1/datasets", params=params)).get("data", {})
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict):
+        return data.get("datasets", data.get("list", [])) or []
+    return []
+
+
+async def create_dataset(
+    name: str, description: str = "", chunk_method: str = "naive"
+) -> Dict[str, Any]:
+    """Create a new dataset in RAGFlow."""
+    return await _post(
+        "/api/v1/datasets",
+        json={
+            "name": name,
+            "description": description,
+            "chunk_method": chunk_method,
+        },
+    )
+
+
+async def delete_dataset(dataset_id: str) -> Dict[str, Any]:
+    """Delete a dataset by ID."""
+    result = await _delete("/api/v1/datasets", json={"ids": [dataset_id]})
+    rf._dataset_changed(dataset_id)
+    return result
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Document Operations
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+async def list_documents(
+    dataset_id: str, page: int = 1, page_size: int = 30
+) -> List[Dict[str, Any]]:
+    """List documents in a dataset."""
+    data = (await _get(
+        f"/api/v1/datasets/{dataset_id}/documents",
+        params={"page": page, "page_size": page_size},
+    )).get("data", {})
+
+    if isinstance(data, dict):
+        return data.get("docs", data.get("documents", [])) or []
+    if isinstance(data, list):
+        return data
+    return []
+
+
+async def _off_loop(blocks) -> AsyncGenerator[bytes, None]:
+    """Drive a blocking byte iterator (file reads) on a worker thread, one block at a time."""
+    blocks = iter(blocks)
+    while True:
+        block = await asyncio.to_thread(next, blocks, None)
+        if block is None:
+            return
+        yield block
+
+
+async def upload_document(dataset_id: str, file_path: str) -> Dict[str, Any]:
+    """Upload a document file to a dataset, reading it off the event loop."""
+    file_name = Path(file_path).name
+    f = await asyncio.to_thread(open, file_path, "rb")
+    try:
+        head = await asyncio.to_thread(f.read, 64)
+        await asyncio.to_thread(f.seek, 0)
+        content_type = upload_stream.detect_mime(file_name, head)
+        meter = upload_stream.UploadMeter(content_type)
+        boundary = uuid.uuid4().hex
+        body = upload_stream.multipart_body(
+            boundary, "file", file_name, content_type, upload_stream.iter_file(f), meter
+        )
+        try:
+            resp = await get_client().post(
+                rf._url(f"/api/v1/datasets/{dataset_id}/documents"),
+                headers={**rf._auth_headers(json_content=False), "Content-Type": f"multipart/form-data; boundary={boundary}"},
+                content=_off_loop(body),
+                timeout=max(rf.RAGFLOW_TIMEOUT_SEC, 60),
+            )
+            resp.raise_for_status()
+            result = resp.json()
+        except Exception:
+            meter.finish(ok=False)
+            raise
+        meter.finish()
+    finally:
+        await asyncio.to_thread(f.close)
+    rf._dataset_changed(dataset_id)
+    return result
+
+
+async def parse_documents(dataset_id: str, document_ids: List[str]) -> Dict[str, Any]:
+    """Trigger chunking/parsing of documents in a dataset."""
+    result = await _post(
+        f"/api/v1/datasets/{dataset_id}/chunks",
+        json={"document_ids": document_ids},
+    )
+    rf._dataset_changed(dataset_id)
+    return result
+
+
+async def delete_documents(dataset_id: str, document_ids: List[str]) -> Dict[str, Any]:
+    """Delete documents from a dataset."""
+    result = await _delete(
+        f"/api/v1/datasets/{dataset_id}/documents",
+        json={"ids": document_ids},
+    )
+    rf._dataset_changed(dataset_id)
+    return result
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Retrieval Operations
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+async def retrieve_chunks(
+    question: str,
+    dataset_ids: List[str],
+    top_k: int = 6,
+    similarity_threshold: float = 0.2,
+) -> List[Dict[str, Any]]:
+    """Retrieve relevant chunks from datasets based on a question (shares rf's retrieval cache)."""
+    key = retrieval_cache.make_key(question, dataset_ids, top_k, similarity_threshold)
+    cached = retrieval_cache.get(key)
+    if cached is not None:
+        return cached
+
+    fetched_epoch = retrieval_cache.epoch()
+    resp = await _post(
+        "/api/v1/retrieval",
+        json={
+            "question": question,
+            "dataset_ids": dataset_ids,
+            "top_k": top_k,
+            "similarity_threshold": similarity_threshold,
+        },
+    )
+
+    data = resp.get("data", {})
+    chunks = data.get("chunks", []) if isinstance(data, dict) else []
+    retrieval_cache.put(key, chunks, fetched_epoch)
+    return chunks
+
+
+async def retrieve_chunks_multi(
+    question: str,
+    dataset_ids: List[str],
+    top_k: int = 6,
+    similarity_threshold: float = 0.2,
+    limit: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Fan a question out to each dataset concurrently and merge the results.
+
+    Chunks are de-duplicated by id (keeping the best score) and ranked by
+    `similarity`. A failing dataset is skipped; the error is only raised if
+    every dataset failed.
+    """
+    unique_ids = list(dict.fromkeys(d for d in dataset_ids if d))
+    results = await asyncio.gather(
+        *(retrieve_chunks(question, [ds], top_k, similarity_threshold) for ds in unique_ids),
+        return_exceptions=True,
+    )
+
+    merged: Dict[Any, Dict[str, Any]] = {}
+    errors: List[BaseException] = []
+    for result in results:
+        if isinstance(result, BaseException):
+            errors.append(result)
+            continue
+        for chunk in result:
+            if not isinstance(chunk, dict):
+                continue
+            key = chunk.get("id") or (chunk.get("document_id"), chunk.get("content"))
+            seen = merged.get(key)
+            if seen is None or _score(chunk) > _score(seen):
+                merged[key] = chunk
+
+    if errors and len(errors) == len(unique_ids):
+        raise errors[0]
+
+    ranked = sorted(merged.values(), key=_score, reverse=True)
+    return ranked[:limit] if limit else ranked
+
+
+def _score(chunk: Dict[str, Any]) -> float:
+    try:
+        return float(chunk.get("similarity") or 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Chat & Completion Operations
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+def _completion_payload(question: str, stream: bool) -> Dict[str, Any]:
+    return {
+        "model": "model",
+        "messages": [{"role": "user", "content": question}],
+        "stream": stream,
+        "extra_body": {
+            "reference": True,
+            "reference_metadata": {
+                "include": True
+            }
+        }
+    }
+
+
+async def chat_completion(
+    question: str, chat_id: str = "", session_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """Get a non-streaming chat completion."""
+    cid = rf._resolve_chat_id(chat_id)
+    return await _post(
+        f"/api/v1/openai/{cid}/chat/completions",
+        json=_completion_payload(question, stream=False),
+        timeout=90,
+    )
+
+
+async def chat_completion_stream(
+    question: str,
+    chat_id: str = "",
+    session_id: Optional[str] = None,
+    **kwargs,
+) -> AsyncGenerator[str, None]:
+    """Get a chat completion response with streaming (same SSE frames as the sync client)."""
+    cid = rf._resolve_chat_id(chat_id)
+
+    payload = _completion_payload(question, stream=True)
+    if session_id:
+        payload["session_id"] = session_id
+    if kwargs.get("dataset_ids"):
+        payload["dataset_ids"] = kwargs["dataset_ids"]
+
+    references = []
+    async with get_client().stream(
+        "POST",
+        rf._url(f"/api/v1/openai/{cid}/chat/completions"),
+        headers=rf._auth_headers(json_content=True),
+        json=payload,
+        timeout=120,
+    ) as resp:
+        resp.raise_for_status()
+        async for line in resp.aiter_lines():
+            if not line or not line.startswith("data:"):
+                continue
+
+            data_str = line[5:].strip()
+            if data_str == "[DONE]":
+                break
+
+            try:
+                data = json.loads(data_str)
+            except json.JSONDecodeError:
+                continue
+
+            delta = data.get("choices", [{}])[0].get("delta") or {}
+            ref = delta.get("reference") or []
+            if ref:
+                references = ref
+
+            yield f"data: {data_str}\n\n"
+
+    yield f'event: metadata\ndata: {json.dumps({"references": references})}\n\n'
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Session Operations
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+async def create_session(chat_id: str = "", name: str = "Guru-Sikshan Session") -> Dict[str, Any]:
+    """Create a new chat session."""
+    cid = rf._resolve_chat_id(chat_id)
+    return await _post(f"/api/v1/chats/{cid}/sessions", json={"name": name})
+
+
+async def list_sessions(chat_id: str = "") -> List[Dict[str, Any]]:
+    """List all sessions for a chat."""
+    cid = rf._resolve_chat_id(chat_id)
+    data = (await _get(f"/api/v1/chats/{cid}/sessions")).get("data", {})
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict):
+        return data.get("sessions", data.get("list", [])) or []
+    return []
+
+
+async def delete_session(chat_id: str, session_id: str) -> Dict[str, Any]:
+    """Delete a session."""
+    cid = rf._resolve_chat_id(chat_id)
+    return await _delete(f"/api/v1/chats/{cid}/sessions", json={"ids": [session_id]})
+
+
+async def get_chat_session(chat_id: str, session_id: str) -> Dict[str, Any]:
+    """Retrieve a specific chat session's history and messages."""
+    return await _get(f"/api/v1/chats/{chat_id}/sessions/{session_id}")
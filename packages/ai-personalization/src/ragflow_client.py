@@ -6,38 +6,177 @@ Handles authentication, request/response parsing, and error handling.
 """
 # NOTE : Almost every function has been implemented but not in use (some of em) by ragflow_routes.
 import os
+import time
+import uuid
+import logging
+import itertools
+import threading
 from pathlib import Path
-from typing import Dict, Any, List, Generator, Optional
+from types import MappingProxyType
+from typing import Dict, Any, Iterable, List, Generator, Mapping, Optional, Tuple
 import json
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv, find_dotenv
 
+import answer_cache
+import retrieval_cache
+import upload_stream
+
 # Load environment variables
 load_dotenv(find_dotenv(), override=False)
 
-# Configuration
-RAGFLOW_BASE_URL = os.getenv("RAGFLOW_BASE_URL", "http://localhost:80").rstrip("/")
-RAGFLOW_API_KEY = os.getenv("RAGFLOW_API_KEY", "").strip()
-RAGFLOW_CHAT_ID = os.getenv("RAGFLOW_CHAT_ID", "").strip()
-RAGFLOW_TIMEOUT_SEC = int(os.getenv("RAGFLOW_TIMEOUT_SEC", "30"))
+# Configuration (refreshed by reload_config)
+RAGFLOW_BASE_URL = ""
+RAGFLOW_API_KEY = ""
+RAGFLOW_CHAT_ID = ""
+RAGFLOW_TIMEOUT_SEC = 30
+RAGFLOW_POOL_CONNECTIONS = int(os.getenv("RAGFLOW_POOL_CONNECTIONS", "4"))   # hosts kept in the pool
+RAGFLOW_POOL_MAXSIZE = int(os.getenv("RAGFLOW_POOL_MAXSIZE", "32"))          # keep-alive sockets per host
+RAGFLOW_MAX_RETRIES = int(os.getenv("RAGFLOW_MAX_RETRIES", "2"))
+
+logger = logging.getLogger("ragflow_client")
+logger.setLevel(os.getenv("RAGFLOW_LOG_LEVEL", os.getenv("LOG_LEVEL", "INFO")).upper())
+
+# Immutable header sets, built once per config load instead of per request
+_JSON_HEADERS: Mapping[str, str] = MappingProxyType({})
+_PLAIN_HEADERS: Mapping[str, str] = MappingProxyType({})
+
+
+def reload_config() -> None:
+    """(Re)read RAGFlow settings from the environment and rebuild the request headers."""
+    global RAGFLOW_BASE_URL, RAGFLOW_API_KEY, RAGFLOW_CHAT_ID, RAGFLOW_TIMEOUT_SEC
+    global _JSON_HEADERS, _PLAIN_HEADERS
+
+    RAGFLOW_BASE_URL = os.getenv("RAGFLOW_BASE_URL", "http://localhost:80").rstrip("/")
+    RAGFLOW_API_KEY = os.getenv("RAGFLOW_API_KEY", "").strip()
+    RAGFLOW_CHAT_ID = os.getenv("RAGFLOW_CHAT_ID", "").strip()
+    RAGFLOW_TIMEOUT_SEC = int(os.getenv("RAGFLOW_TIMEOUT_SEC", "30"))
+
+    auth = {"Authorization": f"Bearer {RAGFLOW_API_KEY}"} if RAGFLOW_API_KEY else {}
+    _PLAIN_HEADERS = MappingProxyType(auth)
+    _JSON_HEADERS = MappingProxyType({**auth, "Content-Type": "application/json"})
+
+    logger.info(
+        "config loaded base_url=%s api_key_set=%s chat_id_set=%s",
+        RAGFLOW_BASE_URL, bool(RAGFLOW_API_KEY), bool(RAGFLOW_CHAT_ID),
+    )
+
+
+reload_config()
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Pooled HTTP Client
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+class RAGFlowHTTP:
+    """
+    Shared keep-alive session used by every call in this module.
+
+    One requests.Session with a mounted HTTPAdapter keeps up to
+    `pool_maxsize` sockets open per host, so consecutive RAGFlow calls reuse
+    the TCP/TLS connection instead of handshaking each time. Connect errors
+    and 502/503/504 on idempotent methods are retried with backoff; POSTs are
+    only retried when the connection was never established.
+    """
+
+    def __init__(
+        self,
+        pool_connections: int = RAGFLOW_POOL_CONNECTIONS,
+        pool_maxsize: int = RAGFLOW_POOL_MAXSIZE,
+        max_retries: int = RAGFLOW_MAX_RETRIES,
+    ):
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=0.3,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+            raise_on_status=False,
+        )
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=retry,
+            pool_block=False,
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+        self.pool_maxsize = pool_maxsize
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._requests = 0
+        self._errors = 0
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Send a request through the shared session, tracking utilisation."""
+        with self._lock:
+            self._in_flight += 1
+            self._requests += 1
+        try:
+            return self.session.request(method, url, **kwargs)
+        except requests.RequestException as exc:
+            with self._lock:
+                self._errors += 1
+            logger.warning("request failed method=%s url=%s error=%s", method, url, exc)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of request counters and per-host connection pool usage."""
+        pools = []
+        manager = self.adapter.poolmanager
+        for key in manager.pools.keys():
+            try:
+                pool = manager.pools[key]
+            except KeyError:
+                continue
+            idle_slots = pool.pool.qsize() if pool.pool is not None else 0
+            pools.append({
+                "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                "maxsize": pool.pool.maxsize if pool.pool is not None else 0,
+                "in_use": (pool.pool.maxsize - idle_slots) if pool.pool is not None else 0,
+                "connections_opened": pool.num_connections,
+                "requests_served": pool.num_requests,
+            })
+
+        with self._lock:
+            return {
+                "pool_maxsize": self.pool_maxsize,
+                "in_flight": self._in_flight,
+                "requests_total": self._requests,
+                "errors_total": self._errors,
+                "pools": pools,
+            }
+
+
+# Shared instance — every helper below goes through it
+_http = RAGFlowHTTP()
+
+
+def pool_stats() -> Dict[str, Any]:
+    """Expose connection pool utilisation for monitoring."""
+    return _http.stats()
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Helper Functions
 # ─────────────────────────────────────────────────────────────────────────────
 
 
-def _auth_headers(json_content: bool = True) -> Dict[str, str]:
-    """Generate authorization headers for RAGFlow API requests."""
-    print("[ragflow_client] api key present:", bool(RAGFLOW_API_KEY))
-    print("[ragflow_client] api key prefix:", (RAGFLOW_API_KEY or "")[:12])
+def _auth_headers(json_content: bool = True) -> Mapping[str, str]:
+    """Return the prebuilt authorization headers for RAGFlow API requests."""
     if not RAGFLOW_API_KEY:
         raise ValueError("RAGFLOW_API_KEY is not set")
-
-    headers = {"Authorization": f"Bearer {RAGFLOW_API_KEY}"}
-    if json_content:
-        headers["Content-Type"] = "application/json"
-    return headers
+    return _JSON_HEADERS if json_content else _PLAIN_HEADERS
 
 
 def _url(path: str) -> str:
@@ -47,7 +186,8 @@ def _url(path: str) -> str:
 
 def _get(path: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """Execute GET request to RAGFlow API."""
-    resp = requests.get(
+    resp = _http.request(
+        "GET",
         _url(path),
         headers=_auth_headers(json_content=True),
         params=params,
@@ -66,7 +206,8 @@ def _post(
 ):
     """Execute POST request to RAGFlow API."""
     headers = _auth_headers(json_content=(json is not None and files is None))
-    resp = requests.post(
+    resp = _http.request(
+        "POST",
         _url(path),
         headers=headers,
         json=json,
@@ -80,7 +221,8 @@ def _post(
 
 def _delete(path: str, json: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """Execute DELETE request to RAGFlow API."""
-    resp = requests.delete(
+    resp = _http.request(
+        "DELETE",
         _url(path),
         headers=_auth_headers(json_content=True),
         json=json,
@@ -93,7 +235,7 @@ def _delete(path: str, json: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
 # Chat Assistant Management Core Functions
 # ─────────────────────────────────────────────────────────────────────────────
 
-def _get_headers() -> Dict[str, str]:
+def _get_headers() -> Mapping[str, str]:
     """Alias for _auth_headers — used by chat assistant management functions."""
     return _auth_headers(json_content=True)
 
@@ -105,36 +247,32 @@ def delete_chat_assistants_bulk(payload: Dict[str, Any]) -> Dict[str, Any]:
     return _delete("/api/v1/chats", json=body)
 
 def create_chat_assistant(name: str, dataset_ids: List[str], **kwargs) -> Dict[str, Any]:
-    url = f"{RAGFLOW_BASE_URL}/api/v1/chats"
     payload = {"name": name, "dataset_ids": dataset_ids, **kwargs}
-    response = requests.post(url, json=payload, headers=_get_headers(), timeout=30)
+    response = _http.request("POST", _url("/api/v1/chats"), json=payload, headers=_get_headers(), timeout=30)
     return response.json()
 
 def get_chat_assistant(chat_id: str) -> Dict[str, Any]:
-    url = f"{RAGFLOW_BASE_URL}/api/v1/chats/{chat_id}"
-    response = requests.get(url, headers=_get_headers(), timeout=30)
+    response = _http.request("GET", _url(f"/api/v1/chats/{chat_id}"), headers=_get_headers(), timeout=30)
     return response.json()
 
 def update_chat_assistant(chat_id: str, name: str, dataset_ids: List[str], **kwargs) -> Dict[str, Any]:
-    url = f"{RAGFLOW_BASE_URL}/api/v1/chats/{chat_id}"
     payload = {"name": name, "dataset_ids": dataset_ids, **kwargs}
-    response = requests.put(url, json=payload, headers=_get_headers(), timeout=30)
+    response = _http.request("PUT", _url(f"/api/v1/chats/{chat_id}"), json=payload, headers=_get_headers(), timeout=30)
+    _chat_changed(chat_id)
     return response.json()
 
 def patch_chat_assistant(chat_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
-    url = f"{RAGFLOW_BASE_URL}/api/v1/chats/{chat_id}"
-    response = requests.patch(url, json=payload, headers=_get_headers(), timeout=30)
+    response = _http.request("PATCH", _url(f"/api/v1/chats/{chat_id}"), json=payload, headers=_get_headers(), timeout=30)
+    _chat_changed(chat_id)
     return response.json()
 
 def delete_chat_assistant(chat_id: str) -> Dict[str, Any]:
-    url = f"{RAGFLOW_BASE_URL}/api/v1/chats/{chat_id}"
-    response = requests.delete(url, headers=_get_headers(), timeout=30)
+    response = _http.request("DELETE", _url(f"/api/v1/chats/{chat_id}"), headers=_get_headers(), timeout=30)
     return response.json()
 
 def list_chat_assistants(page: int = 1, page_size: int = 30, **kwargs) -> Dict[str, Any]:
-    url = f"{RAGFLOW_BASE_URL}/api/v1/chats"
     params = {"page": page, "page_size": page_size, **kwargs}
-    response = requests.get(url, params=params, headers=_get_headers(), timeout=30)
+    response = _http.request("GET", _url("/api/v1/chats"), params=params, headers=_get_headers(), timeout=30)
     return response.json()
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -145,7 +283,7 @@ def list_chat_assistants(page: int = 1, page_size: int = 30, **kwargs) -> Dict[s
 def health_check() -> bool:
     """Check if RAGFlow API is healthy."""
     try:
-        resp = requests.get(_url("/api/v1/system/healthz"), timeout=5)
+        resp = _http.request("GET", _url("/api/v1/system/healthz"), timeout=5)
         resp.raise_for_status()
         data = resp.json()
         return data.get("status") == "ok"
@@ -155,7 +293,7 @@ def health_check() -> bool:
 
 def health_detail() -> Dict[str, Any]:
     """Get detailed health information from RAGFlow API."""
-    resp = requests.get(_url("/api/v1/system/healthz"), timeout=5)
+    resp = _http.request("GET", _url("/api/v1/system/healthz"), timeout=5)
     resp.raise_for_status()
     return resp.json()
 
@@ -208,7 +346,9 @@ def get_or_create_dataset(
 
 def delete_dataset(dataset_id: str) -> Dict[str, Any]:
     """Delete a dataset by ID."""
-    return _delete("/api/v1/datasets", json={"ids": [dataset_id]})
+    result = _delete("/api/v1/datasets", json={"ids": [dataset_id]})
+    _dataset_changed(dataset_id)
+    return result
 
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -216,6 +356,85 @@ def delete_dataset(dataset_id: str) -> Dict[str, Any]:
 # ─────────────────────────────────────────────────────────────────────────────
 
 
+RAGFLOW_CHAT_DATASETS_TTL = float(os.getenv("RAGFLOW_CHAT_DATASETS_TTL", "300"))
+
+_chat_datasets_lock = threading.Lock()
+_chat_datasets: Dict[str, Tuple[float, List[str]]] = {}   # chat id -> (expires_at, dataset ids)
+
+
+def chat_dataset_ids(chat_id: str = "") -> Optional[List[str]]:
+    """
+    Dataset ids the chat assistant answers from, memoised for
+    RAGFLOW_CHAT_DATASETS_TTL seconds; None if RAGFlow could not say.
+    """
+    cid = _resolve_chat_id(chat_id)
+    now = time.monotonic()
+    with _chat_datasets_lock:
+        entry = _chat_datasets.get(cid)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+    try:
+        data = get_chat_assistant(cid).get("data") or {}
+    except Exception as e:
+        logger.warning("could not load datasets of chat %s: %s", cid, e)
+        return None
+    if isinstance(data, list):
+        data = data[0] if data else {}
+    ids = data.get("dataset_ids")
+    if ids is None and isinstance(data.get("datasets"), list):
+        ids = [d.get("id") for d in data["datasets"] if isinstance(d, dict)]
+    if ids is None:
+        return None
+    ids = [str(i) for i in ids if i]
+    with _chat_datasets_lock:
+        _chat_datasets[cid] = (now + RAGFLOW_CHAT_DATASETS_TTL, ids)
+    return ids
+
+
+def _chat_changed(chat_id: str) -> None:
+    with _chat_datasets_lock:
+        _chat_datasets.pop(chat_id, None)
+
+
+def _dataset_changed(dataset_id: str) -> None:
+    """Drop cached retrievals and answers that may have drawn on this dataset."""
+    retrieval_cache.invalidate_dataset(dataset_id)
+    answer_cache.invalidate_dataset(dataset_id)
+
+
+def extract_document_ids(payload: Any) -> List[str]:
+    """Extract document IDs from various response formats."""
+    if isinstance(payload, list):
+        ids: List[str] = []
+        for item in payload:
+            if isinstance(item, dict):
+                value = item.get("id") or item.get("document_id") or item.get("doc_id")
+                if value:
+                    ids.append(str(value))
+            elif isinstance(item, str):
+                ids.append(item)
+        return ids
+
+    if isinstance(payload, dict):
+        for key in ("ids", "document_ids"):
+            value = payload.get(key)
+            if isinstance(value, list):
+                return [str(v) for v in value if v]
+
+        for key in ("id", "document_id", "doc_id"):
+            value = payload.get(key)
+            if value:
+                return [str(value)]
+
+        for key in ("documents", "data", "docs"):
+            value = payload.get(key)
+            ids = extract_document_ids(value)
+            if ids:
+                return ids
+
+    return []
+
+
 def list_documents(
     dataset_id: str, page: int = 1, page_size: int = 30
 ) -> List[Dict[str, Any]]:
@@ -234,30 +453,96 @@ def list_documents(
 
 def upload_document(dataset_id: str, file_path: str) -> Dict[str, Any]:
     """Upload a document file to a dataset."""
-    file_name = Path(file_path).name
     with open(file_path, "rb") as f:
-        resp = _post(
-            f"/api/v1/datasets/{dataset_id}/documents",
-            files={"file": (file_name, f, "application/pdf")},
-            timeout=60,
+        result, _ = upload_document_stream(dataset_id, Path(file_path).name, upload_stream.iter_file(f))
+    return result
+
+
+def upload_document_stream(
+    dataset_id: str,
+    file_name: str,
+    chunks: Iterable[bytes],
+    content_type: Optional[str] = None,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Upload a document to a dataset from an iterable of byte chunks, sent as a
+    chunked multipart body so the file is never held in memory or on disk.
+    The MIME type is sniffed from the first chunk unless given.
+    Returns (RAGFlow response, throughput report).
+    """
+    chunks = iter(chunks)
+    head = next(chunks, b"")
+    content_type = content_type or upload_stream.detect_mime(file_name, head)
+    meter = upload_stream.UploadMeter(content_type)
+    boundary = uuid.uuid4().hex
+    body = upload_stream.multipart_body(
+        boundary, "file", file_name, content_type, itertools.chain((head,), chunks), meter
+    )
+    try:
+        resp = _http.request(
+            "POST",
+            _url(f"/api/v1/datasets/{dataset_id}/documents"),
+            headers={**_auth_headers(json_content=False), "Content-Type": f"multipart/form-data; boundary={boundary}"},
+            data=body,
+            timeout=max(RAGFLOW_TIMEOUT_SEC, 60),
         )
-    return resp.json()
+        resp.raise_for_status()
+        result = resp.json()
+    except Exception:
+        meter.finish(ok=False)
+        raise
+    report = meter.finish()
+    logger.info(
+        "upload dataset=%s file=%s bytes=%d seconds=%.3f mb_per_s=%s",
+        dataset_id, file_name, report["bytes"], report["seconds"], report["mb_per_s"],
+    )
+    _dataset_changed(dataset_id)
+    return result, report
+
+
+def download_document(dataset_id: str, document_id: str, chunk_size: int = 1024 * 1024) -> Generator[bytes, None, None]:
+    """Stream a stored document's original file back from RAGFlow."""
+    resp = _http.request(
+        "GET",
+        _url(f"/api/v1/datasets/{dataset_id}/documents/{document_id}"),
+        headers=_auth_headers(json_content=False),
+        stream=True,
+        timeout=max(RAGFLOW_TIMEOUT_SEC, 60),
+    )
+    with resp:
+        resp.raise_for_status()
+        if resp.headers.get("Content-Type", "").startswith("application/json"):
+            # RAGFlow reports a missing document as a JSON error body with status 200
+            body = resp.content
+            try:
+                error = json.loads(body)
+            except ValueError:
+                error = None
+            if isinstance(error, dict) and error.get("code") not in (None, 0) and "message" in error:
+                raise RuntimeError(f"download failed: {error['message']}")
+            yield body
+            return
+        yield from resp.iter_content(chunk_size=chunk_size)
 
 
 def parse_documents(dataset_id: str, document_ids: List[str]) -> Dict[str, Any]:
     """Trigger chunking/parsing of documents in a dataset."""
-    return _post(
+    result = _post(
         f"/api/v1/datasets/{dataset_id}/chunks",
         json={"document_ids": document_ids},
     ).json()
+    _dataset_changed(dataset_id)
+    return result
 
 
 def delete_documents(dataset_id: str, document_ids: List[str]) -> Dict[str, Any]:
     """Delete documents from a dataset."""
-    return _delete(
+    result = _delete(
         f"/api/v1/datasets/{dataset_id}/documents",
         json={"ids": document_ids},
     )
+    _dataset_changed(dataset_id)
+    return result
 
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -271,7 +556,13 @@ def retrieve_chunks(
     top_k: int = 6,
     similarity_threshold: float = 0.2,
 ) -> List[Dict[str, Any]]:
-    """Retrieve relevant chunks from datasets based on a question."""
+    """Retrieve relevant chunks from datasets based on a question (cached, see retrieval_cache)."""
+    key = retrieval_cache.make_key(question, dataset_ids, top_k, similarity_threshold)
+    cached = retrieval_cache.get(key)
+    if cached is not None:
+        return cached
+
+    fetched_epoch = retrieval_cache.epoch()
     resp = _post(
         "/api/v1/retrieval",
         json={
@@ -283,9 +574,9 @@ def retrieve_chunks(
     ).json()
 
     data = resp.get("data", {})
-    if isinstance(data, dict):
-        return data.get("chunks", [])
-    return []
+    chunks = data.get("chunks", []) if isinstance(data, dict) else []
+    retrieval_cache.put(key, chunks, fetched_epoch)
+    return chunks
 
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -301,6 +592,11 @@ def _resolve_chat_id(chat_id: str = "") -> str:
     return cid
 
 
+def default_chat_id() -> str:
+    """RAGFLOW_CHAT_ID, the assistant used when a caller names none."""
+    return _resolve_chat_id()
+
+
 def chat_completion(
     question: str, chat_id: str = "", session_id: Optional[str] = None
 ) -> Dict[str, Any]:
@@ -389,9 +685,9 @@ def chat_completion_stream(
 def chat_completion_stream_stateless(messages: List[Dict[str, Any]], chat_id: str) -> Generator[str, None, None]:
     """Stateless streaming: caller passes the full message history array."""
     cid = (chat_id or RAGFLOW_CHAT_ID).strip()
-    url = f"{RAGFLOW_BASE_URL}/api/v1/openai/{cid}/chat/completions"
+    url = _url(f"/api/v1/openai/{cid}/chat/completions")
     payload = {"model": "model", "messages": messages, "stream": True}
-    resp = requests.post(url, json=payload, headers=_auth_headers(), stream=True, timeout=120)
+    resp = _http.request("POST", url, json=payload, headers=_auth_headers(), stream=True, timeout=120)
     resp.raise_for_status()
     for line in resp.iter_lines():
         if line:
@@ -404,13 +700,14 @@ def chat_completion_stream_stateful(
 ) -> Generator[str, None, None]:
     """Stateful streaming: RAGFlow tracks history server-side via session_id."""
     cid = (chat_id or RAGFLOW_CHAT_ID).strip()
-    url = f"{RAGFLOW_BASE_URL}/api/v1/chats/{cid}/completions"
+    url = _url(f"/api/v1/chats/{cid}/completions")
     payload = {
         "question": question,
         "session_id": session_id,
         "stream": True
     }
-    resp = requests.post(
+    resp = _http.request(
+        "POST",
         url,
         json=payload,
         headers=_auth_headers(),
@@ -430,9 +727,7 @@ def chat_completion_stream_stateful(
 def create_session(chat_id: str = "", name: str = "Guru-Sikshan Session") -> Dict[str, Any]:
     """Create a new chat session."""
     cid = _resolve_chat_id(chat_id)
-    print("[ragflow_client] session url:", _url(f"/api/v1/chats/{cid}/sessions"))
-    print("[ragflow_client] chat id:", cid)
-    cid = _resolve_chat_id(chat_id)
+    logger.debug("create_session chat_id=%s", cid)
     return _post(
         f"/api/v1/chats/{cid}/sessions",
         json={"name": name},
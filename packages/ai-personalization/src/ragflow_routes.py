@@ -7,19 +7,31 @@ Flask routes for RAGFlow integration.
 
 import json
 import os
-import tempfile
+import uuid
+import shutil
 import traceback
 import time
-import bcrypt
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 from functools import wraps
 
 import google.generativeai as genai
 from flask import Blueprint, Response, jsonify, request, stream_with_context, g
 import jwt
+from werkzeug.utils import secure_filename
 
 
 import ragflow_client as rf
+import ragflow_async_client as arf
+import answer_cache
+import content_index
+import dataset_routing
+import ingest_jobs
+import parse_tracker
+import upload_stream
+import upload_transactions
+from auth.client_auth import get_cached_client, cache_verified_client, mark_client_used
+from auth.hash_pool import check_secret, HashPoolSaturated
+from auth.token_cache import cached_decode
 from resource_registry import get_resources_for_cluster, get_exemplary_resources
 from supabase_client import db
 
@@ -71,23 +83,30 @@ def client_token():
         if not client_id or not client_secret:
             return jsonify(success=False, error="client_id and client_secret required"), 400
         
-        result = db.client.table("api_clients")\
-            .select("client_secret_hash, is_active, allowed_scopes, name")\
-            .eq("client_id", client_id)\
-            .single()\
-            .execute()
-        
-        if not result.data:
-            return jsonify(success=False, error="Invalid client_id"), 401
-        
-        client = result.data[0] if isinstance(result.data, list) else result.data
-        
-        if not client.get("is_active"):
-            return jsonify(success=False, error="Client is disabled"), 403
-        
-        stored_hash = client["client_secret_hash"]
-        if not bcrypt.checkpw(client_secret.encode(), stored_hash.encode()):
-            return jsonify(success=False, error="Invalid client_secret"), 401
+        # Shared with /api/public/auth/token — a recent verification skips Supabase + bcrypt
+        client = get_cached_client(client_id, client_secret)
+        if client is None:
+            result = db.client.table("api_clients")\
+                .select("client_secret_hash, is_active, allowed_scopes, name")\
+                .eq("client_id", client_id)\
+                .single()\
+                .execute()
+            
+            if not result.data:
+                return jsonify(success=False, error="Invalid client_id"), 401
+            
+            client = result.data[0] if isinstance(result.data, list) else result.data
+            
+            if not client.get("is_active"):
+                return jsonify(success=False, error="Client is disabled"), 403
+            
+            stored_hash = client["client_secret_hash"]
+            if not check_secret(client_secret, stored_hash):
+                return jsonify(success=False, error="Invalid client_secret"), 401
+
+            cache_verified_client(client_id, client_secret, client)
+
+        mark_client_used(client_id)
         
         # Check scopes (ensure client has chat permissions)
         scopes = client.get("allowed_scopes", [])
@@ -109,7 +128,6 @@ def client_token():
             "exp": int(time.time()) + 900,     # 15 minutes wrapper
         }
         
-        token = jwt.encode(payload, JWT_SECRET, algorithm="HS256")
         token = jwt.encode(payload, JWT_SECRET, algorithm="HS256")
         
         return jsonify(
@@ -119,6 +137,8 @@ def client_token():
             token_type="Bearer"
         )
     
+    except HashPoolSaturated:
+        return jsonify(success=False, error="Too many credential checks in progress, retry shortly"), 503, {"Retry-After": "1"}
     except Exception as e:
         traceback.print_exc()
         return jsonify(success=False, error=str(e)), 500
@@ -129,6 +149,11 @@ def client_token():
 
 
 
+def _decode_dashboard_token(token: str) -> Dict[str, Any]:
+    # skip audience verification , not needed
+    return jwt.decode(token, JWT_SECRET, algorithms=["HS256"], options={"verify_aud": False})
+
+
 def require_jwt(auth_required: bool = True) -> callable:
     """
     Decorator to require JWT authentication.
@@ -159,8 +184,7 @@ def require_jwt(auth_required: bool = True) -> callable:
             token = auth_header.split(" ")[1]
             
             try:
-                # skip audience verification , not needed
-                payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"], options={"verify_aud": False})
+                payload = cached_decode(token, _decode_dashboard_token, "dashboard")
                 g.user = payload
             except jwt.ExpiredSignatureError:
                 if auth_required:
@@ -274,54 +298,44 @@ def _resolve_dataset_id(dataset_id: str = "", dataset_name: str = "") -> str:
         raise ValueError("dataset_name or dataset_id required")
 
 
-    dataset = rf.get_or_create_dataset(
-        name=name,
+    resolved_id = dataset_routing.dataset_id_for_name(
+        name,
         description=f"Guru-Sikshan dataset for {name}",
         chunk_method="naive",
     )
-    resolved_id = dataset.get("id", "") or dataset.get("dataset_id", "") or ""
     if not resolved_id:
         raise ValueError(f"Unable to resolve dataset id for {name}")
     return resolved_id
 
 
 
-def _extract_document_ids(payload: Any) -> List[str]:
-    """Extract document IDs from various response formats."""
-    if isinstance(payload, list):
-        ids: List[str] = []
-        for item in payload:
-            if isinstance(item, dict):
-                value = item.get("id") or item.get("document_id") or item.get("doc_id")
-                if value:
-                    ids.append(str(value))
-            elif isinstance(item, str):
-                ids.append(item)
-        return ids
-
-
-    if isinstance(payload, dict):
-        for key in ("ids", "document_ids"):
-            value = payload.get(key)
-            if isinstance(value, list):
-                return [str(v) for v in value if v]
-
-
-        for key in ("id", "document_id", "doc_id"):
-            value = payload.get(key)
-            if value:
-                return [str(value)]
-
+def _completion_text(result: Any) -> str:
+    if not isinstance(result, dict):
+        return ""
+    choices = result.get("choices") or []
+    first = choices[0] if choices else {}
+    return (first.get("message") or {}).get("content") or ""
 
-        for key in ("documents", "data", "docs"):
-            value = payload.get(key)
-            ids = _extract_document_ids(value)
-            if ids:
-                return ids
 
+def _open_upload(*leading_fields: str) -> upload_stream.MultipartUpload:
+    """
+    Start reading the request's "file" part straight off the body stream (no
+    request.files). `leading_fields` are form fields the route reads before
+    the upload; sending one after the file is a LateFieldError.
+    """
+    return upload_stream.MultipartUpload(
+        request.stream, request.content_type or "", file_field="file", leading_fields=leading_fields
+    )
 
-    return []
 
+def _declared_sha256(upload: upload_stream.MultipartUpload) -> str:
+    """SHA-256 the client sent ahead of the file (unverified; see content_index.upload)."""
+    return (
+        request.args.get("sha256")
+        or upload.fields.get("sha256")
+        or request.headers.get("X-Content-SHA256")
+        or ""
+    )
 
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -403,6 +417,9 @@ def create_dataset():
             description=data.get("description", ""),
             chunk_method=data.get("chunk_method", "naive"),
         )
+        created = result.get("data", result) if isinstance(result, dict) else {}
+        if isinstance(created, dict) and created.get("id"):
+            dataset_routing.remember_dataset(name, created["id"])
         return jsonify(success=True, dataset=result)
     except Exception as e:
         traceback.print_exc()
@@ -417,12 +434,27 @@ def delete_dataset(dataset_id: str):
     """Delete a dataset."""
     try:
         result = rf.delete_dataset(dataset_id)
+        dataset_routing.forget_dataset(dataset_id)
+        content_index.forget_dataset(dataset_id)
         return jsonify(success=True, result=result)
     except Exception as e:
         traceback.print_exc()
         return jsonify(error=str(e)), 500
 
 
+@ragflow_bp.route("/datasets/routing/refresh", methods=["POST"])
+@require_jwt(auth_required=True)
+@require_admin_or_higher()
+def refresh_dataset_routing():
+    """Reload the board→dataset and name→dataset tables (call after routing changes)."""
+    try:
+        ok = dataset_routing.refresh()
+        return jsonify(success=ok, routing=dataset_routing.routing_stats())
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify(error=str(e)), 500
+
+
 #DONE
 @ragflow_bp.route("/datasets/resolve", methods=["POST"])
 @require_jwt(auth_required=True)
@@ -466,34 +498,34 @@ def list_documents(dataset_id: str):
 @require_jwt(auth_required=True)
 @require_admin_or_higher()
 def upload_document(dataset_id: str):
-    """Upload a document to a dataset."""
+    """
+    Upload a document to a dataset, streamed through to RAGFlow (see
+    upload_stream). Content the dataset already holds is not stored twice: the
+    existing document id is returned with duplicate=true (see content_index).
+    """
     try:
-        if "file" not in request.files:
-            return jsonify(error="file required"), 400
-
-
-        uploaded = request.files["file"]
-        if not uploaded or not uploaded.filename:
+        try:
+            upload = _open_upload("sha256")
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
+        if not upload.filename:
             return jsonify(error="valid file required"), 400
 
 
-        suffix = os.path.splitext(uploaded.filename)[1] or ".pdf"
-        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
-            uploaded.save(tmp.name)
-            tmp_path = tmp.name
-
-
         try:
-            result = rf.upload_document(dataset_id, tmp_path)
-        finally:
-            try:
-                os.unlink(tmp_path)
-            except Exception:
-                pass
-
-
-        document_ids = _extract_document_ids(result)
-        return jsonify(success=True, result=result, document_ids=document_ids)
+            outcome = content_index.upload(dataset_id, upload.filename, upload.chunks(), sha256=_declared_sha256(upload))
+            upload.finish()
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
+        return jsonify(
+            success=True,
+            result=outcome["result"],
+            document_ids=outcome["document_ids"],
+            upload_stats=outcome["upload_stats"],
+            sha256=outcome["sha256"],
+            duplicate=outcome["duplicate"],
+            declared_hash=outcome["declared_hash"],
+        )
     except Exception as e:
         traceback.print_exc()
         return jsonify(error=str(e)), 500
@@ -504,7 +536,11 @@ def upload_document(dataset_id: str):
 @require_jwt(auth_required=True)
 @require_admin_or_higher()
 def parse_documents(dataset_id: str):
-    """Trigger chunking/parsing of documents."""
+    """
+    Trigger chunking/parsing of documents. Progress is then followed by
+    parse_tracker (see GET /datasets/<id>/parse-status); pass webhook_url to
+    be notified when they have all finished.
+    """
     try:
         data = request.json or {}
         ids = data.get("document_ids") or data.get("ids") or []
@@ -513,12 +549,23 @@ def parse_documents(dataset_id: str):
 
 
         result = rf.parse_documents(dataset_id, ids)
+        parse_tracker.track(dataset_id, ids, webhook=(data.get("webhook_url") or "").strip())
         return jsonify(success=True, result=result, parsed_ids=ids)
     except Exception as e:
         traceback.print_exc()
         return jsonify(error=str(e)), 500
 
 
+@ragflow_bp.route("/datasets/<dataset_id>/parse-status", methods=["GET"])
+@require_jwt(auth_required=True)
+@require_admin_or_higher()
+def parse_status(dataset_id: str):
+    """Parse progress from parse_tracker's in-memory state (?ids=a,b for specific documents)."""
+    ids = [i for i in (request.args.get("ids") or "").split(",") if i.strip()]
+    documents = parse_tracker.status([i.strip() for i in ids] if ids else None, dataset_id=dataset_id)
+    return jsonify(success=True, documents=documents, summary=parse_tracker.summary(dataset_id))
+
+
 #DONE
 @ragflow_bp.route("/datasets/<dataset_id>/documents", methods=["DELETE"])
 @require_jwt(auth_required=True)
@@ -536,66 +583,233 @@ def delete_documents(dataset_id: str):
 
 
         result = rf.delete_documents(dataset_id, ids)
+        content_index.forget_documents(dataset_id, ids)
         return jsonify(success=True, result=result, deleted_ids=ids)
     except Exception as e:
         traceback.print_exc()
         return jsonify(error=str(e)), 500
 
 
+def _transaction_response(txn: Dict[str, Any], dataset_name: Optional[str]):
+    return jsonify(
+        success=True,
+        dataset_id=txn["dataset_id"],
+        dataset_name=dataset_name,
+        upload_result=txn["upload_result"],
+        upload_stats=txn["upload_stats"],
+        document_ids=txn["document_ids"],
+        sha256=txn["sha256"],
+        duplicate=txn["duplicate"],
+        declared_hash=txn.get("declared_hash", False),
+        parse_result=txn["parse_result"],
+        replayed=txn["replayed"],
+        transaction=txn,
+    )
+
+
 # Main
-# TODO : Update this function such that it atomic , either do it all or do none
 @ragflow_bp.route("/documents/upload-and-parse", methods=["POST"])
 @require_jwt(auth_required=True)
 @require_admin_or_higher()
 def upload_and_parse_document():
-    """Upload and automatically parse a document."""
+    """
+    Upload and automatically parse a document as one transaction (see
+    upload_transactions). dataset_id / dataset_name are read from the query
+    string or from form fields sent before the file; sending one of the
+    route's fields after the file is a 400, and anything it already did is
+    rolled back.
+
+    Send an Idempotency-Key header (or idempotency_key field) to make retries
+    safe: a retry resumes at the failed step without re-sending the file to
+    RAGFlow, and a finished transaction is replayed. A key in the header or
+    query string is checked before the body is read, so such a retry needs
+    no file part at all. A parse that cannot be completed removes the
+    uploaded document again. Duplicate content returns the existing document
+    and is not re-parsed.
+    """
     try:
-        dataset_id = (request.form.get("dataset_id") or "").strip()
-        dataset_name = (request.form.get("dataset_name") or DEFAULT_DATASET_NAME).strip()
-        resolved_dataset_id = _resolve_dataset_id(dataset_id=dataset_id, dataset_name=dataset_name)
+        key = (request.headers.get("Idempotency-Key") or request.args.get("idempotency_key") or "").strip()
+        if key:
+            # replay / resume before asking for a file the transaction may not need
+            dataset_id = (request.args.get("dataset_id") or "").strip()
+            dataset_name = (request.args.get("dataset_name") or "").strip()
+            expected = _resolve_dataset_id(dataset_id=dataset_id, dataset_name=dataset_name) if dataset_id or dataset_name else ""
+            try:
+                txn = upload_transactions.resume(key, dataset_id=expected, webhook=(request.args.get("webhook_url") or "").strip())
+            except upload_transactions.TransactionError as e:
+                return jsonify(success=False, error=str(e), transaction=e.transaction), e.status
+            if txn is not None:
+                return _transaction_response(txn, dataset_name or None)
 
+        try:
+            upload = _open_upload("dataset_id", "dataset_name", "idempotency_key", "sha256", "webhook_url")
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
+        if not upload.filename:
+            return jsonify(error="valid file required"), 400
 
-        if "file" not in request.files:
-            return jsonify(error="file required"), 400
 
+        dataset_id = (request.args.get("dataset_id") or upload.fields.get("dataset_id") or "").strip()
+        dataset_name = (request.args.get("dataset_name") or upload.fields.get("dataset_name") or DEFAULT_DATASET_NAME).strip()
+        resolved_dataset_id = _resolve_dataset_id(dataset_id=dataset_id, dataset_name=dataset_name)
+        key = key or (upload.fields.get("idempotency_key") or "").strip()
+        webhook = request.args.get("webhook_url") or upload.fields.get("webhook_url") or ""
 
-        uploaded = request.files["file"]
-        if not uploaded or not uploaded.filename:
-            return jsonify(error="valid file required"), 400
 
+        try:
+            txn = upload_transactions.run(
+                resolved_dataset_id,
+                upload.filename,
+                upload.chunks(),
+                key=key,
+                sha256=_declared_sha256(upload),
+                webhook=webhook.strip(),
+            )
+        except upload_transactions.TransactionError as e:
+            return jsonify(success=False, error=str(e), transaction=e.transaction), e.status
 
-        suffix = os.path.splitext(uploaded.filename)[1] or ".pdf"
-        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
-            uploaded.save(tmp.name)
-            tmp_path = tmp.name
+        # a skipped upload never read the body: make sure nothing we acted on came late
+        try:
+            upload.finish()
+        except ValueError as e:
+            if not txn["replayed"]:
+                txn = upload_transactions.abort(txn["idempotency_key"], str(e))
+            return jsonify(success=False, error=str(e), transaction=txn), 400
 
 
+        return _transaction_response(txn, dataset_name)
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify(error=str(e)), 500
+
+
+@ragflow_bp.route("/documents/upload-and-parse/<idempotency_key>", methods=["POST"])
+@require_jwt(auth_required=True)
+@require_admin_or_higher()
+def resume_upload_transaction(idempotency_key: str):
+    """
+    Retry an upload-and-parse transaction by key alone: a finished one is
+    replayed, one whose document is already in RAGFlow is parsed again. A
+    transaction that needs its file (failed during the upload) answers 409;
+    re-send the file to /documents/upload-and-parse with the same key.
+    Optional JSON body: {"webhook_url"}.
+    """
+    try:
+        webhook = ((request.get_json(silent=True) or {}).get("webhook_url") or "").strip()
         try:
-            upload_result = rf.upload_document(resolved_dataset_id, tmp_path)
-        finally:
-            try:
-                os.unlink(tmp_path)
-            except Exception:
-                pass
+            txn = upload_transactions.resume(idempotency_key, webhook=webhook)
+        except upload_transactions.TransactionError as e:
+            return jsonify(success=False, error=str(e), transaction=e.transaction), e.status
+        if txn is None:
+            stored = upload_transactions.get(idempotency_key)
+            if stored is None:
+                return jsonify(error="transaction not found"), 404
+            return jsonify(
+                success=False,
+                error="the upload has to be repeated: re-send the file to /documents/upload-and-parse with this key",
+                transaction=stored,
+            ), 409
+        return _transaction_response(txn, None)
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify(error=str(e)), 500
 
 
-        document_ids = _extract_document_ids(upload_result)
-        parse_result = None
-        if document_ids:
-            parse_result = rf.parse_documents(resolved_dataset_id, document_ids)
+@ragflow_bp.route("/documents/upload-and-parse/<idempotency_key>", methods=["GET"])
+@require_jwt(auth_required=True)
+@require_admin_or_higher()
+def get_upload_transaction(idempotency_key: str):
+    """State of an upload-and-parse transaction."""
+    txn = upload_transactions.get(idempotency_key)
+    if txn is None:
+        return jsonify(error="transaction not found"), 404
+    return jsonify(success=True, transaction=txn)
 
 
-        return jsonify(
-            success=True,
-            dataset_id=resolved_dataset_id,
-            dataset_name=dataset_name,
-            upload_result=upload_result,
-            document_ids=document_ids,
-            parse_result=parse_result,
+# ─────────────────────────────────────────────────────────────────────────────
+# Bulk Ingestion (see ingest_jobs)
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+@ragflow_bp.route("/ingest", methods=["POST"])
+@require_jwt(auth_required=True)
+@require_admin_or_higher()
+def start_ingest():
+    """
+    Start a bulk ingestion job and return its id immediately (202).
+
+    multipart/form-data: one or more "files" parts (documents or .zip archives)
+    plus optional dataset_id / dataset_name / parse_batch_size fields.
+    JSON: {"paths": [...]} of files, directories or zips under UPLOAD_DIR,
+    with the same optional keys and "parse": false to upload only.
+    webhook_url, if given, is called as each parse batch finishes.
+    """
+    staged = ""
+    try:
+        if request.files:
+            options = request.form
+            paths = []
+            staged = ingest_jobs.staging_dir(uuid.uuid4().hex)
+            for i, uploaded in enumerate(request.files.getlist("files") + request.files.getlist("file")):
+                name = secure_filename(uploaded.filename or "") or f"document-{i}"
+                path = os.path.join(staged, f"{i:05d}-{name}")
+                uploaded.save(path)
+                paths.append(path)
+        else:
+            options = request.json or {}
+            requested = options.get("paths") or ([options["path"]] if options.get("path") else [])
+            paths = [ingest_jobs.resolve_ingest_path(str(p)) for p in requested]
+        if not paths:
+            return jsonify(error="files or paths required"), 400
+
+
+        sources = [source for path in paths for source in ingest_jobs.sources_from_path(path)]
+        if not sources:
+            return jsonify(error="no ingestable documents found"), 400
+
+
+        dataset_id = _resolve_dataset_id(
+            dataset_id=(options.get("dataset_id") or "").strip(),
+            dataset_name=(options.get("dataset_name") or DEFAULT_DATASET_NAME).strip(),
+        )
+        parse = str(options.get("parse", True)).lower() not in ("false", "0", "no")
+        batch_size = int(options.get("parse_batch_size") or ingest_jobs.INGEST_PARSE_BATCH_SIZE)
+        job = ingest_jobs.create_job(
+            dataset_id, sources, parse=parse, parse_batch_size=batch_size,
+            webhook=(options.get("webhook_url") or "").strip(),
         )
+        if staged:
+            job.cleanup.append(staged)
+            staged = ""
+        ingest_jobs.start_job(job)
+        return jsonify(success=True, job_id=job.id, dataset_id=dataset_id, total=len(sources)), 202
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
     except Exception as e:
         traceback.print_exc()
         return jsonify(error=str(e)), 500
+    finally:
+        if staged:
+            shutil.rmtree(staged, ignore_errors=True)
+
+
+@ragflow_bp.route("/ingest", methods=["GET"])
+@require_jwt(auth_required=True)
+@require_admin_or_higher()
+def list_ingest_jobs():
+    """Recent ingestion jobs, newest first."""
+    return jsonify(success=True, jobs=ingest_jobs.list_jobs())
+
+
+@ragflow_bp.route("/ingest/<job_id>", methods=["GET"])
+@require_jwt(auth_required=True)
+@require_admin_or_higher()
+def get_ingest_job(job_id: str):
+    """Progress of one ingestion job."""
+    job = ingest_jobs.get_job(job_id)
+    if job is None:
+        return jsonify(error="job not found"), 404
+    return jsonify(success=True, job=job)
 
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -848,12 +1062,19 @@ def ask():
             )
 
 
+        # completions are stateless on RAGFlow's side, so session_id is not part of the key
+        result = answer_cache.lookup(final_question, chat_id)
+        if result is not None:
+            return jsonify(success=True, result=result, cached=True)
+
         result = rf.chat_completion(
             final_question,
             chat_id=chat_id,
             session_id=session_id,
         )
-        return jsonify(success=True, result=result)
+        if _completion_text(result):
+            answer_cache.store(final_question, chat_id, None, result)
+        return jsonify(success=True, result=result, cached=False)
 
 
     except Exception as e:
@@ -883,12 +1104,21 @@ def retrieve():
         similarity_threshold = float(data.get("similarity_threshold", 0.2))
 
 
-        chunks = rf.retrieve_chunks(
-            question=question,
-            dataset_ids=dataset_ids,
-            top_k=top_k,
-            similarity_threshold=similarity_threshold,
-        )
+        # Several datasets → query them concurrently and merge by similarity
+        if len(dataset_ids) > 1:
+            chunks = arf.run(arf.retrieve_chunks_multi(
+                question=question,
+                dataset_ids=dataset_ids,
+                top_k=top_k,
+                similarity_threshold=similarity_threshold,
+            ))
+        else:
+            chunks = rf.retrieve_chunks(
+                question=question,
+                dataset_ids=dataset_ids,
+                top_k=top_k,
+                similarity_threshold=similarity_threshold,
+            )
         return jsonify(success=True, dataset_ids=dataset_ids, chunks=chunks, count=len(chunks))
     except Exception as e:
         traceback.print_exc()
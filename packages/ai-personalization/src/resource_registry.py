@@ -4,7 +4,10 @@ Curated teacher-training content sources with geo-tagging.
 Used by ragflow_client.py to seed/recommend resources based on teacher location.
 """
 # TODO : This is just a base to use later when multiple datasets are available. Not rn , for now as long as it works for one dataset its fine
-from typing import List, Optional
+import re
+from functools import lru_cache
+from types import MappingProxyType
+from typing import List, Mapping, Optional, Sequence, Tuple
 
 RESOURCE_REGISTRY = [
     # ── NATIONAL / MULTI-STATE ──────────────────────────────────────────────
@@ -232,19 +235,22 @@ STATE_CLUSTER_MAP = {
 }
 
 
-def get_resources_for_cluster(cluster: str, competency_area: Optional[str] = None) -> List[dict]:
-    """
-    Return resources sorted by geo-relevance and priority.
-    cluster: the teacher's cluster string (city / district / state)
-    competency_area: optional filter (e.g. 'pedagogy')
-    """
-    cluster_lower = cluster.lower()
-    state_code = None
-    for keyword, code in STATE_CLUSTER_MAP.items():
-        if keyword in cluster_lower:
-            state_code = code
-            break
+# ── Lookup index ────────────────────────────────────────────────────────────
+# Built at import (and by rebuild_index() if the tables above change at runtime):
+#   _CLUSTER_PATTERN  one regex finding every STATE_CLUSTER_MAP keyword in a
+#                     cluster string in a single pass
+#   _INDEX            (state_code | None, competency_area | None) → presorted
+#                     tuple of read-only resource views carrying _geo_score
+# Cluster strings seen before are memoised, so a lookup is two dict hits.
+
+RESOURCE_CLUSTER_MEMO_SIZE = 4096
 
+_CLUSTER_PATTERN = None
+_KEYWORD_RANK: dict = {}
+_INDEX: dict = {}
+
+
+def _ranked(state_code: Optional[str], competency_area: Optional[str]) -> Tuple[Mapping, ...]:
     results = []
     for r in RESOURCE_REGISTRY:
         if competency_area and competency_area not in r["competency_areas"]:
@@ -257,8 +263,48 @@ def get_resources_for_cluster(cluster: str, competency_area: Optional[str] = Non
         results.append({**r, "_geo_score": geo_score})
 
     results.sort(key=lambda x: (-x["_geo_score"], x["priority"]))
-    return results
+    return tuple(MappingProxyType(r) for r in results)
+
+
+def rebuild_index() -> None:
+    """Recompute the matcher and presorted results from the current tables."""
+    global _CLUSTER_PATTERN, _KEYWORD_RANK, _INDEX
+    keywords = list(STATE_CLUSTER_MAP)
+    # a zero-width lookahead reports overlapping keywords too; at each position
+    # the alternation prefers the earliest map entry, matching the old scan order
+    _CLUSTER_PATTERN = re.compile("(?=(" + "|".join(re.escape(k) for k in keywords) + "))")
+    _KEYWORD_RANK = {k: i for i, k in enumerate(keywords)}
+
+    states = {None, *STATE_CLUSTER_MAP.values()}
+    areas = {None, *(a for r in RESOURCE_REGISTRY for a in r["competency_areas"])}
+    _INDEX = {(s, a): _ranked(s, a) for s in states for a in areas}
+    _state_for_cluster.cache_clear()
+
+
+@lru_cache(maxsize=RESOURCE_CLUSTER_MEMO_SIZE)
+def _state_for_cluster(cluster: str) -> Optional[str]:
+    """State code of the first STATE_CLUSTER_MAP keyword (in map order) found in `cluster`."""
+    found = [m.group(1) for m in _CLUSTER_PATTERN.finditer(cluster.lower())]
+    if not found:
+        return None
+    return STATE_CLUSTER_MAP[min(found, key=_KEYWORD_RANK.__getitem__)]
+
+
+def get_resources_for_cluster(cluster: str, competency_area: Optional[str] = None) -> Sequence[Mapping]:
+    """
+    Return resources sorted by geo-relevance and priority.
+    cluster: the teacher's cluster string (city / district / state)
+    competency_area: optional filter (e.g. 'pedagogy')
+
+    The result is a shared, precomputed tuple of read-only mappings; copy an
+    entry with dict() before changing it.
+    """
+    state_code = _state_for_cluster(cluster or "") if STATE_CLUSTER_MAP else None
+    return _INDEX.get((state_code, competency_area or None), ())
 
 
 def get_exemplary_resources() -> List[dict]:
-    return [r for r in RESOURCE_REGISTRY if r.get("exemplary")]
\ No newline at end of file
+    return [r for r in RESOURCE_REGISTRY if r.get("exemplary")]
+
+
+rebuild_index()
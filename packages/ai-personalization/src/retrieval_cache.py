@@ -0,0 +1,116 @@
+"""
+retrieval_cache.py — memoised RAGFlow retrieval results
+
+/query/retrieve, /query/ask-from-dataset, /api/lesson/context and
+/api/lesson/generate send the same (question, dataset_ids, top_k,
+similarity_threshold) tuples over and over; lesson generation always asks
+"{class} {subject} {topic}". ragflow_client.retrieve_chunks (and its async
+twin) consult this LRU + TTL cache before hitting the vector store.
+
+Keys are normalised: the question is lower-cased with whitespace collapsed, and
+dataset ids are de-duplicated and sorted. Empty results are not cached
+because they usually mean documents are still being parsed.
+
+Document changes call invalidate_dataset(). Every invalidation bumps an epoch,
+and put() drops results fetched under an older epoch so a retrieval racing an
+upload cannot re-insert stale chunks.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "4096"))
+RETRIEVAL_CACHE_TTL  = int(os.getenv("RETRIEVAL_CACHE_TTL", "900"))
+
+Key = Tuple[str, Tuple[str, ...], int, float]
+
+_lock    = threading.Lock()
+_entries: "OrderedDict[Key, Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+_by_dataset: Dict[str, set] = {}
+_epoch   = 0
+_versions: Dict[str, int] = {}        # dataset_id -> bumps since start, for downstream cache keys
+_stats   = {"hits": 0, "misses": 0, "stores": 0, "stale_drops": 0, "invalidations": 0}
+
+
+def make_key(question: str, dataset_ids: Iterable[str], top_k: int, similarity_threshold: float) -> Key:
+    return (
+        " ".join((question or "").lower().split()),
+        tuple(sorted({str(d) for d in (dataset_ids or []) if d})),
+        int(top_k),
+        round(float(similarity_threshold), 4),
+    )
+
+
+def epoch() -> int:
+    """Read before fetching; pass to put() so stale results are discarded."""
+    return _epoch
+
+
+def dataset_version(dataset_id: str) -> int:
+    """How many times `dataset_id` has changed in this process; 0 if never."""
+    return _versions.get(dataset_id or "", 0)
+
+
+def _remove(key: Key) -> None:
+    _entries.pop(key, None)
+    for ds in key[1]:
+        keys = _by_dataset.get(ds)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del _by_dataset[ds]
+
+
+def get(key: Key) -> Optional[List[Dict[str, Any]]]:
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                _entries.move_to_end(key)
+                _stats["hits"] += 1
+                return list(entry[1])
+            _remove(key)
+        _stats["misses"] += 1
+    return None
+
+
+def put(key: Key, chunks: List[Dict[str, Any]], fetched_epoch: int) -> None:
+    if not chunks:
+        return
+    with _lock:
+        if fetched_epoch != _epoch:
+            _stats["stale_drops"] += 1
+            return
+        _entries[key] = (time.monotonic() + RETRIEVAL_CACHE_TTL, list(chunks))
+        _entries.move_to_end(key)
+        for ds in key[1]:
+            _by_dataset.setdefault(ds, set()).add(key)
+        _stats["stores"] += 1
+        while len(_entries) > RETRIEVAL_CACHE_SIZE:
+            _remove(next(iter(_entries)))
+
+
+def invalidate_dataset(dataset_id: str) -> int:
+    """Forget every cached retrieval that touched `dataset_id`."""
+    global _epoch
+    with _lock:
+        _epoch += 1
+        _versions[dataset_id] = _versions.get(dataset_id, 0) + 1
+        keys = list(_by_dataset.get(dataset_id, ()))
+        for key in keys:
+            _remove(key)
+        _stats["invalidations"] += len(keys)
+    return len(keys)
+
+
+def retrieval_cache_stats() -> Dict[str, Any]:
+    with _lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "size":     len(_entries),
+            "max_size": RETRIEVAL_CACHE_SIZE,
+            "hit_rate": round(_stats["hits"] / lookups, 4) if lookups else 0.0,
+        }
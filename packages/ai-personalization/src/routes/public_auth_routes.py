@@ -1,6 +1,7 @@
 import time
 from flask import Blueprint, request, jsonify
 from auth.client_auth import authenticate_client
+from auth.hash_pool import HashPoolSaturated
 from auth.token_utils import issue_token
 from middleware.rate_limiter import rate_limit
 from middleware.audit_logger import log_request
@@ -34,7 +35,15 @@ def get_token():
         log_request("/auth/token", 400, start, "missing_credentials")
         return jsonify({"error": "invalid_request", "message": "client_id and client_secret required"}), 400
 
-    client = authenticate_client(client_id, client_secret)
+    try:
+        client = authenticate_client(client_id, client_secret)
+    except HashPoolSaturated:
+        log_request("/auth/token", 503, start, "verifier_saturated")
+        return jsonify({
+            "error": "temporarily_unavailable",
+            "message": "Too many credential checks in progress, retry shortly",
+        }), 503, {"Retry-After": "1"}
+
     if not client:
         log_request("/auth/token", 401, start, "invalid_credentials")
         return jsonify({"error": "invalid_client", "message": "Invalid credentials"}), 401
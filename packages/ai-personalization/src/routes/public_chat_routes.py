@@ -3,15 +3,21 @@ import os
 import time
 import uuid
 import json
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
 from flask import Blueprint, request, jsonify, stream_with_context, Response, g
 from supabase import create_client
 from middleware.auth_middleware import require_token
 from middleware.rate_limiter import rate_limit
 from middleware.audit_logger import log_request
+import answer_cache
 from ragflow_client import (
     chat_completion,
     chat_completion_stream,
+    chat_dataset_ids,
     create_session as ragflow_create_session,
+    default_chat_id,
 )
 from dotenv import load_dotenv, find_dotenv
 
@@ -25,6 +31,8 @@ SUPABASE_KEY = os.environ["SUPABASE_SERVICE_ROLE_KEY"]
 _sb = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "86400"))  # 24 hours
+SESSION_CACHE_SIZE  = int(os.getenv("SESSION_CACHE_SIZE", "10000"))
+SESSION_CACHE_TTL   = int(os.getenv("SESSION_CACHE_TTL", "300"))       # re-read from Supabase after this
 
 print("[debug] ragflow_create_session:", ragflow_create_session)
 print("[debug] module:", getattr(ragflow_create_session, "__module__", None))
@@ -57,6 +65,44 @@ def _make_session_id() -> str:
     return "sess_" + uuid.uuid4().hex
 
 
+# ── session cache ────────────────────────────────────────────
+# api_sessions rows never change after insert apart from expiring, so
+# /message can be served from memory. Entries live until the row's
+# expires_at or SESSION_CACHE_TTL, whichever comes first; only found rows
+# are cached.
+_session_lock  = threading.Lock()
+_session_cache: "OrderedDict[tuple[str, str], tuple[float, datetime, dict]]" = OrderedDict()
+_session_hits   = 0
+_session_misses = 0
+
+
+def _cache_session(session_id: str, client_id: str, row: dict) -> None:
+    expires_at = row["expires_at"]
+    if isinstance(expires_at, str):
+        expires_at = datetime.fromisoformat(expires_at)
+    with _session_lock:
+        _session_cache[(session_id, client_id)] = (time.monotonic() + SESSION_CACHE_TTL, expires_at, row)
+        _session_cache.move_to_end((session_id, client_id))
+        while len(_session_cache) > SESSION_CACHE_SIZE:
+            _session_cache.popitem(last=False)
+
+
+def invalidate_session(session_id: str, client_id: str) -> None:
+    with _session_lock:
+        _session_cache.pop((session_id, client_id), None)
+
+
+def session_cache_stats() -> dict:
+    with _session_lock:
+        total = _session_hits + _session_misses
+        return {
+            "size":     len(_session_cache),
+            "hits":     _session_hits,
+            "misses":   _session_misses,
+            "hit_rate": round(_session_hits / total, 4) if total else 0.0,
+        }
+
+
 # ── health ───────────────────────────────────────────────────
 @public_chat_bp.route("/health", methods=["GET"])
 def health():
@@ -129,17 +175,19 @@ def create_session():
             "details": str(e),
         }), 502
 
-    from datetime import datetime, timezone, timedelta
+    from datetime import timedelta
     expires_at = datetime.now(timezone.utc) + timedelta(seconds=SESSION_TTL_SECONDS)
 
-    _sb.table("api_sessions").insert({
+    row = {
         "client_id":           g.client_id,
         "external_user_id":    external_user_id,
         "internal_session_id": session_id,
         "ragflow_session_id":  rf_session_id,
         "context_json":        context,
         "expires_at":          expires_at.isoformat(),
-    }).execute()
+    }
+    _sb.table("api_sessions").insert(row).execute()
+    _cache_session(session_id, g.client_id, row)
 
     log_request("/chat/session", 201, start)
     return jsonify({
@@ -150,8 +198,25 @@ def create_session():
 
 def _get_valid_session(session_id: str, client_id: str):
     """Fetch session row, enforce ownership + expiry without crashing on 0 rows."""
-    from datetime import datetime, timezone
-    
+    global _session_hits, _session_misses
+    key = (session_id, client_id)
+    with _session_lock:
+        entry = _session_cache.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            _session_cache.move_to_end(key)
+            _session_hits += 1
+        else:
+            _session_cache.pop(key, None)
+            entry = None
+            _session_misses += 1
+
+    if entry is not None:
+        _, expires_at, row = entry
+        if expires_at < datetime.now(timezone.utc):
+            invalidate_session(session_id, client_id)
+            return None, "session_expired"
+        return row, None
+
     result = (
         _sb.table("api_sessions")
         .select("*")
@@ -168,6 +233,7 @@ def _get_valid_session(session_id: str, client_id: str):
     if expires_at < datetime.now(timezone.utc):
         return None, "session_expired"
 
+    _cache_session(session_id, client_id, row)
     return row, None
 
 
@@ -207,21 +273,31 @@ def send_message():
     context       = session_row.get("context_json", {})
     scope_override = body.get("scope", [])
     scopes  = scope_override or context.get("moduleScopes", DEFAULT_DATASETS)
-    ds_ids  = _resolve_datasets(scopes)
 
-    try:
-        rf_resp = chat_completion(
-            question=message,
-            session_id=rf_session_id,
-        )
-    except Exception as e:
-        log_request("/chat/message", 502, start, str(e))
-        return jsonify({"error": "upstream_error", "message": "RAGFlow request failed","details":str(e)}), 502
+    # chat_completion answers from the default assistant's own datasets, so the
+    # cache is keyed (and invalidated) by those; None leaves the entry unscoped,
+    # which any dataset change drops. Entries never cross sessions.
+    chat_id  = default_chat_id()
+    cache_ds = chat_dataset_ids(chat_id)
+    rf_resp = answer_cache.lookup(message, chat_id, cache_ds, session_id=rf_session_id or session_id)
+    cached  = rf_resp is not None
+    if not cached:
+        try:
+            rf_resp = chat_completion(
+                question=message,
+                chat_id=chat_id,
+                session_id=rf_session_id,
+            )
+        except Exception as e:
+            log_request("/chat/message", 502, start, str(e))
+            return jsonify({"error": "upstream_error", "message": "RAGFlow request failed","details":str(e)}), 502
 
     choices = rf_resp.get("choices") or []
     first = choices[0] if choices else {}
     message_obj = first.get("message") or {}
     answer = message_obj.get("content", "") or ""
+    if answer and not cached:
+        answer_cache.store(message, chat_id, cache_ds, rf_resp, session_id=rf_session_id or session_id)
 
     sources = _extract_sources(rf_resp)
 
@@ -233,6 +309,7 @@ def send_message():
         "meta": {
             "datasetsQueried": scopes,
             "latencyMs": int((time.time() - start) * 1000),
+            "cached": cached,
         }
     }), 200
 
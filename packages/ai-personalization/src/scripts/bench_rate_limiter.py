@@ -0,0 +1,72 @@
+"""
+Benchmark: rate limiter throughput with many distinct clients.
+
+Compares the previous list-per-key sliding window (global lock, list rebuilt
+on every check) with the token-bucket engine in middleware.rate_limiter.
+
+Run from src/:
+    python -m scripts.bench_rate_limiter --clients 10000 --checks 500000 --threads 4
+"""
+import argparse
+import random
+import threading
+import time
+
+from middleware import rate_limiter
+
+_legacy_lock = threading.Lock()
+_legacy_windows: dict[str, list[float]] = {}
+
+
+def _legacy_check(key: str, max_calls: int, window_seconds: int) -> bool:
+    """The pre-change implementation, kept here only for comparison."""
+    now = time.monotonic()
+    cutoff = now - window_seconds
+    with _legacy_lock:
+        timestamps = _legacy_windows.get(key, [])
+        timestamps = [t for t in timestamps if t > cutoff]
+        if len(timestamps) >= max_calls:
+            return False
+        timestamps.append(now)
+        _legacy_windows[key] = timestamps
+    return True
+
+
+def _run(check, keys: list[str], checks: int, threads: int) -> float:
+    max_calls, window = rate_limiter.LIMITS["message"]
+    per_thread = checks // threads
+
+    def worker(seed: int):
+        rng = random.Random(seed)
+        for _ in range(per_thread):
+            check(keys[rng.randrange(len(keys))], max_calls, window)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return per_thread * threads / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=10_000)
+    parser.add_argument("--checks", type=int, default=500_000)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    keys = [f"message:gsc_client_{i}" for i in range(args.clients)]
+    before = _run(_legacy_check, keys, args.checks, args.threads)
+    after = _run(rate_limiter._check, keys, args.checks, args.threads)
+
+    print(f"clients          : {args.clients}")
+    print(f"checks / threads : {args.checks} / {args.threads}")
+    print(f"before (checks/s): {before:,.0f}")
+    print(f"after  (checks/s): {after:,.0f}")
+    print(f"speedup          : {after / before:,.1f}x")
+
+
+if __name__ == "__main__":
+    main()
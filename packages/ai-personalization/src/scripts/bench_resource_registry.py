@@ -0,0 +1,76 @@
+"""
+Benchmark: resource_registry.get_resources_for_cluster lookups.
+
+Compares the previous implementation (scan STATE_CLUSTER_MAP, then copy and
+sort RESOURCE_REGISTRY on every call) with the precomputed index, and checks
+that both return the same resources in the same order.
+
+Run from src/:
+    python -m scripts.bench_resource_registry --lookups 200000
+"""
+import argparse
+import random
+import time
+
+import resource_registry as reg
+
+
+def _legacy(cluster, competency_area=None):
+    """The pre-change implementation, kept here only for comparison."""
+    cluster_lower = cluster.lower()
+    state_code = None
+    for keyword, code in reg.STATE_CLUSTER_MAP.items():
+        if keyword in cluster_lower:
+            state_code = code
+            break
+
+    results = []
+    for r in reg.RESOURCE_REGISTRY:
+        if competency_area and competency_area not in r["competency_areas"]:
+            continue
+        geo_score = 0
+        if state_code and state_code in r["states"]:
+            geo_score = 10
+        elif "ALL" in r["states"]:
+            geo_score = 5
+        results.append({**r, "_geo_score": geo_score})
+
+    results.sort(key=lambda x: (-x["_geo_score"], x["priority"]))
+    return results
+
+
+def _run(fn, queries) -> float:
+    start = time.perf_counter()
+    for cluster, area in queries:
+        fn(cluster, area)
+    return len(queries) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lookups", type=int, default=200_000)
+    parser.add_argument("--clusters", type=int, default=500, help="Distinct cluster strings")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    places = list(reg.STATE_CLUSTER_MAP) + ["unknown block", "rural zone"]
+    areas = [None, *sorted({a for r in reg.RESOURCE_REGISTRY for a in r["competency_areas"]})]
+    clusters = [f"{rng.choice(places).title()} Cluster {i}" for i in range(args.clusters)]
+    queries = [(rng.choice(clusters), rng.choice(areas)) for _ in range(args.lookups)]
+
+    for cluster in clusters:
+        for area in areas:
+            expected = _legacy(cluster, area)
+            assert [dict(r) for r in reg.get_resources_for_cluster(cluster, area)] == expected, cluster
+
+    before = _run(_legacy, queries)
+    after = _run(reg.get_resources_for_cluster, queries)
+    print(f"registry / places : {len(reg.RESOURCE_REGISTRY)} / {len(reg.STATE_CLUSTER_MAP)}")
+    print(f"lookups           : {args.lookups} over {args.clusters} clusters")
+    print(f"before (lookups/s): {before:,.0f}")
+    print(f"after  (lookups/s): {after:,.0f}")
+    print(f"speedup           : {after / before:,.1f}x")
+
+
+if __name__ == "__main__":
+    main()
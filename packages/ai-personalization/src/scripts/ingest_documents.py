@@ -0,0 +1,73 @@
+"""
+Bulk-ingest documents into a RAGFlow dataset.
+
+Accepts any mix of files, directories (walked recursively) and .zip archives
+(read in place). Uploads run INGEST_UPLOAD_WORKERS at a time (--workers
+overrides it), and document ids are sent to parse_documents in batches of
+--parse-batch. Progress is printed while the job runs.
+
+Run from src/:
+    python -m scripts.ingest_documents ./ncert/class10 ncert-extra.zip --dataset-name gurusikshan-ncert
+"""
+import argparse
+import os
+import threading
+
+import dataset_routing
+import ingest_jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upload and parse many documents into one dataset")
+    parser.add_argument("paths", nargs="+", help="Files, directories or .zip archives")
+    parser.add_argument("--dataset-id", default="")
+    parser.add_argument("--dataset-name", default=os.getenv("RAGFLOW_DEFAULT_DATASET", "gurusikshan-ncert"))
+    parser.add_argument("--workers", type=int, default=ingest_jobs.INGEST_UPLOAD_WORKERS, help="Parallel uploads")
+    parser.add_argument("--parse-batch", type=int, default=ingest_jobs.INGEST_PARSE_BATCH_SIZE, help="Document ids per parse_documents call")
+    parser.add_argument("--no-parse", action="store_true", help="Upload only")
+    parser.add_argument("--ext", action="append", help="Extension to include (repeatable, default: INGEST_EXTENSIONS)")
+    parser.add_argument("--interval", type=float, default=5.0, help="Seconds between progress lines")
+    args = parser.parse_args()
+
+    ingest_jobs.set_upload_workers(args.workers)
+    extensions = {e if e.startswith(".") else f".{e}" for e in args.ext} if args.ext else ingest_jobs.INGEST_EXTENSIONS
+    sources = [s for path in args.paths for s in ingest_jobs.sources_from_path(path, extensions)]
+    if not sources:
+        raise SystemExit("no ingestable documents found")
+
+    dataset_id = args.dataset_id or dataset_routing.dataset_id_for_name(
+        args.dataset_name,
+        description=f"Guru-Sikshan dataset for {args.dataset_name}",
+        chunk_method="naive",
+    )
+    if not dataset_id:
+        raise SystemExit(f"Unable to resolve dataset id for {args.dataset_name}")
+
+    job = ingest_jobs.create_job(dataset_id, sources, parse=not args.no_parse, parse_batch_size=args.parse_batch)
+    print(f"job {job.id}: {len(sources)} documents → dataset {dataset_id}")
+
+    done = threading.Event()
+
+    def report():
+        while not done.wait(args.interval):
+            s = job.snapshot()
+            print(f"  {s['uploaded'] + s['failed']:>6}/{s['total']}  uploaded={s['uploaded']} failed={s['failed']} "
+                  f"parse_requested={s['parse_requested']}  {s['files_per_s'] or 0:.1f} files/s")
+
+    threading.Thread(target=report, daemon=True).start()
+    final = ingest_jobs.run_job(job)
+    done.set()
+
+    print(f"status           : {final['status']}")
+    print(f"uploaded / failed: {final['uploaded']} / {final['failed']}")
+    print(f"parse calls      : {final['parse_calls']} ({final['parse_requested']} documents)")
+    print(f"elapsed          : {final['elapsed_s']:.2f}s")
+    print(f"throughput       : {final['files_per_s'] or 0:,.2f} files/s, {final['mb_per_s'] or 0:,.2f} MB/s")
+    for error in final["errors"][:20]:
+        print(f"[WARN] {error}")
+    if final["status"] == "failed":
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
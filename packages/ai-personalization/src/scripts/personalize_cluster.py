@@ -0,0 +1,248 @@
+"""
+Batch personalization for a whole cluster.
+
+Loads the cluster's teachers and issues once, then:
+  1. classifies every issue into competency areas (competency_classifier),
+     spread over a process pool;
+  2. groups teachers whose top competency gaps match;
+  3. asks Gemini for one personalized module per group (not per teacher),
+     with at most --llm-concurrency calls in flight;
+  4. bulk-writes a personalized_training row per teacher.
+
+Run from src/:
+    python -m scripts.personalize_cluster --cluster "Cluster A" [--dry-run]
+"""
+import argparse
+import json
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import google.generativeai as genai
+
+from competency_classifier import CompetencyClassifier, get_classifier
+from supabase_client import db
+
+MODEL_NAME = "gemini-2.5-flash"
+
+_worker_classifier = None
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Classification (CPU)
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+def _init_worker(classifier: CompetencyClassifier) -> None:
+    global _worker_classifier
+    _worker_classifier = classifier
+
+
+def _classify_chunk(issues: list[dict]) -> list[dict]:
+    return _worker_classifier.classify_issues(issues)
+
+
+def classify_issues(issues: list[dict], workers: int, chunk_size: int = 500) -> list[dict]:
+    """Classify issues in chunks on a process pool (inline when workers <= 1)."""
+    classifier = get_classifier()
+    if workers <= 1 or len(issues) <= chunk_size:
+        return classifier.classify_issues(issues)
+
+    chunks = [issues[i:i + chunk_size] for i in range(0, len(issues), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(classifier,)) as pool:
+        return [result for chunk in pool.map(_classify_chunk, chunks) for result in chunk]
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Grouping
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+def group_teachers(
+    teachers: list[dict],
+    issues: list[dict],
+    classified: list[dict],
+    max_gaps: int,
+    min_score: float,
+) -> dict[tuple, dict]:
+    """
+    Combine each teacher's issue scores per competency area (noisy-OR), take
+    the top `max_gaps` areas scoring at least `min_score`, and group teachers
+    sharing that gap set. Teachers without a gap are left out.
+    """
+    scores: dict[str, dict[str, float]] = defaultdict(dict)
+    excerpts: dict[str, list[str]] = defaultdict(list)
+    for issue, result in zip(issues, classified):
+        teacher_id = issue.get("teacher_id")
+        if not teacher_id or not result["competencies"]:
+            continue
+        for area, info in result["competencies"].items():
+            prev = scores[teacher_id].get(area, 0.0)
+            scores[teacher_id][area] = 1 - (1 - prev) * (1 - info["score"])
+        if issue.get("description"):
+            excerpts[teacher_id].append(str(issue["description"])[:300])
+
+    groups: dict[tuple, dict] = {}
+    for teacher in teachers:
+        teacher_scores = scores.get(teacher.get("id"), {})
+        ranked = sorted(teacher_scores.items(), key=lambda kv: kv[1], reverse=True)
+        gaps = tuple(sorted(area for area, score in ranked[:max_gaps] if score >= min_score))
+        if not gaps:
+            continue
+        group = groups.setdefault(gaps, {"teachers": [], "excerpts": []})
+        group["teachers"].append(teacher)
+        group["excerpts"].extend(excerpts.get(teacher["id"], [])[:2])
+    return groups
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Generation (LLM, bounded)
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+def load_base_modules(areas: set[str], module_id: str = "") -> dict[str, dict]:
+    """Base module per competency area in one query (or one forced module for all)."""
+    if module_id:
+        module = db.get_base_training_module(module_id)
+        if not module:
+            raise SystemExit(f"Module {module_id} not found")
+        return {area: module for area in areas}
+
+    rows = (
+        db.client.table("training_modules")
+        .select("*")
+        .in_("competency_area", sorted(areas))
+        .order("created_at", desc=True)
+        .execute()
+    ).data or []
+    modules: dict[str, dict] = {}
+    for row in rows:
+        modules.setdefault(row["competency_area"], row)
+    return modules
+
+
+def _build_prompt(gaps: tuple, module: dict, group: dict) -> str:
+    issues = "\n".join(f"- {e}" for e in group["excerpts"][:8]) or "- (no issue text)"
+    return f"""You are a teacher-training designer for Indian government schools.
+Adapt the base training module below for a group of {len(group['teachers'])} teachers
+whose reported classroom issues point to these competency gaps: {", ".join(gaps)}.
+
+Base module: {module.get('title', '')}
+{module.get('description', '')}
+
+Representative issues reported by these teachers:
+{issues}
+
+Write the personalized module in Markdown: a short overview, 3-5 practical
+sessions tied to the issues above, and a checklist teachers can use in class."""
+
+
+def generate_group_modules(groups: dict[tuple, dict], modules: dict[str, dict], concurrency: int) -> dict[tuple, dict]:
+    """One Gemini call per group with at most `concurrency` in flight."""
+    model = genai.GenerativeModel(MODEL_NAME, generation_config={"temperature": 0.5})
+
+    def generate(gaps: tuple) -> dict:
+        # base the group's module on the first gap area that has one
+        module = next((modules[a] for a in gaps if a in modules), None)
+        if module is None:
+            return {"error": f"no base module for {', '.join(gaps)}", "called": False}
+        try:
+            response = model.generate_content(_build_prompt(gaps, module, groups[gaps]))
+            return {"module": module, "content": response.text, "called": True}
+        except Exception as e:
+            return {"error": str(e), "called": True}
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        return dict(zip(groups, pool.map(generate, groups)))
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# CLI
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Personalize training for every teacher in a cluster")
+    parser.add_argument("--cluster", required=True)
+    parser.add_argument("--module-id", default="", help="Use one base module for all groups")
+    parser.add_argument("--max-gaps", type=int, default=2, help="Competency areas per group signature")
+    parser.add_argument("--min-score", type=float, default=0.5, help="Minimum area score to count as a gap")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processes for classification")
+    parser.add_argument("--llm-concurrency", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=None, help="Rows per personalized_training insert")
+    parser.add_argument("--dry-run", action="store_true", help="Group only; no LLM calls or writes")
+    args = parser.parse_args()
+
+    if os.getenv("GEMINI_API_KEY"):
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+
+    timings: dict[str, float] = {}
+    started = time.perf_counter()
+
+    stage = time.perf_counter()
+    teachers = db.get_teachers_by_cluster(args.cluster)
+    issues = db.get_cluster_issues(args.cluster)
+    timings["load"] = time.perf_counter() - stage
+
+    stage = time.perf_counter()
+    classified = classify_issues(issues, args.workers)
+    groups = group_teachers(teachers, issues, classified, args.max_gaps, args.min_score)
+    timings["classify+group"] = time.perf_counter() - stage
+
+    print(f"cluster          : {args.cluster}")
+    print(f"teachers / issues: {len(teachers)} / {len(issues)}")
+    print(f"groups           : {len(groups)}")
+    for gaps, group in sorted(groups.items(), key=lambda kv: -len(kv[1]["teachers"])):
+        print(f"  {len(group['teachers']):>5}  {', '.join(gaps)}")
+
+    written = failed = 0
+    llm_calls = 0
+    if not args.dry_run and groups:
+        stage = time.perf_counter()
+        modules = load_base_modules({a for gaps in groups for a in gaps}, args.module_id)
+        generated = generate_group_modules(groups, modules, args.llm_concurrency)
+        llm_calls = sum(1 for g in generated.values() if g["called"])
+        timings["generate"] = time.perf_counter() - stage
+
+        stage = time.perf_counter()
+        now = datetime.now(timezone.utc).isoformat()
+        assignments = []
+        for gaps, result in generated.items():
+            if "error" in result:
+                print(f"[WARN] group {', '.join(gaps)} skipped: {result['error']}")
+                continue
+            metadata = {
+                "competency_gaps": list(gaps),
+                "group_size": len(groups[gaps]["teachers"]),
+                "cluster": args.cluster,
+                "model": MODEL_NAME,
+                "generated_at": now,
+                "batch": True,
+            }
+            for teacher in groups[gaps]["teachers"]:
+                assignments.append({
+                    "teacher_id": teacher["id"],
+                    "module_id": result["module"]["id"],
+                    "personalized_content": result["content"],
+                    "metadata": metadata,
+                })
+        result = db.save_personalized_trainings(assignments, batch_size=args.batch_size)
+        written, failed = result["written"], len(result["failed"])
+        timings["write"] = time.perf_counter() - stage
+
+    total = time.perf_counter() - started
+    print(f"llm calls        : {llm_calls}")
+    print(f"rows written     : {written} ({failed} failed)")
+    for name, seconds in timings.items():
+        print(f"  {name:<15}: {seconds:.2f}s")
+    print(f"total            : {total:.2f}s")
+    print(f"throughput       : {len(teachers) / total if total else 0:,.1f} teachers/s, "
+          f"{len(issues) / total if total else 0:,.1f} issues/s")
+    if failed:
+        print(json.dumps(result["failed"][:5], default=str, indent=2))
+
+
+if __name__ == "__main__":
+    main()
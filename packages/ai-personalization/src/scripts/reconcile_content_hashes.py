@@ -0,0 +1,120 @@
+"""
+Reconcile content_index with what RAGFlow actually holds.
+
+For each dataset:
+  1. lists every document (paged list_documents);
+  2. drops document_hashes rows whose document no longer exists;
+  3. downloads each document without a hash, computes its SHA-256 and records
+     it (--workers downloads at a time);
+  4. reports documents with identical content; --delete-duplicates removes
+     all but the first one indexed.
+
+Run from src/:
+    python -m scripts.reconcile_content_hashes --dataset-name gurusikshan-ncert [--dry-run]
+    python -m scripts.reconcile_content_hashes --all
+"""
+import argparse
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import content_index
+import ragflow_client as rf
+
+PAGE_SIZE = 100
+
+
+def _all_pages(fetch):
+    page, items = 1, []
+    while True:
+        batch = fetch(page)
+        items.extend(batch)
+        if len(batch) < PAGE_SIZE:
+            return items
+        page += 1
+
+
+def _hash_document(dataset_id: str, document_id: str) -> str:
+    digest = hashlib.sha256()
+    for block in rf.download_document(dataset_id, document_id):
+        digest.update(block)
+    return digest.hexdigest()
+
+
+def reconcile(dataset_id: str, workers: int, dry_run: bool, delete_duplicates: bool) -> dict:
+    docs = _all_pages(lambda page: rf.list_documents(dataset_id, page=page, page_size=PAGE_SIZE))
+    doc_ids = {str(d.get("id")) for d in docs if d.get("id")}
+    indexed = content_index.entries(dataset_id)
+    indexed_ids = {row["document_id"] for row in indexed.values()}
+
+    stale = sorted(indexed_ids - doc_ids)
+    if stale and not dry_run:
+        content_index.forget_documents(dataset_id, stale)
+
+    todo = [d for d in docs if d.get("id") and str(d["id"]) not in indexed_ids]
+    report = {"dataset_id": dataset_id, "documents": len(docs), "indexed": len(indexed_ids & doc_ids),
+              "stale_removed": len(stale), "backfilled": 0, "duplicates": [], "failed": []}
+    if dry_run:
+        report["backfilled"] = f"{len(todo)} to hash"
+        return report
+
+    def work(doc):
+        try:
+            return doc, _hash_document(dataset_id, str(doc["id"])), None
+        except Exception as e:
+            return doc, None, str(e)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for doc, sha256, error in pool.map(work, todo):
+            if error:
+                report["failed"].append({"document_id": doc["id"], "error": error})
+                continue
+            owner = content_index.claim(dataset_id, sha256, str(doc["id"]), doc.get("name") or "", doc.get("size") or 0)
+            if owner == str(doc["id"]):
+                report["backfilled"] += 1
+            else:
+                report["duplicates"].append({"document_id": doc["id"], "name": doc.get("name"), "same_as": owner})
+
+    if delete_duplicates and report["duplicates"]:
+        rf.delete_documents(dataset_id, [d["document_id"] for d in report["duplicates"]])
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill and clean document_hashes from RAGFlow")
+    parser.add_argument("--dataset-id", action="append", default=[])
+    parser.add_argument("--dataset-name", action="append", default=[])
+    parser.add_argument("--all", action="store_true", help="Every dataset visible to the API key")
+    parser.add_argument("--workers", type=int, default=4, help="Parallel downloads")
+    parser.add_argument("--dry-run", action="store_true", help="Report only; no downloads or writes")
+    parser.add_argument("--delete-duplicates", action="store_true", help="Delete documents whose content is already indexed")
+    args = parser.parse_args()
+
+    dataset_ids = list(args.dataset_id)
+    for name in args.dataset_name:
+        matches = [d for d in rf.list_datasets(name=name) if d.get("name") == name]
+        if not matches:
+            raise SystemExit(f"dataset {name!r} not found")
+        dataset_ids.append(matches[0]["id"])
+    if args.all:
+        dataset_ids += [d["id"] for d in _all_pages(lambda page: rf.list_datasets(page=page, page_size=PAGE_SIZE))]
+    if not dataset_ids:
+        raise SystemExit("pass --dataset-id, --dataset-name or --all")
+
+    for dataset_id in dict.fromkeys(dataset_ids):
+        started = time.perf_counter()
+        report = reconcile(dataset_id, args.workers, args.dry_run, args.delete_duplicates)
+        print(f"dataset          : {dataset_id}")
+        print(f"documents        : {report['documents']} ({report['indexed']} already indexed)")
+        print(f"stale removed    : {report['stale_removed']}")
+        print(f"backfilled       : {report['backfilled']}")
+        print(f"duplicates       : {len(report['duplicates'])}{' (deleted)' if args.delete_duplicates and report['duplicates'] else ''}")
+        for dup in report["duplicates"][:20]:
+            print(f"  {dup['document_id']} {dup['name'] or ''} = {dup['same_as']}")
+        for failure in report["failed"][:20]:
+            print(f"[WARN] {failure['document_id']}: {failure['error']}")
+        print(f"elapsed          : {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,9 @@ current_dir = Path(__file__).parent
 dotenv_path = current_dir.parent.parent.parent / '.env'
 load_dotenv(dotenv_path=dotenv_path)
 
+# Rows per request for bulk_insert / bulk_upsert
+SUPABASE_BULK_BATCH_SIZE = int(os.getenv("SUPABASE_BULK_BATCH_SIZE", "500"))
+
 
 class SupabaseDB:
     def __init__(self):
@@ -18,6 +21,73 @@ class SupabaseDB:
             raise ValueError("SUPABASE_URL and SUPABASE_KEY_PYTHON must be set in .env file")
         
         self.client: Client = create_client(url, key)
+
+    # ── Bulk writes ──────────────────────────────────────────────────────────
+
+    def _bulk_write(self, table, rows, batch_size=None, on_conflict=None, isolate_failures=True, ignore_duplicates=False):
+        """
+        Write `rows` in chunks of `batch_size`, one request per chunk.
+
+        If a chunk is rejected and isolate_failures is set, its rows are retried
+        one at a time so the good ones still land and only the bad ones are
+        reported. With ignore_duplicates an upsert leaves existing rows untouched
+        (INSERT … ON CONFLICT DO NOTHING). Returns:
+            {"written": int, "batches": int, "data": [returned rows],
+             "failed": [{"index": i, "row": row, "error": str}]}
+        """
+        rows = list(rows)
+        batch_size = max(1, batch_size or SUPABASE_BULK_BATCH_SIZE)
+        result = {"written": 0, "batches": 0, "data": [], "failed": []}
+
+        def write(chunk):
+            query = self.client.table(table)
+            if on_conflict is None:
+                query = query.insert(chunk)
+            elif on_conflict:
+                query = query.upsert(chunk, on_conflict=on_conflict, ignore_duplicates=ignore_duplicates)
+            else:
+                query = query.upsert(chunk, ignore_duplicates=ignore_duplicates)
+            return query.execute().data or []
+
+        for start in range(0, len(rows), batch_size):
+            chunk = rows[start:start + batch_size]
+            result["batches"] += 1
+            try:
+                result["data"].extend(write(chunk))
+                result["written"] += len(chunk)
+                continue
+            except Exception as e:
+                if not isolate_failures or len(chunk) == 1:
+                    result["failed"].extend(
+                        {"index": start + i, "row": row, "error": str(e)} for i, row in enumerate(chunk)
+                    )
+                    continue
+                print(f"Bulk write to {table} rejected a batch of {len(chunk)}, retrying row by row: {e}")
+
+            for i, row in enumerate(chunk):
+                try:
+                    result["data"].extend(write([row]))
+                    result["written"] += 1
+                except Exception as e:
+                    result["failed"].append({"index": start + i, "row": row, "error": str(e)})
+
+        if result["failed"]:
+            print(f"Bulk write to {table}: {result['written']} written, {len(result['failed'])} failed")
+        return result
+
+    def bulk_insert(self, table, rows, batch_size=None, isolate_failures=True):
+        """Insert many rows with one request per batch (see _bulk_write for the result shape)."""
+        return self._bulk_write(table, rows, batch_size=batch_size, isolate_failures=isolate_failures)
+
+    def bulk_upsert(self, table, rows, on_conflict="", batch_size=None, isolate_failures=True, ignore_duplicates=False):
+        """
+        Upsert many rows with one request per batch; on_conflict names the unique
+        columns. ignore_duplicates keeps the stored row instead of overwriting it.
+        """
+        return self._bulk_write(
+            table, rows, batch_size=batch_size, on_conflict=on_conflict,
+            isolate_failures=isolate_failures, ignore_duplicates=ignore_duplicates,
+        )
     
     def get_teachers_by_cluster(self, cluster_id):
         """Fetch all teachers in a cluster using 'cluster' column"""
@@ -88,6 +158,81 @@ class SupabaseDB:
             print(f"Error saving personalized training: {e}")
             return None
     
+    def save_personalized_trainings(self, assignments, batch_size=None):
+        """
+        Save many personalized training assignments (e.g. a whole cluster) in
+        batched inserts. Each assignment is a dict with teacher_id, module_id,
+        personalized_content and metadata. Returns the bulk_insert result.
+        """
+        rows = [
+            {
+                'teacher_id': a['teacher_id'],
+                'module_id': a['module_id'],
+                'personalized_content': a['personalized_content'],
+                'adaptation_metadata': a.get('metadata'),
+                'status': 'assigned',
+                'completion_percentage': 0
+            }
+            for a in assignments
+        ]
+        return self.bulk_insert('personalized_training', rows, batch_size=batch_size)
+    
+    def get_document_hashes(self, dataset_id, page_size=1000):
+        """All document_hashes rows for a RAGFlow dataset (None if the table could not be read)."""
+        try:
+            rows, start = [], 0
+            while True:
+                response = self.client.table('document_hashes')\
+                    .select('*')\
+                    .eq('dataset_id', dataset_id)\
+                    .range(start, start + page_size - 1)\
+                    .execute()
+                batch = response.data or []
+                rows.extend(batch)
+                if len(batch) < page_size:
+                    return rows
+                start += page_size
+        except Exception as e:
+            print(f"Error loading document hashes: {e}")
+            return None
+
+    def get_document_hash(self, dataset_id, sha256):
+        """The document_hashes row for one content hash in a dataset (None if absent or unreadable)."""
+        try:
+            response = self.client.table('document_hashes')\
+                .select('*')\
+                .eq('dataset_id', dataset_id)\
+                .eq('sha256', sha256)\
+                .execute()
+            return response.data[0] if response.data else None
+        except Exception as e:
+            print(f"Error loading document hash: {e}")
+            return None
+
+    def delete_document_hashes(self, dataset_id, document_ids=None):
+        """Remove hash rows for some documents of a dataset, or for the whole dataset."""
+        try:
+            query = self.client.table('document_hashes').delete().eq('dataset_id', dataset_id)
+            if document_ids is not None:
+                query = query.in_('document_id', list(document_ids))
+            query.execute()
+            return True
+        except Exception as e:
+            print(f"Error deleting document hashes: {e}")
+            return False
+
+    def get_upload_transaction(self, idempotency_key):
+        """Stored upload-and-parse transaction for an idempotency key, if any."""
+        try:
+            response = self.client.table('upload_transactions')\
+                .select('*')\
+                .eq('idempotency_key', idempotency_key)\
+                .execute()
+            return response.data[0] if response.data else None
+        except Exception as e:
+            print(f"Error loading upload transaction: {e}")
+            return None
+
     # Backward compatibility alias 
     def get_feedback_by_id(self, feedback_id: str):
         """
@@ -133,13 +278,11 @@ class SupabaseDB:
                     {'issue_keyword': 'interest', 'competency_area': 'student_engagement', 'confidence_score': 0.80},
                 ]
                 
-                for mapping in default_mappings:
-                    try:
-                        self.client.table('issue_competency_mapping').insert(mapping).execute()
-                    except Exception as e:
-                        print(f"Error inserting mapping {mapping['issue_keyword']}: {e}")
+                result = self.bulk_insert('issue_competency_mapping', default_mappings)
+                for failure in result['failed']:
+                    print(f"Error inserting mapping {failure['row']['issue_keyword']}: {failure['error']}")
                 
-                print(f"✓ Initialized {len(default_mappings)} default mappings")
+                print(f"✓ Initialized {result['written']} default mappings")
             else:
                 print(f"✓ Database already has {existing.count} mappings")
         except Exception as e:
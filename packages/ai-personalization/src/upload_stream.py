@@ -0,0 +1,304 @@
+"""
+upload_stream.py — pass-through document uploads
+
+The upload routes used to let Flask parse the multipart body (spooling it to
+a temp file), copy it into a second NamedTemporaryFile, and re-read that file
+into a new multipart request to RAGFlow. Every byte went to disk twice and
+the browser's Content-Type was thrown away for a hard-coded application/pdf.
+
+MultipartUpload reads the incoming body straight off the WSGI stream with
+werkzeug's sans-IO MultipartDecoder. Form fields that come *before* the file
+part are collected into .fields; a field the route reads (leading_fields)
+that turns up after the file raises LateFieldError. The file itself is exposed as .chunks(), a
+generator of UPLOAD_CHUNK_BYTES blocks that ragflow_client.upload_document_stream
+wraps in the outgoing multipart body. Memory stays at about one chunk per
+upload whatever the file size, and nothing is written to disk.
+
+detect_mime() sniffs the first bytes and falls back to the file extension.
+UploadMeter times each transfer, and upload_stats() aggregates throughput
+for /metrics.
+"""
+import os
+import time
+import mimetypes
+import threading
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, Optional
+
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+UPLOAD_CHUNK_BYTES     = int(os.getenv("RAGFLOW_UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+UPLOAD_FIELD_MAX_BYTES = int(os.getenv("RAGFLOW_UPLOAD_FIELD_MAX_BYTES", str(64 * 1024)))
+
+DEFAULT_MIME = "application/octet-stream"
+
+# leading bytes -> MIME type; None means "container format, decide by extension"
+_MAGIC = (
+    (b"%PDF-", "application/pdf"),
+    (b"PK\x03\x04", None),                                    # zip: docx/xlsx/pptx/odt/epub/zip
+    (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", None),              # OLE2: doc/xls/ppt
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+    (b"{\\rtf", "application/rtf"),
+)
+_CONTAINER_DEFAULT = {b"PK\x03\x04": "application/zip", b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1": DEFAULT_MIME}
+_ZIP_BASED = {".docx", ".xlsx", ".pptx", ".odt", ".ods", ".odp", ".epub", ".zip"}
+_OLE_BASED = {".doc", ".xls", ".ppt", ".msg"}
+_EXTRA_TYPES = {".md": "text/markdown", ".epub": "application/epub+zip", ".msg": "application/vnd.ms-outlook"}
+
+
+def _guess_from_name(filename: str) -> Optional[str]:
+    ext = os.path.splitext(filename or "")[1].lower()
+    return _EXTRA_TYPES.get(ext) or mimetypes.guess_type(f"x{ext}")[0]
+
+
+def detect_mime(filename: str, head: bytes) -> str:
+    """
+    MIME type for an upload from its first bytes, falling back to the
+    extension. Content wins when the two disagree (a .pdf that is really a
+    .docx is sent as a .docx); container formats (zip, OLE2) and text are
+    refined by the extension.
+    """
+    ext = os.path.splitext(filename or "")[1].lower()
+    for magic, mime in _MAGIC:
+        if not head.startswith(magic):
+            continue
+        if mime:
+            return mime
+        family = _ZIP_BASED if magic == b"PK\x03\x04" else _OLE_BASED
+        if ext in family:
+            return _guess_from_name(filename) or _CONTAINER_DEFAULT[magic]
+        return _CONTAINER_DEFAULT[magic]
+
+    if head and b"\x00" not in head:
+        try:
+            head.decode("utf-8")
+        except UnicodeDecodeError as e:
+            # a multi-byte character cut off by the end of the chunk is still text
+            is_text = e.start >= len(head) - 3
+        else:
+            is_text = True
+        if is_text:
+            guessed = _guess_from_name(filename)
+            return guessed if guessed and (guessed.startswith("text/") or guessed.endswith(("json", "xml"))) else "text/plain"
+
+    return _guess_from_name(filename) or DEFAULT_MIME
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Incoming multipart
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+class LateFieldError(ValueError):
+    """A field that has to precede the file part was sent after it."""
+
+
+class MultipartUpload:
+    """
+    One file part read lazily from a multipart/form-data request body.
+
+    Construction consumes the body up to the start of `file_field` (raising
+    ValueError if it is missing). .chunks() then yields the file contents.
+    Fields after the file are added to .fields once the chunks have been
+    drained, so pass anything needed before the upload (dataset_id …) ahead
+    of the file or in the query string. Any of `leading_fields` found after
+    the file raises LateFieldError from .chunks() before the generator
+    finishes, which aborts a streamed upload before RAGFlow sees a complete
+    body. Call .finish() when the chunks may not have been read at all.
+    """
+
+    def __init__(
+        self,
+        stream: BinaryIO,
+        content_type: str,
+        file_field: str = "file",
+        chunk_size: int = UPLOAD_CHUNK_BYTES,
+        leading_fields: Iterable[str] = (),
+    ):
+        mimetype, options = parse_options_header(content_type or "")
+        if mimetype != "multipart/form-data" or not options.get("boundary"):
+            raise ValueError("multipart/form-data body required")
+        self._stream = stream
+        self._chunk_size = chunk_size
+        # the decoder refuses to buffer more than max_form_memory_size at once,
+        # so feed it in reads well below that and re-block the file data ourselves
+        self._read_size = max(1024, min(chunk_size, UPLOAD_FIELD_MAX_BYTES // 2))
+        self._decoder = MultipartDecoder(options["boundary"].encode("latin-1"), max_form_memory_size=UPLOAD_FIELD_MAX_BYTES)
+        self._eof = False
+        self._consumed = False
+        self.file_field = file_field
+        self.leading_fields = frozenset(leading_fields)
+        self.fields: Dict[str, str] = {}
+        self.filename: Optional[str] = None
+        self.content_type: Optional[str] = None   # as declared by the client
+        self.size = 0
+        self._field: Optional[str] = None
+        self._value = bytearray()
+
+        for event in self._events():
+            if isinstance(event, File) and event.name == file_field:
+                self.filename = event.filename or ""
+                self.content_type = event.headers.get("Content-Type")
+                return
+            self._absorb(event)
+        raise ValueError(f"{file_field} required")
+
+    def _events(self) -> Iterator[Any]:
+        while True:
+            event = self._decoder.next_event()
+            if isinstance(event, NeedData):
+                if self._eof:
+                    raise ValueError("truncated multipart body")
+                data = self._stream.read(self._read_size)
+                self._eof = not data
+                self._decoder.receive_data(data or None)
+                continue
+            if isinstance(event, Epilogue):
+                return
+            yield event
+
+    def _absorb(self, event: Any) -> None:
+        """Collect a form field (other file parts are skipped)."""
+        if isinstance(event, Field):
+            self._field, self._value = event.name, bytearray()
+        elif isinstance(event, File):
+            self._field = None
+        elif isinstance(event, Data) and self._field is not None:
+            self._value += event.data
+            if len(self._value) > UPLOAD_FIELD_MAX_BYTES:
+                raise ValueError(f"form field {self._field!r} is larger than {UPLOAD_FIELD_MAX_BYTES} bytes")
+            if not event.more_data:
+                self.fields[self._field] = self._value.decode("utf-8", "replace")
+
+    def chunks(self) -> Iterator[bytes]:
+        """Yield the file part in blocks of `chunk_size` bytes (the last may be shorter)."""
+        if self._consumed:
+            raise RuntimeError("upload stream already consumed")
+        self._consumed = True
+        self._field = None
+        buf = bytearray()
+        events = self._events()
+        for event in events:
+            if not isinstance(event, Data):
+                raise ValueError("malformed multipart body")
+            buf += event.data
+            self.size += len(event.data)
+            while len(buf) >= self._chunk_size:
+                yield bytes(buf[:self._chunk_size])
+                del buf[:self._chunk_size]
+            if not event.more_data:
+                break
+        if buf:
+            yield bytes(buf)
+        for event in events:
+            if isinstance(event, Field) and event.name in self.leading_fields:
+                raise LateFieldError(f"form field {event.name!r} must be sent before the file part or in the query string")
+            self._absorb(event)
+
+    def finish(self) -> None:
+        """Read whatever is left of the body, so fields after the file are seen (and checked)."""
+        if not self._consumed:
+            for _ in self.chunks():
+                pass
+
+
+def iter_file(f: BinaryIO, chunk_size: int = UPLOAD_CHUNK_BYTES) -> Iterator[bytes]:
+    """Read an open file in fixed-size blocks."""
+    while True:
+        block = f.read(chunk_size)
+        if not block:
+            return
+        yield block
+
+
+def hashing(chunks: Iterable[bytes], digest: Any) -> Iterator[bytes]:
+    """Pass chunks through unchanged while feeding them to a hashlib digest."""
+    for chunk in chunks:
+        digest.update(chunk)
+        yield chunk
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Outgoing multipart
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+def _quote(value: str) -> str:
+    # HTML5-style escaping, the same urllib3 uses for requests' files=
+    return value.replace("\\", "\\\\").replace('"', "%22").replace("\r", "%0D").replace("\n", "%0A")
+
+
+def multipart_body(
+    boundary: str,
+    field: str,
+    filename: str,
+    content_type: str,
+    chunks: Iterable[bytes],
+    meter: Optional["UploadMeter"] = None,
+) -> Iterator[bytes]:
+    """A single-file multipart/form-data body, generated chunk by chunk."""
+    yield (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{_quote(field)}"; filename="{_quote(filename)}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode("utf-8")
+    for chunk in chunks:
+        if meter is not None:
+            meter.add(len(chunk))
+        yield chunk
+    yield f"\r\n--{boundary}--\r\n".encode("ascii")
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Throughput
+# ─────────────────────────────────────────────────────────────────────────────
+
+_stats_lock = threading.Lock()
+_stats = {"uploads": 0, "failed": 0, "bytes": 0, "seconds": 0.0}
+
+
+class UploadMeter:
+    """Bytes and wall time of one upload, from first byte to RAGFlow's response."""
+
+    def __init__(self, content_type: str):
+        self.content_type = content_type
+        self.bytes = 0
+        self._start = time.perf_counter()
+        self._seconds: Optional[float] = None
+
+    def add(self, n: int) -> None:
+        self.bytes += n
+
+    def finish(self, ok: bool = True) -> Dict[str, Any]:
+        self._seconds = time.perf_counter() - self._start
+        with _stats_lock:
+            if ok:
+                _stats["uploads"] += 1
+                _stats["bytes"] += self.bytes
+                _stats["seconds"] += self._seconds
+            else:
+                _stats["failed"] += 1
+        return self.report()
+
+    def report(self) -> Dict[str, Any]:
+        seconds = self._seconds if self._seconds is not None else time.perf_counter() - self._start
+        return {
+            "bytes": self.bytes,
+            "seconds": round(seconds, 3),
+            "mb_per_s": round(self.bytes / seconds / 1e6, 2) if seconds > 0 else None,
+            "content_type": self.content_type,
+        }
+
+
+def upload_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["seconds"] = round(stats["seconds"], 3)
+    stats["avg_mb_per_s"] = round(stats["bytes"] / stats["seconds"] / 1e6, 2) if stats["seconds"] else None
+    stats["chunk_bytes"] = UPLOAD_CHUNK_BYTES
+    return stats
@@ -0,0 +1,378 @@
+"""
+upload_transactions.py — idempotent upload-and-parse
+
+/api/ragflow/documents/upload-and-parse did upload → parse_documents with no
+memory between requests. If parsing failed, the document was left behind
+unparsed, and the client's retry uploaded the whole file again. Each call
+is now a transaction keyed by an idempotency key (Idempotency-Key header;
+without one a random key is used and the call cannot be resumed):
+
+    uploading → uploaded → parse_requested → parsed
+                  │  ↑            │
+                  └──┴─ failed ←──┘          (duplicate: content already held)
+
+A retry with the same key picks up where the last attempt stopped:
+  * parse_requested / parsed / duplicate — the stored result is replayed,
+    and the request body is not read;
+  * uploaded — the document is already in RAGFlow, so only parse_documents
+    is retried;
+  * failed / uploading (a crashed attempt) — starts again from the upload,
+    after deleting any document the earlier attempt left behind.
+resume() does the first two without a file at all, so a client can retry
+with just the key (POST /documents/upload-and-parse/<key>).
+
+A parse that fails, either the parse_documents call or RAGFlow reporting the
+document as failed through parse_tracker, may be retried
+UPLOAD_TXN_MAX_PARSE_ATTEMPTS times. After that, or when there is no key to
+retry with, the transaction is compensated: documents it created are
+removed with delete_documents (a duplicate's existing document is never
+touched) and the state becomes failed. Keyed transactions left in
+"uploaded" for UPLOAD_TXN_ABANDON_SEC are compensated the same way.
+
+State is kept in memory and written through to the Supabase
+upload_transactions table (unique on idempotency_key), so a retry that
+lands on another worker or after a restart still resumes; a parse_requested
+row loaded that way is handed to parse_tracker again. Two requests running
+the same key at the same moment are only refused within one process (the
+in-progress set is not shared), so clients should not race their own
+retries across workers.
+"""
+import os
+import time
+import uuid
+import functools
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Optional
+
+import content_index
+import parse_tracker
+import ragflow_client as rf
+from supabase_client import db
+
+UPLOAD_TXN_MAX_PARSE_ATTEMPTS = int(os.getenv("UPLOAD_TXN_MAX_PARSE_ATTEMPTS", "3"))
+UPLOAD_TXN_ABANDON_SEC        = float(os.getenv("UPLOAD_TXN_ABANDON_SEC", "3600"))
+UPLOAD_TXN_TTL_SEC            = float(os.getenv("UPLOAD_TXN_TTL_SEC", "86400"))
+
+_REPLAY = frozenset({"parse_requested", "parsed", "duplicate"})
+_SWEEP_EVERY_SEC = 60.0
+
+_lock = threading.Lock()
+_txns: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_busy: set = set()
+_last_sweep = 0.0
+_stats = {"started": 0, "replayed": 0, "resumed": 0, "compensated": 0, "orphans_deleted": 0}
+
+
+class TransactionError(Exception):
+    """A step failed or the key is unusable; `status` is the HTTP code to answer with."""
+
+    def __init__(self, message: str, status: int, transaction: Optional[Dict[str, Any]] = None):
+        super().__init__(message)
+        self.status = status
+        self.transaction = _public(transaction)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _public(row: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    return {k: v for k, v in row.items() if not k.startswith("_")} if row else None
+
+
+def _persist(row: Dict[str, Any]) -> None:
+    if not row["_keyed"]:
+        return
+    result = db.bulk_upsert("upload_transactions", [_public(row)], on_conflict="idempotency_key")
+    for failure in result["failed"]:
+        print(f"[WARN] upload_transactions upsert failed for {row['idempotency_key']}: {failure['error']}")
+
+
+def _load(key: str) -> Optional[Dict[str, Any]]:
+    # caller holds _lock
+    row = _txns.get(key)
+    if row is None:
+        stored = db.get_upload_transaction(key)
+        if stored:
+            row = _txns[key] = {
+                **stored,
+                "_keyed": True,
+                "_touched": time.monotonic(),
+                # its parse_tracker watch died with the process that started it
+                "_untracked": stored.get("state") == "parse_requested",
+            }
+    return row
+
+
+def _follow(row: Optional[Dict[str, Any]]) -> None:
+    """Track a parse_requested row loaded from Supabase again (caller must not hold _lock)."""
+    if not (row and row.get("_untracked")):
+        return
+    row["_untracked"] = False
+    parse_tracker.track(
+        row["dataset_id"], row["document_ids"], callback=functools.partial(_parse_finished, row["idempotency_key"])
+    )
+
+
+def _update(key: str, **changes: Any) -> Dict[str, Any]:
+    with _lock:
+        row = _txns[key]
+        row.update(changes, updated_at=_now(), _touched=time.monotonic())
+        snapshot = dict(row)
+    _persist(snapshot)
+    return snapshot
+
+
+def get(key: str) -> Optional[Dict[str, Any]]:
+    """Current state of a transaction (None if the key is unknown)."""
+    with _lock:
+        row = _load(key)
+    _follow(row)
+    return _public(row)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Steps
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+def _begin(key: str, keyed: bool, dataset_id: str, file_name: str, resume_only: bool = False) -> tuple:
+    """
+    Claim the key for this request and decide where to start: replay, parse or
+    upload. With resume_only, a transaction that needs its file again is left
+    alone and (row, "upload") comes back without claiming anything.
+    """
+    with _lock:
+        if key in _busy:
+            raise TransactionError("a request with this idempotency key is already in progress", 409, _txns.get(key))
+        row = _load(key) if keyed else None
+        if row and dataset_id and row["dataset_id"] != dataset_id:
+            raise TransactionError("idempotency key was used for a different dataset", 409, row)
+        if row and row["state"] in _REPLAY:
+            _stats["replayed"] += 1
+            return row, "replay"
+        if resume_only and not (row and row["state"] == "uploaded"):
+            return row, "upload"
+        _busy.add(key)
+        if row and row["state"] == "uploaded":
+            _stats["resumed"] += 1
+            return row, "parse"
+        leftover = dict(row) if row and row["owned"] and row["document_ids"] else None
+
+    if leftover:
+        # an earlier attempt's documents whose cleanup failed: remove them before uploading again
+        try:
+            rf.delete_documents(leftover["dataset_id"], leftover["document_ids"])
+        except Exception as e:
+            with _lock:
+                _busy.discard(key)
+            raise TransactionError(
+                f"documents left by the previous attempt could not be removed, retry later: {e}", 502, leftover
+            )
+        content_index.forget_documents(leftover["dataset_id"], leftover["document_ids"])
+
+    now = _now()
+    with _lock:
+        if leftover:
+            _stats["orphans_deleted"] += len(leftover["document_ids"])
+        row = _txns[key] = {
+            "idempotency_key": key,
+            "dataset_id": dataset_id,
+            "file_name": file_name,
+            "state": "uploading",
+            "document_ids": [],
+            "owned": False,
+            "duplicate": False,
+            "declared_hash": False,
+            "sha256": None,
+            "upload_result": None,
+            "upload_stats": None,
+            "parse_result": None,
+            "parse_attempts": 0,
+            "failed_step": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+            "_keyed": keyed,
+            "_touched": time.monotonic(),
+        }
+        _stats["started"] += 1
+    _persist(row)
+    return row, "upload"
+
+
+def _compensate(key: str, reason: str) -> Dict[str, Any]:
+    """Undo a transaction: delete the documents it created and mark it failed."""
+    with _lock:
+        row = dict(_txns[key])
+    cleaned = {"document_ids": [], "owned": False}
+    if row["owned"] and row["document_ids"]:
+        try:
+            rf.delete_documents(row["dataset_id"], row["document_ids"])
+            content_index.forget_documents(row["dataset_id"], row["document_ids"])
+            with _lock:
+                _stats["orphans_deleted"] += len(row["document_ids"])
+        except Exception as e:
+            # keep the ids on the failed row so the orphans can still be found
+            print(f"[WARN] could not delete orphaned documents {row['document_ids']}: {e}")
+            reason = f"{reason}; cleanup failed: {e}"
+            cleaned = {}
+    with _lock:
+        _stats["compensated"] += 1
+    return _update(key, state="failed", error=reason, **cleaned)
+
+
+def _parse_failed(key: str, error: str) -> Dict[str, Any]:
+    with _lock:
+        row = _txns[key]
+        attempts = row["parse_attempts"] + 1
+        retryable = row["_keyed"] and attempts < UPLOAD_TXN_MAX_PARSE_ATTEMPTS
+    if not retryable:
+        _update(key, parse_attempts=attempts, failed_step="parse")
+        return _compensate(key, f"parse failed: {error}")
+    return _update(key, state="uploaded", parse_attempts=attempts, failed_step="parse", error=error)
+
+
+def _parse_finished(key: str, summary: Dict[str, Any]) -> None:
+    """parse_tracker callback: parsed, or a failed parse that counts as an attempt."""
+    with _lock:
+        row = _txns.get(key)
+        if row is None or row["state"] != "parse_requested":
+            return
+    if summary["failed"] == 0:
+        _update(key, state="parsed", failed_step=None, error=None)
+        return
+    bad = [d for d in summary["documents"] if d["status"] != "done"]
+    _parse_failed(key, "; ".join(f"{d['document_id']}: {d['status']} {d.get('message') or ''}".strip() for d in bad))
+
+
+def run(
+    dataset_id: str,
+    file_name: str,
+    chunks: Iterable[bytes],
+    key: str = "",
+    sha256: str = "",
+    webhook: str = "",
+) -> Dict[str, Any]:
+    """
+    Upload a document and request parsing as one idempotent transaction.
+    `chunks` is only consumed when the upload step actually runs. Returns the
+    transaction (with "replayed" for a stored result); raises TransactionError.
+    """
+    keyed = bool(key)
+    key = key or f"auto-{uuid.uuid4().hex}"
+    _sweep()
+    row, step = _begin(key, keyed, dataset_id, file_name)
+    _follow(row)
+    if step == "replay":
+        return {**_public(row), "replayed": True}
+    return _advance(key, row, step, chunks, sha256, webhook)
+
+
+def resume(key: str, dataset_id: str = "", webhook: str = "") -> Optional[Dict[str, Any]]:
+    """
+    Replay or finish a keyed transaction without its file. Returns None when
+    the key is unknown or the upload itself has to run again (re-send the
+    file to run()); raises TransactionError like run().
+    """
+    _sweep()
+    row, step = _begin(key, True, dataset_id, "", resume_only=True)
+    _follow(row)
+    if step == "replay":
+        return {**_public(row), "replayed": True}
+    if step == "upload":
+        return None
+    return _advance(key, row, step, (), "", webhook)
+
+
+def _advance(key: str, row: Dict[str, Any], step: str, chunks: Iterable[bytes], sha256: str, webhook: str) -> Dict[str, Any]:
+    """Run the upload (if `step` is "upload") and parse steps of a claimed transaction."""
+    dataset_id = row["dataset_id"]
+    try:
+        if step == "upload":
+            try:
+                outcome = content_index.upload(dataset_id, row["file_name"], chunks, sha256=sha256)
+            except Exception as e:
+                # ValueError: the request body itself was bad (truncated, fields out of order)
+                status = 400 if isinstance(e, ValueError) else 502
+                raise TransactionError(f"upload failed: {e}", status, _update(key, state="failed", failed_step="upload", error=str(e)))
+            row = _update(
+                key,
+                state="duplicate" if outcome["duplicate"] else "uploaded",
+                document_ids=outcome["document_ids"],
+                owned=not outcome["duplicate"],
+                duplicate=outcome["duplicate"],
+                declared_hash=outcome["declared_hash"],
+                sha256=outcome["sha256"],
+                upload_result=outcome["result"],
+                upload_stats=outcome["upload_stats"],
+            )
+            if outcome["duplicate"]:
+                return {**_public(row), "replayed": False}
+            if not outcome["document_ids"]:
+                raise TransactionError("upload returned no document id", 502, _compensate(key, "upload returned no document id"))
+
+        try:
+            parse_result = rf.parse_documents(dataset_id, row["document_ids"])
+        except Exception as e:
+            row = _parse_failed(key, f"parse_documents: {e}")
+            retry = " (retry with the same Idempotency-Key to resume)" if row["state"] == "uploaded" else ""
+            raise TransactionError(f"parse failed: {e}{retry}", 502, row)
+
+        row = _update(key, state="parse_requested", parse_result=parse_result, failed_step=None, error=None)
+        parse_tracker.track(dataset_id, row["document_ids"], callback=functools.partial(_parse_finished, key), webhook=webhook)
+        return {**_public(row), "replayed": False}
+    finally:
+        with _lock:
+            _busy.discard(key)
+
+
+def abort(key: str, reason: str) -> Dict[str, Any]:
+    """
+    Roll back a transaction that run() completed but the request turned out to
+    be invalid (e.g. a field that changes its meaning arrived after the file):
+    its documents are deleted and the state becomes failed.
+    """
+    with _lock:
+        if key not in _txns:
+            raise KeyError(key)
+    return _public(_compensate(key, reason))
+
+
+def _sweep() -> None:
+    """Compensate abandoned transactions and forget old finished ones (at most once a minute)."""
+    global _last_sweep
+    now = time.monotonic()
+    with _lock:
+        if now - _last_sweep < _SWEEP_EVERY_SEC:
+            return
+        _last_sweep = now
+        abandoned = [
+            k for k, r in _txns.items()
+            if r["state"] == "uploaded" and k not in _busy and now - r["_touched"] > UPLOAD_TXN_ABANDON_SEC
+        ]
+        expired = [
+            k for k, r in _txns.items()
+            if r["state"] in ("parsed", "failed", "duplicate", "uploading")
+            and k not in _busy and now - r["_touched"] > UPLOAD_TXN_TTL_SEC
+        ]
+        for k in expired:
+            del _txns[k]
+        # claimed like a request would, so a retry arriving mid-cleanup gets a 409
+        _busy.update(abandoned)
+    try:
+        for k in abandoned:
+            _compensate(k, "abandoned after a failed parse")
+    finally:
+        with _lock:
+            _busy.difference_update(abandoned)
+
+
+def transaction_stats() -> Dict[str, Any]:
+    with _lock:
+        states: Dict[str, int] = {}
+        for row in _txns.values():
+            states[row["state"]] = states.get(row["state"], 0) + 1
+        return {**_stats, "in_progress": len(_busy), "states": states}